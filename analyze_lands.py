@@ -1,77 +1,797 @@
-import pymongo
-import pandas as pd
-import matplotlib.pyplot as plt
+import argparse
+import itertools
+import math
 import re
-from connector import collection
+import pandas as pd
+from pymongo import UpdateOne
+from connector import get_collection
+from sketch import KLLSketch
+
+# Rates used to normalize prices to US dollars
+CURRENCY_RATES = {"$": 1.0, "€": 1.08, "₴": 0.024}
+CURRENCY_SIGNS = {"$": "$", "USD": "$", "€": "€", "EUR": "€", "₴": "₴", "UAH": "₴", "грн": "₴"}
+
+# Thousands separators and units that are stripped before numbers are parsed
+SPACES = (" ", "\xa0", "\u202f", "\u2009")
+SIZE_UNITS = ("м²", "м2", "m²")
+
+# Shapes almost every scraped value has, they skip the general regex parsing
+COMMON_PRICE = r"\$? ?[0-9][0-9 ]* ?\$?"
+COMMON_SIZE = r"[0-9]+ ?м²"
+
+PRICE_CATEGORIES = ["Cheap", "Moderate", "Expensive"]
+
+MIGRATION_BATCH_SIZE = 1000
+
+ANALYSIS_MODES = ("pandas", "pipeline", "stream", "summary", "snapshot")
+
+# Streaming mode reads only these fields, STREAM_CHUNK_SIZE documents at a time
+STREAM_FIELDS = ("_id", "price", "size", "location")
+STREAM_CHUNK_SIZE = 10000
+
+# Thresholds from the streaming sketch are within this rank distance of the exact
+# quantiles (KLLSketch with the default k=200 stays well below it). Location
+# averages are exact up to floating point summation order.
+STREAM_RANK_TOLERANCE = 0.01
+
+# Materialized per-location summary: location_stats holds {_id: location, sum,
+# count, sketch}, analysis_state the global sketch and the updated_at watermark
+LOCATION_STATS = "location_stats"
+ANALYSIS_STATE = "analysis_state"
+STATS_STATE_ID = "location_stats"
+
 
 # Retrieve data from MongoDB
-data = list(collection.find())
-df = pd.DataFrame(data)
+def load_listings(collection):
+    return pd.DataFrame(list(collection.find()))
 
 
-# Ensure price is numeric
-def clean_price(price_str):
-    price_str = price_str.replace(" ", "")  # Remove spaces
-    price_str = price_str.replace("$", "")  # Remove dollar sign
-    return float(price_str)
+def _as_text(values):
+    return values.astype("string[pyarrow]")
 
 
-df["price_numeric"] = df["price"].apply(clean_price)
+def _matches(text, pattern):
+    return text.str.fullmatch(pattern).fillna(False).astype(bool)
 
 
-def extract_total_size(size_str):
-    match = re.match(r"(\d+)", size_str)
-    if match:
-        return float(match.group(1))
-    else:
-        return None
+# Remove literal substrings, tokens that do not occur are not scanned for twice
+def _strip_tokens(text, tokens):
+    for token in tokens:
+        if text.str.contains(token, regex=False).any():
+            text = text.str.replace(token, "", regex=False)
+    return text
 
 
-# Apply the function to extract the total size
-df["size_numeric"] = df["size"].apply(extract_total_size)
+def _to_float(text):
+    return text.where(_matches(text, r"[0-9]+(\.[0-9]+)?")).astype("float64")
+
+
+# General price parser for everything that is not a plain dollar amount
+def _parse_irregular_prices(text):
+    rate = pd.Series(1.0, index=text.index)  # Prices without a currency sign are in dollars
+    for sign, currency in CURRENCY_SIGNS.items():
+        if currency != "$":
+            found = text.str.contains(sign, regex=False).fillna(False).astype(bool)
+            rate = rate.mask(found, CURRENCY_RATES[currency])
+
+    # A separator followed by one or two trailing digits is the decimal point,
+    # every other separator groups thousands
+    digits = _strip_tokens(text, SPACES).str.replace(r"[^0-9.,]", "", regex=True)
+    decimals = digits.str.extract(r"[.,]([0-9]{1,2})$", expand=False)
+    integer = digits.str.replace(r"[.,][0-9]{1,2}$", "", regex=True).str.replace(
+        r"[.,]", "", regex=True
+    )
+    return _to_float(integer + ("." + decimals).fillna("")) * rate
+
+
+# Parse price strings like "12 000 $", "1.250.000 грн" or "9 500,50 €" into dollars
+def parse_prices(prices):
+    text = _as_text(prices)
+    common = _matches(text, COMMON_PRICE)
+    digits = text.str.replace(" ", "", regex=False).str.replace("$", "", regex=False)
+    result = digits.where(common).astype("float64")
+    if not common.all():
+        result = result.mask(~common, _parse_irregular_prices(text[~common]))
+    return result
+
+
+# Parse the total size, the leading number of strings like "1000 м²" or "12,5 м²"
+def parse_sizes(sizes):
+    text = _as_text(sizes)
+    common = _matches(text, COMMON_SIZE)
+    result = text.str.replace("м²", "", regex=False).where(common).str.strip().astype("float64")
+    if not common.all():
+        other = _strip_tokens(text[~common].str.strip(), SIZE_UNITS)
+        number = other.str.extract(r"^\s*([0-9]+(?:[.,][0-9]+)?)", expand=False)
+        result = result.mask(~common, _to_float(number.str.replace(",", ".", regex=False)))
+    return result
+
+
+def clean_listings(df):
+    df = df.copy()
+    df["price_numeric"] = parse_prices(df["price"])
+    df["size_numeric"] = parse_sizes(df["size"])
+
+    # Calculate price per square meter
+    df = df.dropna(subset=["price_numeric", "size_numeric"])
+    df = df[df["size_numeric"] > 0]
+    df["price_per_sqm"] = df["price_numeric"] / df["size_numeric"]
+    return df
 
-# Calculate price per square meter
-df = df.dropna(subset=["price_numeric", "size_numeric"])
-df["price_per_sqm"] = df["price_numeric"] / df["size_numeric"]
 
 # Define thresholds for categorization
-cheap_threshold = df["price_per_sqm"].quantile(0.33)
-expensive_threshold = df["price_per_sqm"].quantile(0.67)
+def compute_thresholds(price_per_sqm):
+    return price_per_sqm.quantile(0.33), price_per_sqm.quantile(0.67)
 
 
-def categorize(price_per_sqm):
-    if price_per_sqm <= cheap_threshold:
-        return "Cheap"
-    elif price_per_sqm <= expensive_threshold:
-        return "Moderate"
+def categorize_prices(price_per_sqm, cheap_threshold, expensive_threshold):
+    if cheap_threshold < expensive_threshold:
+        bins, labels = [cheap_threshold, expensive_threshold], PRICE_CATEGORIES
     else:
-        return "Expensive"
+        # Equal thresholds leave no room for the moderate category
+        bins, labels = [cheap_threshold], ["Cheap", "Expensive"]
+    categories = pd.cut(
+        price_per_sqm, bins=[float("-inf"), *bins, float("inf")], labels=labels, right=True
+    )
+    return categories.cat.set_categories(PRICE_CATEGORIES)
+
+
+def _batches(values, batch_size):
+    for start in range(0, len(values), batch_size):
+        yield values[start : start + batch_size]
 
 
-# Categorize each document
-df["category"] = df["price_per_sqm"].apply(categorize)
+# Update MongoDB with new category field, only for documents whose category changed.
+# Writes are batched UpdateOne bulk writes, or with grouped=True one update_many
+# per category and batch of _ids
+def migrate_categories(collection, df, batch_size=MIGRATION_BATCH_SIZE, grouped=False):
+    changed = df
+    if "previous_category" in df:
+        changed = df[df["category"].ne(df["previous_category"])]
+    total = len(changed)
+    print(f"{total} of {len(df)} categories changed")
 
-# Update MongoDB with new category field
-for index, row in df.iterrows():
-    collection.update_one({"_id": row["_id"]}, {"$set": {"category": row["category"]}})
+    done = 0
+    if grouped:
+        for category, ids in changed.groupby("category")["_id"]:
+            for batch in _batches(ids.tolist(), batch_size):
+                collection.update_many({"_id": {"$in": batch}}, {"$set": {"category": category}})
+                done += len(batch)
+                print(f"Migrated {done}/{total}")
+    else:
+        pairs = list(zip(changed["_id"], changed["category"]))
+        for batch in _batches(pairs, batch_size):
+            operations = [
+                UpdateOne({"_id": _id}, {"$set": {"category": category}})
+                for _id, category in batch
+            ]
+            collection.bulk_write(operations, ordered=False)
+            done += len(batch)
+            print(f"Migrated {done}/{total}")
+
+    print("Migration completed successfully.")
+    return done
 
-print("Migration completed successfully.")
 
 # Calculate average price per square meter for each location
-location_avg_price = df.groupby("location")["price_per_sqm"].mean().reset_index()
-location_avg_price = location_avg_price.sort_values(by="price_per_sqm", ascending=False)
-
-# Identify Top 5 Most Expensive Locations
-top_5_locations = location_avg_price.head(5)
-print(top_5_locations)
-
-# Generate Bar Chart
-plt.figure(figsize=(10, 6))
-plt.bar(top_5_locations["location"], top_5_locations["price_per_sqm"], color="blue")
-plt.xlabel("Location")
-plt.ylabel("Average Price per Square Meter")
-plt.title("Top 5 Most Expensive Locations")
-plt.xticks(rotation=45)
-plt.tight_layout()
-plt.savefig("top_locations.png")
-plt.show()
+def location_averages(df):
+    location_avg_price = (
+        df.groupby("location", observed=True)["price_per_sqm"]
+        .agg(price_per_sqm="mean", count="size")
+        .reset_index()
+    )
+    return location_avg_price.sort_values(by="price_per_sqm", ascending=False)
+
+
+# One listing per near-duplicate cluster written by dedup.py, listings without
+# a cluster count on their own. With seen, clusters counted in earlier chunks
+# are skipped too and the new ones are added to it.
+def first_in_clusters(df, seen=None):
+    if "cluster" not in df:
+        return df
+    key = df["cluster"].where(df["cluster"].notna(), df["_id"].astype(str))
+    keep = ~key.duplicated()
+    if seen is not None:
+        keep &= ~key.isin(seen)
+        seen.update(key[keep])
+    return df[keep]
+
+
+# Pull every listing into pandas, categorize and summarize it. With dedup the
+# summary counts each near-duplicate cluster once, every listing is still migrated.
+def analyze_in_memory(collection, migrate=True, dedup=False):
+    df = clean_listings(load_listings(collection))
+    if not dedup:
+        return summarize_frame(df, collection if migrate else None)
+    summary = summarize_frame(first_in_clusters(df))
+    if migrate:
+        if "category" in df:
+            df = df.rename(columns={"category": "previous_category"})
+        df["category"] = categorize_prices(df["price_per_sqm"], *summary["thresholds"]).astype(object)
+        migrate_categories(collection, df)
+    return summary
+
+
+def summarize_frame(df, collection=None):
+    if "category" in df:
+        df = df.rename(columns={"category": "previous_category"})
+
+    # Categorize each document
+    cheap_threshold, expensive_threshold = compute_thresholds(df["price_per_sqm"])
+    df["category"] = categorize_prices(
+        df["price_per_sqm"], cheap_threshold, expensive_threshold
+    ).astype(object)
+    if collection is not None:
+        migrate_categories(collection, df)
+
+    return {
+        "thresholds": (cheap_threshold, expensive_threshold),
+        "locations": location_averages(df),
+        "categories": df["category"].value_counts().to_dict(),
+    }
+
+
+# Raw DataFrames of at most chunk_size listings from a projected cursor
+def iter_raw_chunks(
+    collection, chunk_size=STREAM_CHUNK_SIZE, fields=STREAM_FIELDS, query=None, sort=None
+):
+    cursor = collection.find(query or {}, {field: 1 for field in fields}, batch_size=chunk_size)
+    if sort:
+        cursor = cursor.sort(sort)
+    while True:
+        docs = list(itertools.islice(cursor, chunk_size))
+        if not docs:
+            return
+        yield pd.DataFrame(docs, columns=list(fields))
+
+
+def iter_listing_chunks(collection, chunk_size=STREAM_CHUNK_SIZE, fields=STREAM_FIELDS, query=None):
+    for chunk in iter_raw_chunks(collection, chunk_size, fields, query):
+        yield clean_listings(chunk)
+
+
+# Summarize the collection chunk by chunk with running per-location sums and a
+# quantile sketch, memory depends on the chunk size and number of locations only.
+# Categories are counted and migrated in a second pass once thresholds are known.
+# With dedup each near-duplicate cluster is counted once, which keeps a set of
+# the clusters seen.
+def analyze_streaming(
+    collection, migrate=True, chunk_size=STREAM_CHUNK_SIZE, sketch=None, dedup=False
+):
+    sketch = sketch or KLLSketch()
+    sums = {}
+    counts = {}
+    fields = STREAM_FIELDS + (("cluster",) if dedup else ())
+    seen = set()
+    for chunk in iter_listing_chunks(collection, chunk_size, fields):
+        if dedup:
+            chunk = first_in_clusters(chunk, seen)
+        sketch.update_many(chunk["price_per_sqm"].tolist())
+        grouped = chunk.groupby("location")["price_per_sqm"].agg(["sum", "size"])
+        for location, row in grouped.iterrows():
+            sums[location] = sums.get(location, 0.0) + row["sum"]
+            counts[location] = counts.get(location, 0) + int(row["size"])
+    if not sketch.count:
+        raise ValueError("No listings with a parseable price and size")
+
+    cheap_threshold, expensive_threshold = sketch.quantiles([0.33, 0.67])
+    locations = pd.DataFrame(
+        [
+            {"location": location, "price_per_sqm": sums[location] / counts[location], "count": counts[location]}
+            for location in sums
+        ],
+        columns=["location", "price_per_sqm", "count"],
+    ).sort_values(by="price_per_sqm", ascending=False)
+
+    categories = dict.fromkeys(PRICE_CATEGORIES, 0)
+    if migrate:
+        seen = set()
+        for chunk in iter_listing_chunks(collection, chunk_size, fields + ("category",)):
+            chunk = chunk.rename(columns={"category": "previous_category"})
+            chunk["category"] = categorize_prices(
+                chunk["price_per_sqm"], cheap_threshold, expensive_threshold
+            ).astype(object)
+            counted = first_in_clusters(chunk, seen) if dedup else chunk
+            for category, count in counted["category"].value_counts().items():
+                categories[category] += int(count)
+            migrate_categories(collection, chunk)
+    else:
+        # Without a second pass the category sizes come from the sketch ranks
+        cheap_rank, expensive_rank = sketch.rank(cheap_threshold), sketch.rank(expensive_threshold)
+        categories["Cheap"] = round(cheap_rank * sketch.count)
+        categories["Moderate"] = round((expensive_rank - cheap_rank) * sketch.count)
+        categories["Expensive"] = sketch.count - categories["Cheap"] - categories["Moderate"]
+    categories = {category: count for category, count in categories.items() if count}
+
+    return {
+        "thresholds": (cheap_threshold, expensive_threshold),
+        "locations": locations,
+        "categories": categories,
+    }
+
+
+def _apply_location_deltas(stats_collection, deltas, sketches):
+    if not deltas:
+        return
+    stored = {
+        doc["_id"]: doc
+        for doc in stats_collection.find({"_id": {"$in": list(deltas)}}, {"sketch": 1})
+    }
+    operations = []
+    for location, (total, count) in deltas.items():
+        update = {"$inc": {"sum": total, "count": count}}
+        if location in sketches:
+            sketch = sketches[location]
+            if location in stored and stored[location].get("sketch"):
+                sketch = KLLSketch.from_dict(stored[location]["sketch"]).merge(sketch)
+            update["$set"] = {"sketch": sketch.to_dict()}
+        operations.append(UpdateOne({"_id": location}, update, upsert=True))
+    stats_collection.bulk_write(operations, ordered=False)
+
+
+# Fold listings matching query into the location_stats collection. Each listing
+# remembers what it contributed in stats_contribution, so a changed listing is
+# first subtracted from its old location. Sketches cannot forget values, so they
+# drift with changes until the next rebuild.
+def _fold_into_location_stats(collection, db, query, state, chunk_size):
+    stats_collection = db[LOCATION_STATS]
+    global_sketch = KLLSketch.from_dict(state["sketch"]) if state.get("sketch") else KLLSketch()
+    watermark = state.get("watermark")
+    processed = 0
+    fields = STREAM_FIELDS + ("updated_at", "stats_contribution")
+
+    for raw in iter_raw_chunks(collection, chunk_size, fields, query, sort=[("updated_at", 1)]):
+        cleaned = clean_listings(raw).set_index("_id")
+        deltas = {}
+        sketches = {}
+        operations = []
+        for _id, previous, updated_at in zip(raw["_id"], raw["stats_contribution"], raw["updated_at"]):
+            if pd.notna(updated_at):
+                updated_at = pd.Timestamp(updated_at).to_pydatetime()
+                watermark = updated_at if watermark is None else max(watermark, updated_at)
+            current = None
+            if _id in cleaned.index:
+                row = cleaned.loc[_id]
+                if isinstance(row["location"], str):
+                    current = {"location": row["location"], "price_per_sqm": float(row["price_per_sqm"])}
+            previous = previous if isinstance(previous, dict) else None
+            if previous == current:
+                continue
+            if previous:
+                total, count = deltas.get(previous["location"], (0.0, 0))
+                deltas[previous["location"]] = (total - previous["price_per_sqm"], count - 1)
+            if current:
+                total, count = deltas.get(current["location"], (0.0, 0))
+                deltas[current["location"]] = (total + current["price_per_sqm"], count + 1)
+                sketches.setdefault(current["location"], KLLSketch()).update(current["price_per_sqm"])
+                global_sketch.update(current["price_per_sqm"])
+                operations.append(UpdateOne({"_id": _id}, {"$set": {"stats_contribution": current}}))
+            else:
+                operations.append(UpdateOne({"_id": _id}, {"$unset": {"stats_contribution": ""}}))
+
+        _apply_location_deltas(stats_collection, deltas, sketches)
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+        processed += len(operations)
+
+        # Checkpoint after every chunk, chunks come in updated_at order
+        state = {"_id": STATS_STATE_ID, "sketch": global_sketch.to_dict(), "watermark": watermark}
+        db[ANALYSIS_STATE].replace_one({"_id": STATS_STATE_ID}, state, upsert=True)
+
+    print(f"Folded {processed} changed listings into {LOCATION_STATS}")
+    return state
+
+
+# Rebuild location_stats from every listing, and print how far the incremental
+# sums had drifted from the rebuilt ones
+def rebuild_location_stats(collection, chunk_size=STREAM_CHUNK_SIZE):
+    db = collection.database
+    before = {doc["_id"]: doc for doc in db[LOCATION_STATS].find({}, {"sum": 1, "count": 1})}
+    db[LOCATION_STATS].drop()
+    collection.update_many({"stats_contribution": {"$exists": True}}, {"$unset": {"stats_contribution": ""}})
+    state = _fold_into_location_stats(collection, db, {}, {}, chunk_size)
+
+    drifted = 0
+    for doc in db[LOCATION_STATS].find({}, {"sum": 1, "count": 1}):
+        old = before.get(doc["_id"])
+        if old and (old["count"] != doc["count"] or not math.isclose(old["sum"], doc["sum"], rel_tol=1e-9)):
+            drifted += 1
+            print(f"Drift in {doc['_id']}: {old['count']}/{old['sum']} vs rebuilt {doc['count']}/{doc['sum']}")
+    if before:
+        print(f"Rebuild verified {len(before)} locations, {drifted} had drifted")
+    return state
+
+
+# Bring location_stats up to date with listings inserted or changed since the watermark
+def update_location_stats(collection, chunk_size=STREAM_CHUNK_SIZE, rebuild=False):
+    db = collection.database
+    state = db[ANALYSIS_STATE].find_one({"_id": STATS_STATE_ID})
+    if rebuild or state is None:
+        return rebuild_location_stats(collection, chunk_size)
+    query = {}
+    if state.get("watermark") is not None:
+        # $gte because listings written in the same instant may straddle a chunk,
+        # reprocessing one is a no-op thanks to stats_contribution
+        query = {"updated_at": {"$gte": state["watermark"]}}
+    return _fold_into_location_stats(collection, db, query, state, chunk_size)
+
+
+# Summary read from location_stats only, no listing is touched
+def summary_from_location_stats(db):
+    state = db[ANALYSIS_STATE].find_one({"_id": STATS_STATE_ID}) or {}
+    locations = pd.DataFrame(
+        [
+            {"location": doc["_id"], "price_per_sqm": doc["sum"] / doc["count"], "count": doc["count"]}
+            for doc in db[LOCATION_STATS].find({"count": {"$gt": 0}}, {"sum": 1, "count": 1})
+        ],
+        columns=["location", "price_per_sqm", "count"],
+    ).sort_values(by="price_per_sqm", ascending=False)
+
+    thresholds = (math.nan, math.nan)
+    categories = {}
+    if state.get("sketch"):
+        sketch = KLLSketch.from_dict(state["sketch"])
+        thresholds = tuple(sketch.quantiles([0.33, 0.67]))
+        cheap_rank, expensive_rank = sketch.rank(thresholds[0]), sketch.rank(thresholds[1])
+        categories = {
+            "Cheap": round(cheap_rank * sketch.count),
+            "Moderate": round((expensive_rank - cheap_rank) * sketch.count),
+            "Expensive": round((1 - expensive_rank) * sketch.count),
+        }
+    return {"thresholds": thresholds, "locations": locations, "categories": categories}
+
+
+def _first_capture(match):
+    return {"$arrayElemAt": [f"{match}.captures", 0]}
+
+
+def _concat_matches(text, regex):
+    return {
+        "$reduce": {
+            "input": {"$regexFindAll": {"input": text, "regex": regex}},
+            "initialValue": "",
+            "in": {"$concat": ["$$value", "$$this.match"]},
+        }
+    }
+
+
+def _to_double(value):
+    return {"$convert": {"input": value, "to": "double", "onError": None, "onNull": None}}
+
+
+# Stages that parse price and size on the server the same way parse_prices and
+# parse_sizes do, and leave only _id, location, category and price_per_sqm
+def listing_metrics_pipeline():
+    # Later signs win in parse_prices, so they come first in the $switch
+    rate_branches = [
+        {
+            "case": {"$regexMatch": {"input": "$_price", "regex": re.escape(sign)}},
+            "then": CURRENCY_RATES[currency],
+        }
+        for sign, currency in reversed(CURRENCY_SIGNS.items())
+        if currency != "$"
+    ]
+    return [
+        {
+            "$project": {
+                "location": 1,
+                "category": 1,
+                "_price": {"$cond": [{"$eq": [{"$type": "$price"}, "string"]}, "$price", ""]},
+                "_size": {"$cond": [{"$eq": [{"$type": "$size"}, "string"]}, "$size", ""]},
+            }
+        },
+        {
+            "$set": {
+                "_rate": {"$switch": {"branches": rate_branches, "default": 1.0}},
+                "_digits": _concat_matches("$_price", "[0-9.,]+"),
+                "_size_match": {
+                    "$regexFind": {"input": "$_size", "regex": r"^\s*([0-9]+(?:[.,][0-9]+)?)"}
+                },
+            }
+        },
+        {"$set": {"_decimal": {"$regexFind": {"input": "$_digits", "regex": "[.,]([0-9]{1,2})$"}}}},
+        {
+            "$set": {
+                "_integer": _concat_matches(
+                    {
+                        "$cond": [
+                            {"$eq": ["$_decimal", None]},
+                            "$_digits",
+                            {
+                                "$substrCP": [
+                                    "$_digits",
+                                    0,
+                                    {
+                                        "$subtract": [
+                                            {"$strLenCP": "$_digits"},
+                                            {"$strLenCP": "$_decimal.match"},
+                                        ]
+                                    },
+                                ]
+                            },
+                        ]
+                    },
+                    "[0-9]+",
+                ),
+            }
+        },
+        {
+            "$set": {
+                "price_numeric": {
+                    "$multiply": [
+                        _to_double(
+                            {
+                                "$cond": [
+                                    {"$eq": ["$_decimal", None]},
+                                    "$_integer",
+                                    {"$concat": ["$_integer", ".", _first_capture("$_decimal")]},
+                                ]
+                            }
+                        ),
+                        "$_rate",
+                    ]
+                },
+                "size_numeric": _to_double(
+                    {"$replaceAll": {"input": _first_capture("$_size_match"), "find": ",", "replacement": "."}}
+                ),
+            }
+        },
+        {"$match": {"price_numeric": {"$type": "double"}, "size_numeric": {"$gt": 0}}},
+        {
+            "$project": {
+                "location": 1,
+                "category": 1,
+                "price_per_sqm": {"$divide": ["$price_numeric", "$size_numeric"]},
+            }
+        },
+    ]
+
+
+# Server-side version of categorize_prices, (-inf, cheap], (cheap, expensive], (expensive, inf)
+def category_expression(cheap_threshold, expensive_threshold):
+    return {
+        "$switch": {
+            "branches": [
+                {"case": {"$lte": ["$price_per_sqm", cheap_threshold]}, "then": "Cheap"},
+                {"case": {"$lte": ["$price_per_sqm", expensive_threshold]}, "then": "Moderate"},
+            ],
+            "default": "Expensive",
+        }
+    }
+
+
+# Linearly interpolated quantile like pandas, read from the sorted values on the server
+def _pipeline_quantile(collection, base, q, count):
+    position = q * (count - 1)
+    lower = math.floor(position)
+    values = [
+        doc["price_per_sqm"]
+        for doc in collection.aggregate(
+            base
+            + [
+                {"$sort": {"price_per_sqm": 1}},
+                {"$skip": lower},
+                {"$limit": 2},
+                {"$project": {"_id": 0, "price_per_sqm": 1}},
+            ],
+            allowDiskUse=True,
+        )
+    ]
+    return values[0] + (values[-1] - values[0]) * (position - lower)
+
+
+def pipeline_thresholds(collection, base, count, method="exact"):
+    if method == "exact":
+        return tuple(_pipeline_quantile(collection, base, q, count) for q in (0.33, 0.67))
+    # $percentile needs MongoDB 7.0 and is approximate
+    result = collection.aggregate(
+        base
+        + [
+            {
+                "$group": {
+                    "_id": None,
+                    "thresholds": {
+                        "$percentile": {
+                            "input": "$price_per_sqm",
+                            "p": [0.33, 0.67],
+                            "method": "approximate",
+                        }
+                    },
+                }
+            }
+        ]
+    ).next()
+    return tuple(result["thresholds"])
+
+
+# Compute the same summary as analyze_in_memory inside MongoDB, only the
+# per-location and per-category results are sent back
+def analyze_with_pipeline(collection, migrate=True, quantile_method="exact"):
+    base = listing_metrics_pipeline()
+    groups = list(
+        collection.aggregate(
+            base
+            + [
+                {
+                    "$group": {
+                        "_id": "$location",
+                        "price_per_sqm": {"$avg": "$price_per_sqm"},
+                        "count": {"$sum": 1},
+                    }
+                },
+                {"$sort": {"price_per_sqm": -1}},
+            ],
+            allowDiskUse=True,
+        )
+    )
+    count = sum(group["count"] for group in groups)
+    if not count:
+        raise ValueError("No listings with a parseable price and size")
+    locations = pd.DataFrame(
+        [
+            {"location": group["_id"], "price_per_sqm": group["price_per_sqm"], "count": group["count"]}
+            for group in groups
+            if group["_id"] is not None
+        ],
+        columns=["location", "price_per_sqm", "count"],
+    )
+
+    cheap_threshold, expensive_threshold = pipeline_thresholds(
+        collection, base, count, quantile_method
+    )
+    category = category_expression(cheap_threshold, expensive_threshold)
+    categories = {
+        doc["_id"]: doc["count"]
+        for doc in collection.aggregate(
+            base + [{"$group": {"_id": category, "count": {"$sum": 1}}}], allowDiskUse=True
+        )
+    }
+
+    if migrate:
+        # Write changed categories back without them leaving the server
+        collection.aggregate(
+            base
+            + [
+                {"$set": {"new_category": category}},
+                {"$match": {"$expr": {"$ne": ["$new_category", "$category"]}}},
+                {"$project": {"category": "$new_category"}},
+                {
+                    "$merge": {
+                        "into": collection.name,
+                        "on": "_id",
+                        "whenMatched": "merge",
+                        "whenNotMatched": "discard",
+                    }
+                },
+            ],
+            allowDiskUse=True,
+        )
+        print("Migration completed successfully.")
+
+    return {
+        "thresholds": (cheap_threshold, expensive_threshold),
+        "locations": locations,
+        "categories": categories,
+    }
+
+
+# Compare the pipeline or streaming summary with the pandas one, returns the
+# differences found. Streaming thresholds are compared by rank, see STREAM_RANK_TOLERANCE
+def check_parity(collection, mode="pipeline", rel_tol=1e-9, rank_tol=STREAM_RANK_TOLERANCE):
+    df = clean_listings(load_listings(collection))
+    expected = summarize_frame(df)
+    if mode == "stream":
+        actual = analyze_streaming(collection, migrate=False)
+    else:
+        actual = analyze_with_pipeline(collection, migrate=False)
+    differences = []
+
+    values = df["price_per_sqm"]
+    if mode == "stream":
+        # Thresholds taken from the values sit at ranks that are multiples of 1/n,
+        # coarser than rank_tol on small collections
+        rank_tol += 1 / len(values)
+    thresholds = zip(("cheap", "expensive"), (0.33, 0.67), expected["thresholds"], actual["thresholds"])
+    for name, q, want, got in thresholds:
+        if mode == "stream":
+            rank = (values <= got).mean()
+            if abs(rank - q) > rank_tol:
+                differences.append(f"{name} threshold: {mode} {got} has rank {rank:.4f}, expected {q}")
+        elif not math.isclose(want, got, rel_tol=rel_tol):
+            differences.append(f"{name} threshold: pandas {want}, {mode} {got}")
+
+    want_locations = expected["locations"].set_index("location")
+    got_locations = actual["locations"].set_index("location")
+    for location in want_locations.index.union(got_locations.index):
+        if location not in want_locations.index or location not in got_locations.index:
+            differences.append(f"location {location} missing from one of the results")
+            continue
+        want, got = want_locations.loc[location], got_locations.loc[location]
+        if want["count"] != got["count"] or not math.isclose(
+            want["price_per_sqm"], got["price_per_sqm"], rel_tol=rel_tol
+        ):
+            differences.append(f"location {location}: pandas {want.to_dict()}, {mode} {got.to_dict()}")
+
+    for category in PRICE_CATEGORIES:
+        want = expected["categories"].get(category, 0)
+        got = actual["categories"].get(category, 0)
+        allowed = 2 * rank_tol * len(values) if mode == "stream" else 0
+        if abs(want - got) > allowed:
+            differences.append(f"{category} count: pandas {want}, {mode} {got}")
+
+    for difference in differences:
+        print(difference)
+    print(f"Parity check found {len(differences)} differences")
+    return differences
+
+
+# Generate Bar Chart. matplotlib is imported here, it is the slowest import of the
+# module and only the chart needs it.
+def plot_top_locations(top_5_locations, path="top_locations.png"):
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 6))
+    plt.bar(top_5_locations["location"], top_5_locations["price_per_sqm"], color="blue")
+    plt.xlabel("Location")
+    plt.ylabel("Average Price per Square Meter")
+    plt.title("Top 5 Most Expensive Locations")
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.show()
+
+
+def main(mode="pandas", verify=False, rebuild=False, dedup=False):
+    if mode not in ANALYSIS_MODES:
+        raise ValueError(f"Unknown mode {mode}, expected one of {ANALYSIS_MODES}")
+    if dedup and mode not in ("pandas", "stream"):
+        raise ValueError("Counting duplicate clusters once is supported in the pandas and stream modes")
+    collection = get_collection()
+    if verify:
+        return check_parity(collection, "stream" if mode == "stream" else "pipeline")
+
+    if mode == "pipeline":
+        summary = analyze_with_pipeline(collection)
+    elif mode == "stream":
+        summary = analyze_streaming(collection, dedup=dedup)
+    elif mode == "summary":
+        update_location_stats(collection, rebuild=rebuild)
+        summary = summary_from_location_stats(collection.database)
+    elif mode == "snapshot":
+        # Reads the Parquet files written by snapshot.py export, MongoDB is not queried
+        from snapshot import load_snapshot
+
+        summary = summarize_frame(load_snapshot())
+    else:
+        summary = analyze_in_memory(collection, dedup=dedup)
+
+    # Identify Top 5 Most Expensive Locations
+    top_5_locations = summary["locations"].head(5)
+    print(top_5_locations)
+    plot_top_locations(top_5_locations)
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Analyze scraped land listings")
+    parser.add_argument("--mode", choices=ANALYSIS_MODES, default="pandas")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="compare the pipeline (or with --mode stream the streaming) results with pandas",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="with --mode summary, rebuild location_stats from all listings and report drift",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="count each near-duplicate cluster found by dedup.py once (pandas and stream modes)",
+    )
+    args = parser.parse_args()
+    main(args.mode, args.verify, args.rebuild, args.dedup)
+
+
+if __name__ == "__main__":
+    cli()
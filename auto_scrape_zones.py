@@ -1,33 +1,131 @@
+import argparse
+import importlib
 import json
-import time
-from selenium import webdriver
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from selenium.webdriver.common.by import By
-from selenium.webdriver.firefox.service import Service
-from selenium.webdriver.firefox.options import Options
 from selenium.common.exceptions import NoSuchElementException, TimeoutException
-from webdriver_manager.firefox import GeckoDriverManager
+import requests
+from browser_pool import get_browser_pool, launch_driver
+from instrumentation import metrics
+from page_cache import get_page_cache
+from politeness import get_scheduler, wait_for_document, wait_for_elements, wait_for_navigation
+from zone_search import ZoneIndex
 
-# Initialize the Selenium WebDriver
+# Longest wait for a page to show the elements a scraper looks for
+READY_TIMEOUT = 10
+
+# Site adapters by jurisdiction name, filled by the @jurisdiction decorator
+JURISDICTIONS = {}
+
+# Comma-separated modules with more adapters, imported by load_plugins()
+PLUGINS_ENV = "HESTI_ZONE_PLUGINS"
+
+
+# Register a site adapter: url is the code's home page and entry_xpath the link
+# clicked there before scrape_function(driver) runs
+def jurisdiction(name, url, entry_xpath):
+    def register(scrape_function):
+        JURISDICTIONS[name] = {
+            "name": name,
+            "url": url,
+            "entry_xpath": entry_xpath,
+            "scrape": scrape_function,
+        }
+        return scrape_function
+
+    return register
+
+
+def load_plugins(modules=None):
+    if modules is None:
+        modules = [module for module in os.getenv(PLUGINS_ENV, "").split(",") if module]
+    for module in modules:
+        importlib.import_module(module.strip())
+
+# Initialize a headless Selenium WebDriver that skips images, fonts and stylesheets
 def init_driver():
-    options = Options()
-    options.add_argument('--headless')
-    driver = webdriver.Firefox(service=Service(GeckoDriverManager().install()), options=options)
-    return driver
+    return launch_driver()
+
+# Warm browsers shared by the jurisdiction workers
+def browser_pool(size=1):
+    return get_browser_pool("zones", size)
 
-# Function to click an element using XPath
+# Function to click an element using XPath and wait for the page it leads to
 def click_element(driver, xpath):
     try:
-        elements = driver.find_elements(By.XPATH, xpath)
+        elements = wait_for_elements(driver, xpath, READY_TIMEOUT, required=False)
         if elements:
+            old_url = driver.current_url
             elements[0].click()
-            time.sleep(3)
+            wait_for_navigation(driver, old_url, READY_TIMEOUT)
     except Exception as e:
         print(f"Element with xpath {xpath} not found or clickable. Exception: {e}")
 
+# Open url in a new tab once the politeness scheduler allows it, waiting for ready_xpath
+def open_tab(driver, url, ready_xpath):
+    scheduler = get_scheduler()
+    scheduler.wait(url)
+    with metrics.span("detail_navigation"):
+        driver.execute_script("window.open(arguments[0], '_blank');", url)
+        driver.switch_to.window(driver.window_handles[1])
+    try:
+        wait_for_document(driver, READY_TIMEOUT)
+    except TimeoutException:
+        scheduler.failure(url)
+        raise
+    if wait_for_elements(driver, ready_xpath, READY_TIMEOUT, required=False):
+        scheduler.success(url)
+
+# Close the current tab and switch back to the main window
+def close_tab(driver):
+    driver.close()
+    driver.switch_to.window(driver.window_handles[0])
+
+# Open url in a new tab and return extract(driver). With cache=True the page is
+# revalidated over HTTP first, and while its content is unchanged the previous
+# result comes from the page cache without opening the tab. Sites that render
+# their content with JavaScript must pass cache=False.
+def read_page(driver, url, ready_xpath, extract, cache=True):
+    page = None
+    if cache:
+        try:
+            page = get_page_cache().fetch(url)
+        except requests.RequestException as e:
+            print(f"Could not revalidate {url}: {e}")
+        if page is not None:
+            result = get_page_cache().get_result(url, page["content_hash"])
+            if result is not None:
+                return result
+
+    try:
+        open_tab(driver, url, ready_xpath)
+        with metrics.span("element_lookup"):
+            result = extract(driver)
+    finally:
+        close_tab(driver)
+    if page is not None:
+        get_page_cache().put_result(url, page["content_hash"], result)
+    return result
+
+# Description of an Airway Heights zone page
+def read_airway_heights_description(driver):
+    try:
+        header_elements = driver.find_elements(By.XPATH, "//*[@class='Cite']")
+        content_elements = driver.find_elements(By.XPATH, "//*[@class='P1' or @class='P2' or @class='P3']")
+
+        headers = [header.text for header in header_elements]
+        contents = [content.text for content in content_elements]
+
+        return ' '.join(headers + contents)
+    except NoSuchElementException:
+        return "Description not found"
+
 # Function to scrape zones from the first website
+@jurisdiction("airway_heights", "https://www.codepublishing.com/WA/AirwayHeights", "//*[@id='AirwayHeights17']")
 def scrape_zones_airway_heights(driver):
     zones = []
-    zone_links = driver.find_elements(By.XPATH, "//a[contains(text(), 'Zone') and not(starts-with(text(), 'Zone'))]")
+    zone_links = wait_for_elements(driver, "//a[contains(text(), 'Zone') and not(starts-with(text(), 'Zone'))]", READY_TIMEOUT, required=False)
 
     for link in zone_links:
         zone_name = link.text.strip().split(' ', 1)[1]  # Extracting text without the leading chapter number
@@ -37,37 +135,17 @@ def scrape_zones_airway_heights(driver):
         zone_url = link.get_attribute('href')
         
         try:
-            # Open the zone URL in a new tab
-            driver.execute_script("window.open(arguments[0], '_blank');", zone_url)
-            driver.switch_to.window(driver.window_handles[1])
-            time.sleep(3)
+            # Read the zone page in a new tab, or from the cache if it did not change
+            zone_description = read_page(driver, zone_url, "//*[@class='P1' or @class='P2' or @class='P3']", read_airway_heights_description)
 
-            try:
-                header_elements = driver.find_elements(By.XPATH, "//*[@class='Cite']")
-                content_elements = driver.find_elements(By.XPATH, "//*[@class='P1' or @class='P2' or @class='P3']")
-                
-                headers = [header.text for header in header_elements]
-                contents = [content.text for content in content_elements]
-
-                zone_description = ' '.join(headers + contents)
-            except NoSuchElementException:
-                zone_description = "Description not found"
-            
             zones.append({
                 'name': zone_name,
                 'description': zone_description,
                 'link': zone_url
             })
-
-            # Close the tab and switch back to the main window
-            driver.close()
-            driver.switch_to.window(driver.window_handles[0])
-            time.sleep(3)
         except Exception as e:
+            metrics.count("zone_errors")
             print(f"Failed to scrape description from {zone_url}: {e}")
-            driver.close()
-            driver.switch_to.window(driver.window_handles[0])
-            time.sleep(3)
 
     return zones
 
@@ -87,15 +165,24 @@ def clean_name(name):
         name = name[1:].strip()
     return name
 
+ALBION_DESCRIPTION_XPATH = '/html/body/div[3]/div[2]/ui-view/mcc-codes/div[2]/main/div[1]/mcc-codes-content/div/div[2]/ul/li[2]'
+
+# Description of an Albion district page
+def read_albion_description(driver):
+    try:
+        return driver.find_element(By.XPATH, ALBION_DESCRIPTION_XPATH).text
+    except NoSuchElementException:
+        return "Description not found"
+
 # Function to scrape zones from the second website (Albion)
+@jurisdiction("albion", "https://library.municode.com/wa/albion/codes/code_of_ordinances", "/html/body/div[3]/div[2]/ui-view/mcc-codes/div[2]/nav/div[2]/div[2]/mcc-codes-toc/mcc-product-toc/div/ul/li[14]/a")
 def scrape_districts_albion(driver):
     districts = []
     # Click on the zoning link to navigate to the zoning page
     click_element(driver, "/html/body/div[3]/div[2]/ui-view/mcc-codes/div[2]/nav/div[2]/div[2]/mcc-codes-toc/mcc-product-toc/div/ul/li[14]/a")
-    time.sleep(3)
 
     # Find all district links on the zoning page
-    district_links = driver.find_elements(By.XPATH, "/html/body/div[3]/div[2]/ui-view/mcc-codes/div[2]/main/div[1]/mcc-codes-content/div/div[2]/div[2]/ul/li/mcc-codes-content-mini-toc-item/div/div/a")
+    district_links = wait_for_elements(driver, "/html/body/div[3]/div[2]/ui-view/mcc-codes/div[2]/main/div[1]/mcc-codes-content/div/div[2]/div[2]/ul/li/mcc-codes-content-mini-toc-item/div/div/a", READY_TIMEOUT, required=False)
     
     for link in district_links:
         raw_district_name = link.text.strip().split(' ', 2)[2]  # Extracting text without the leading chapter number
@@ -104,44 +191,40 @@ def scrape_districts_albion(driver):
             district_url = link.get_attribute('href')
 
             try:
-                # Open the district URL in a new tab
-                driver.execute_script("window.open(arguments[0], '_blank');", district_url)
-                driver.switch_to.window(driver.window_handles[1])
-                time.sleep(3)
-
-                try:
-                    description_element = driver.find_element(By.XPATH, '/html/body/div[3]/div[2]/ui-view/mcc-codes/div[2]/main/div[1]/mcc-codes-content/div/div[2]/ul/li[2]')
-                    district_description = description_element.text
-                except NoSuchElementException:
-                    district_description = "Description not found"
+                # Read the district page in a new tab. Municode renders it with
+                # JavaScript, so its HTTP content cannot tell whether it changed
+                district_description = read_page(driver, district_url, ALBION_DESCRIPTION_XPATH, read_albion_description, cache=False)
 
                 districts.append({
                     'name': district_name,
                     'description': district_description,
                     'link': district_url
                 })
-
-                # Close the tab and switch back to the main window
-                driver.close()
-                driver.switch_to.window(driver.window_handles[0])
-                time.sleep(3)
             except Exception as e:
+                metrics.count("zone_errors")
                 print(f"Failed to scrape description from {district_url}: {e}")
-                driver.close()
-                driver.switch_to.window(driver.window_handles[0])
-                time.sleep(3)
 
     return districts
 
+ALGONA_DESCRIPTION_XPATH = "//*[@class='level6 chunking-small type-Section has-history']"
+
+# Description of an Algona district page
+def read_algona_description(driver):
+    try:
+        description_elements = driver.find_elements(By.XPATH, ALGONA_DESCRIPTION_XPATH)
+        return ' '.join([element.text for element in description_elements])
+    except NoSuchElementException:
+        return "Description not found"
+
 # Function to scrape zones from the third website (Algona)
+@jurisdiction("algona", "https://algona.municipal.codes/", "/html/body/div[1]/div[4]/div/div/main/div/div/div/a[15]")
 def scrape_districts_algona(driver):
     districts = []
     # Click on the zoning link to navigate to the zoning page
     click_element(driver, "/html/body/div[1]/div[4]/div/div/main/div/div/div/a[15]")
-    time.sleep(3)
 
     # Find all district links on the zoning page
-    district_links = driver.find_elements(By.XPATH, "/html/body/div[1]/div[4]/div/div/main/div/article/ul/li/a")
+    district_links = wait_for_elements(driver, "/html/body/div[1]/div[4]/div/div/main/div/article/ul/li/a", READY_TIMEOUT, required=False)
     
     for link in district_links:
         raw_district_name = link.find_element(By.XPATH, "./span[2]").text.strip()
@@ -150,62 +233,121 @@ def scrape_districts_algona(driver):
             district_url = link.get_attribute('href')
 
             try:
-                # Open the district URL in a new tab
-                driver.execute_script("window.open(arguments[0], '_blank');", district_url)
-                driver.switch_to.window(driver.window_handles[1])
-                time.sleep(3)
-
-                try:
-                    description_elements = driver.find_elements(By.XPATH, "//*[@class='level6 chunking-small type-Section has-history']")
-                    district_description = ' '.join([element.text for element in description_elements])
-                except NoSuchElementException:
-                    district_description = "Description not found"
+                # Read the district page in a new tab, or from the cache if it did not change
+                district_description = read_page(driver, district_url, ALGONA_DESCRIPTION_XPATH, read_algona_description)
 
                 districts.append({
                     'name': district_name,
                     'description': district_description,
                     'link': district_url
                 })
-
-                # Close the tab and switch back to the main window
-                driver.close()
-                driver.switch_to.window(driver.window_handles[0])
-                time.sleep(3)
             except Exception as e:
+                metrics.count("zone_errors")
                 print(f"Failed to scrape description from {district_url}: {e}")
-                driver.close()
-                driver.switch_to.window(driver.window_handles[0])
-                time.sleep(3)
 
     return districts
 
-# Main function to scrape all provided URLs
-def main():
-    urls_xpaths = [
-        ("https://www.codepublishing.com/WA/AirwayHeights", "//*[@id='AirwayHeights17']", scrape_zones_airway_heights),
-        ("https://library.municode.com/wa/albion/codes/code_of_ordinances", "/html/body/div[3]/div[2]/ui-view/mcc-codes/div[2]/nav/div[2]/div[2]/mcc-codes-toc/mcc-product-toc/div/ul/li[14]/a", scrape_districts_albion),
-        ("https://algona.municipal.codes/", "/html/body/div[1]/div[4]/div/div/main/div/div/div/a[15]", scrape_districts_algona)
-    ]
+# Zones per jurisdiction URL, saved as soon as each jurisdiction finishes so a
+# crashed crawl keeps what it already has. Optionally mirrored to MongoDB and
+# to a zone_search.ZoneIndex.
+class ZoneStore:
+    def __init__(self, path="zones.json", collection=None, index=None):
+        self.path = path
+        self.collection = collection
+        self.index = index
+        self.zones = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.zones = json.load(f)
 
-    all_zones = {}
-    driver = init_driver()
+    def save(self, url, zones):
+        self.zones[url] = zones
+        # Write a temporary file and rename it, readers never see a partial file
+        with metrics.span("db_write"):
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.zones, f, indent=2)
+            os.replace(self.path + ".tmp", self.path)
+            if self.collection is not None:
+                self.collection.delete_many({"jurisdiction": url})
+                if zones:
+                    self.collection.insert_many([dict(zone, jurisdiction=url) for zone in zones])
+            if self.index is not None:
+                self.index.update_jurisdiction(url, zones)
 
-    for url, xpath, scrape_function in urls_xpaths:
-        try:
-            print(f"Scraping {url}")
-            driver.get(url)
-            time.sleep(3)
-            click_element(driver, xpath)
-            zones = scrape_function(driver)
-            all_zones[url] = zones
-        except Exception as e:
-            print(f"Failed to scrape {url}: {e}")
 
-    # Save the results to a JSON file
-    with open('zones.json', 'w') as f:
-        json.dump(all_zones, f, indent=2)
-    print("Scraping complete. Results saved to zones.json")
-    driver.quit()
+# Scrape one jurisdiction with a browser from the pool
+def scrape_jurisdiction(site):
+    pool = browser_pool()
+    driver = pool.acquire()
+    zones = []
+    try:
+        print(f"Scraping {site['url']}")
+        get_scheduler().wait(site["url"])
+        with metrics.span("page_load"):
+            driver.get(site["url"])
+        wait_for_document(driver, READY_TIMEOUT)
+        click_element(driver, site["entry_xpath"])
+        zones = site["scrape"](driver)
+        metrics.count("zones_scraped", len(zones), jurisdiction=site["name"])
+        return zones
+    finally:
+        # The entry page plus roughly one page per zone, cached ones included
+        pool.release(driver, 1 + len(zones))
+
+
+# Scrape jurisdictions concurrently, one pooled browser per worker thread. The
+# browsers are separate processes, so threads are enough to keep them all busy.
+def crawl_jurisdictions(names=None, workers=4, store=None):
+    store = store or ZoneStore()
+    names = names or list(JURISDICTIONS)
+    unknown = [name for name in names if name not in JURISDICTIONS]
+    if unknown:
+        raise ValueError(f"Unknown jurisdictions {unknown}, expected some of {sorted(JURISDICTIONS)}")
+    failed = []
+    browser_pool(workers).prewarm(min(workers, len(names)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(scrape_jurisdiction, JURISDICTIONS[name]): name for name in names
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                zones = future.result()
+            except Exception as e:
+                print(f"Failed to scrape {name}: {e}")
+                failed.append(name)
+                continue
+            store.save(JURISDICTIONS[name]["url"], zones)
+            print(f"Saved {len(zones)} zones for {name} to {store.path}")
+    return failed
+
+
+def main(names=None, workers=4, output="zones.json", mongo=False, index_path="zones_index.sqlite3"):
+    load_plugins()
+    collection = None
+    if mongo:
+        from connector import get_db
+
+        collection = get_db()["zones"]
+    index = ZoneIndex(index_path) if index_path else None
+    failed = crawl_jurisdictions(names, workers, ZoneStore(output, collection, index))
+    print(f"Scraping complete. Results saved to {output}")
+    print(f"Page cache: {get_page_cache().stats()}")
+    if failed:
+        print(f"Failed jurisdictions: {', '.join(failed)}")
+    metrics.report()
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Scrape zoning codes of the registered jurisdictions")
+    parser.add_argument("--only", action="append", help="jurisdiction to scrape, may be repeated")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--output", default="zones.json")
+    parser.add_argument("--mongo", action="store_true", help="also store the zones in MongoDB")
+    parser.add_argument("--index", default="zones_index.sqlite3", help="full-text index to update, empty to skip")
+    args = parser.parse_args()
+    main(args.only, args.workers, args.output, args.mongo, args.index)
+
 
 if __name__ == "__main__":
-    main()
+    cli()
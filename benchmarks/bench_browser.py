@@ -0,0 +1,97 @@
+# Startup and per-page cost of a cold Firefox per run versus the warm browser pool.
+#
+#   python benchmarks/bench_browser.py URL [URL ...] --runs 3
+#
+# Point it at a ReplayServer (see bench_scrapers.py) to keep the network out of it.
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from browser_pool import BrowserPool, launch_driver  # noqa: E402
+
+
+def load(driver, url):
+    start = time.perf_counter()
+    driver.get(url)
+    while driver.execute_script("return document.readyState") != "complete":
+        time.sleep(0.01)
+    return time.perf_counter() - start
+
+
+# What every run did before: resolve geckodriver, start a full browser, quit
+def bench_cold(urls, runs):
+    from selenium import webdriver
+    from selenium.webdriver.firefox.options import Options
+    from selenium.webdriver.firefox.service import Service
+    from webdriver_manager.firefox import GeckoDriverManager
+
+    startups, pages = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        options = Options()
+        options.add_argument("--headless")
+        driver = webdriver.Firefox(service=Service(GeckoDriverManager().install()), options=options)
+        startups.append(time.perf_counter() - start)
+        try:
+            pages.extend(load(driver, url) for url in urls)
+        finally:
+            driver.quit()
+    return startups, pages
+
+
+def bench_pool(urls, runs):
+    pool = BrowserPool(size=1)
+    start = time.perf_counter()
+    pool.prewarm()
+    prewarm = time.perf_counter() - start
+
+    startups, pages = [], []
+    try:
+        for _ in range(runs):
+            start = time.perf_counter()
+            driver = pool.acquire()
+            startups.append(time.perf_counter() - start)
+            pages.extend(load(driver, url) for url in urls)
+            pool.release(driver, len(urls))
+    finally:
+        pool.close()
+    return prewarm, startups, pages
+
+
+def bench_launch(runs):
+    launches = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        launch_driver().quit()
+        launches.append(time.perf_counter() - start)
+    return launches
+
+
+def ms(values):
+    return f"{statistics.mean(values) * 1000:8.0f} ms" if values else "     n/a"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark driver startup and page loads")
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    cold_startups, cold_pages = bench_cold(args.urls, args.runs)
+    launches = bench_launch(args.runs)
+    prewarm, pool_startups, pool_pages = bench_pool(args.urls, args.runs)
+
+    print(f"cold start, GeckoDriverManager each run  {ms(cold_startups)}")
+    print(f"launch with cached driver path (+ quit)  {ms(launches)}")
+    print(f"pool prewarm (once)                      {prewarm * 1000:8.0f} ms")
+    print(f"pool acquire of a warm browser           {ms(pool_startups)}")
+    print(f"page load, full browser                  {ms(cold_pages)}")
+    print(f"page load, images/fonts/CSS blocked      {ms(pool_pages)}")
+
+
+if __name__ == "__main__":
+    main()
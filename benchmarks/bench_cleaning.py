@@ -0,0 +1,93 @@
+# Rows/sec of the row-wise cleaning in the old analyze_lands.py against the
+# vectorized parse_prices / parse_sizes / categorize_prices on a synthetic frame.
+#
+#   python benchmarks/bench_cleaning.py --rows 1000000
+import argparse
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyze_lands import (  # noqa: E402
+    categorize_prices,
+    compute_thresholds,
+    parse_prices,
+    parse_sizes,
+)
+
+
+# Row-wise implementation as it was in analyze_lands.py
+def clean_price(price_str):
+    price_str = price_str.replace(" ", "")
+    price_str = price_str.replace("$", "")
+    return float(price_str)
+
+
+def extract_total_size(size_str):
+    match = re.match(r"(\d+)", size_str)
+    if match:
+        return float(match.group(1))
+    else:
+        return None
+
+
+def make_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    prices = rng.integers(1_000, 2_000_000, rows)
+    sizes = rng.integers(20, 5_000, rows)
+    return pd.DataFrame(
+        {
+            # The row-wise parser only understands space separated dollar prices
+            "price": [f"{price:,} $".replace(",", " ") for price in prices],
+            "size": [f"{size} м²" for size in sizes],
+        }
+    )
+
+
+def rowwise(df):
+    price = df["price"].apply(clean_price)
+    size = df["size"].apply(extract_total_size)
+    price_per_sqm = price / size
+    cheap, expensive = compute_thresholds(price_per_sqm)
+
+    def categorize(value):
+        if value <= cheap:
+            return "Cheap"
+        elif value <= expensive:
+            return "Moderate"
+        else:
+            return "Expensive"
+
+    return price_per_sqm.apply(categorize)
+
+
+def vectorized(df):
+    price_per_sqm = parse_prices(df["price"]) / parse_sizes(df["size"])
+    cheap, expensive = compute_thresholds(price_per_sqm)
+    return categorize_prices(price_per_sqm, cheap, expensive)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark listing cleaning")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+    results = {}
+    for name, clean in (("row-wise", rowwise), ("vectorized", vectorized)):
+        start = time.perf_counter()
+        results[name] = clean(df)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>10}: {elapsed:.2f}s ({args.rows / elapsed:,.0f} rows/sec)")
+
+    same = (results["row-wise"] == results["vectorized"].astype(object)).mean()
+    print(f"Matching categories: {same:.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Listings/sec of the MinHash LSH dedup index and how many planted near-duplicates
+# it finds, on synthetic descriptions.
+#
+#   python benchmarks/bench_dedup.py --listings 100000
+#   python benchmarks/bench_dedup.py --listings 1000000 --chunk-size 20000
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dedup import DedupIndex  # noqa: E402
+
+VOCABULARY = 20000
+
+
+# Descriptions of 40-120 random words. duplicate_rate of them re-post an
+# earlier description with edits words replaced, as an agent editing a copy would.
+def make_descriptions(listings, duplicate_rate, edits, rng):
+    words = np.array([f"w{i}" for i in range(VOCABULARY)], dtype=object)
+    descriptions = []
+    originals = np.full(listings, -1)
+    for index in range(listings):
+        if index > 10 and rng.random() < duplicate_rate:
+            original = int(rng.integers(0, index))
+            while originals[original] >= 0:
+                original = originals[original]
+            text = descriptions[original].split()
+            for position in rng.integers(0, len(text), edits):
+                text[position] = words[rng.integers(0, VOCABULARY)]
+            originals[index] = original
+        else:
+            text = words[rng.integers(0, VOCABULARY, int(rng.integers(40, 120)))]
+        descriptions.append(" ".join(text))
+    return descriptions, originals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark near-duplicate detection")
+    parser.add_argument("--listings", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--duplicate-rate", type=float, default=0.1)
+    parser.add_argument("--edits", type=int, default=2, help="words changed in a duplicate")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    descriptions, originals = make_descriptions(
+        args.listings, args.duplicate_rate, args.edits, rng
+    )
+    listings = [f"listing-{index:08d}" for index in range(args.listings)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = DedupIndex(os.path.join(directory, "dedup.sqlite3"))
+        start = time.perf_counter()
+        for chunk in range(0, args.listings, args.chunk_size):
+            index.add(
+                listings[chunk : chunk + args.chunk_size],
+                descriptions[chunk : chunk + args.chunk_size],
+            )
+            if chunk and chunk % (10 * args.chunk_size) == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{chunk:>9} listings, {chunk / elapsed:,.0f} listings/sec")
+        elapsed = time.perf_counter() - start
+
+        clusters = index.clusters()
+        planted = originals >= 0
+        found = sum(
+            clusters.get(listings[i]) is not None
+            and clusters.get(listings[i]) == clusters.get(listings[originals[i]])
+            for i in np.flatnonzero(planted)
+        )
+        # Members of a cluster that was not planted together
+        false = sum(
+            1
+            for listing, cluster in clusters.items()
+            if originals[int(listing.split("-")[1])] < 0 and listing != cluster
+        )
+        print(
+            f"{args.listings:,} listings in {elapsed:.1f}s, {args.listings / elapsed:,.0f} listings/sec, "
+            f"index {os.path.getsize(os.path.join(directory, 'dedup.sqlite3')) / 2**20:.0f} MB"
+        )
+        print(
+            f"{index.stats()}, found {found} of {int(planted.sum())} planted duplicates, "
+            f"{false} listings wrongly clustered"
+        )
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
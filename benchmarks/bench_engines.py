@@ -0,0 +1,85 @@
+# Compare listings/sec of the Selenium and lxml extraction engines on saved pages.
+#
+#   python benchmarks/bench_engines.py --save pages/ URL [URL ...]
+#   python benchmarks/bench_engines.py pages/*.html
+import argparse
+import hashlib
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scrape_lands import (  # noqa: E402
+    LISTING_XPATH,
+    create_session,
+    extract_listings_from_html,
+)
+
+
+def save_pages(directory, urls):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    session = create_session()
+    for url in urls:
+        response = session.get(url, timeout=15)
+        response.raise_for_status()
+        path = directory / f"{hashlib.sha1(url.encode()).hexdigest()[:12]}.html"
+        path.write_bytes(response.content)
+        print(f"Saved {url} to {path}")
+
+
+def bench_lxml(paths, rounds):
+    pages = [Path(path).read_text(encoding="utf-8") for path in paths]
+    count = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for page in pages:
+            count += len(extract_listings_from_html(page, "https://flatfy.ua/"))
+    return count, time.perf_counter() - start
+
+
+def bench_selenium(paths, rounds):
+    from selenium.webdriver.common.by import By
+    from scrape_lands import create_driver, extract_listing_data
+
+    driver = create_driver()
+    try:
+        count = 0
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for path in paths:
+                driver.get(Path(path).resolve().as_uri())
+                for listing in driver.find_elements(By.XPATH, LISTING_XPATH):
+                    extract_listing_data(listing)
+                    count += 1
+        return count, time.perf_counter() - start
+    finally:
+        driver.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare extraction engines")
+    parser.add_argument("pages", nargs="+", help="saved HTML pages (or URLs with --save)")
+    parser.add_argument("--save", metavar="DIR", help="download the given URLs into DIR")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--skip-selenium", action="store_true")
+    args = parser.parse_args()
+
+    if args.save:
+        save_pages(args.save, args.pages)
+        return
+
+    engines = [("lxml", bench_lxml)]
+    if not args.skip_selenium:
+        engines.append(("selenium", bench_selenium))
+
+    for name, bench in engines:
+        count, elapsed = bench(args.pages, args.rounds)
+        rate = count / elapsed if elapsed else float("inf")
+        print(f"{name:>8}: {count} listings in {elapsed:.2f}s ({rate:.1f} listings/sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Point-in-polygon assignment with the STRtree against a loop over every polygon,
+# and the per-polygon price aggregation, on synthetic listings around Kharkiv.
+#
+#   python benchmarks/bench_listing_polygons.py --listings 1000000 --polygons 2000
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from listing_polygons import PolygonAccumulator, locate, points_in_polygons  # noqa: E402
+
+CENTER = (49.99, 36.23)
+SPREAD = 0.15
+
+
+def make_polygons(count, rng):
+    lats = CENTER[0] + rng.uniform(-SPREAD, SPREAD, count)
+    lons = CENTER[1] + rng.uniform(-SPREAD, SPREAD, count)
+    sizes = rng.uniform(0.001, 0.006, count)
+    return shapely.buffer(shapely.points(lons, lats), sizes, quad_segs=4)
+
+
+def make_points(count, rng):
+    return (
+        CENTER[0] + rng.uniform(-SPREAD, SPREAD, count),
+        CENTER[1] + rng.uniform(-SPREAD, SPREAD, count),
+    )
+
+
+# Every point tested against every polygon, as a plain loop would
+def naive_pairs(lons, lats, geometries):
+    points = shapely.points(lons, lats)
+    shapely.prepare(geometries)
+    pairs = 0
+    for geometry in geometries:
+        pairs += int(shapely.intersects(geometry, points).sum())
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark assigning listings to polygons")
+    parser.add_argument("--listings", type=int, default=1000000)
+    parser.add_argument("--polygons", type=int, default=2000)
+    parser.add_argument("--locations", type=int, default=5000, help="distinct listing locations")
+    parser.add_argument("--naive-sample", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    geometries = make_polygons(args.polygons, rng)
+
+    # Worst case, every listing has a point of its own
+    lats, lons = make_points(args.listings, rng)
+    start = time.perf_counter()
+    point_index, _ = points_in_polygons(lons, lats, geometries)
+    seconds = time.perf_counter() - start
+    print(
+        f"STRtree: {args.listings:,} points x {args.polygons:,} polygons in {seconds:.2f}s, "
+        f"{len(point_index):,} pairs"
+    )
+
+    sample = args.naive_sample
+    start = time.perf_counter()
+    naive_pairs(lons[:sample], lats[:sample], geometries)
+    seconds = time.perf_counter() - start
+    print(
+        f"Loop over polygons: {sample:,} points in {seconds:.2f}s, "
+        f"{seconds * args.listings / sample:.1f}s extrapolated to {args.listings:,}"
+    )
+
+    # Listings share their locations' points, as with geocoded location strings
+    location_lats, location_lons = make_points(args.locations, rng)
+    points = {f"location {i}": point for i, point in enumerate(zip(location_lats, location_lons))}
+    listings = pd.DataFrame(
+        {
+            "location": np.array(list(points), dtype=object)[
+                rng.integers(0, args.locations, args.listings)
+            ],
+            "price_per_sqm": rng.lognormal(6.5, 0.5, args.listings),
+        }
+    )
+    start = time.perf_counter()
+    location_polygons = locate(points, geometries)
+    accumulator = PolygonAccumulator()
+    assigned = 0
+    for chunk_start in range(0, args.listings, 10000):
+        assigned += accumulator.add(listings.iloc[chunk_start : chunk_start + 10000], location_polygons)
+    stats = accumulator.frame([f"polygon {i}" for i in range(args.polygons)], np.ones(args.polygons))
+    seconds = time.perf_counter() - start
+    print(
+        f"Locate {args.locations:,} locations and aggregate {args.listings:,} listings "
+        f"in {seconds:.2f}s, {assigned:,} assignments over {len(stats):,} polygons"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Accuracy and polygons/sec of the old google_maps_polygons.calculate_polygon_area
+# against polygon_area.polygon_areas on synthetic parcels at several latitudes.
+#
+#   python benchmarks/bench_polygon_area.py --polygons 10000
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+from geopy.distance import geodesic
+from shapely.geometry import Polygon
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from polygon_area import from_vertices, polygon_areas  # noqa: E402
+
+
+# Implementation as it was in google_maps_polygons.py, without the prints
+def calculate_polygon_area(vertices):
+    if vertices[0] != vertices[-1]:
+        vertices.append(vertices[0])
+    polygon = Polygon(vertices)
+    if not polygon.is_valid:
+        return 0
+    total_area = polygon.area
+    average_lat = sum(lat for lat, lon in vertices) / len(vertices)
+    lat_distance = geodesic((average_lat, 0), (average_lat + 1, 0)).meters
+    lon_distance = geodesic((0, vertices[0][1]), (0, vertices[0][1] + 1)).meters
+    return total_area * lat_distance * lon_distance
+
+
+# Irregular polygons of radius_km around random centers at the given latitude.
+# Varying radii make some rings self-intersect, the old function returned 0 for
+# those. Centers stay clear of the antimeridian, see polygon_area.polygon_areas.
+def make_polygons(count, latitude, radius_km, seed=0):
+    rng = np.random.default_rng(seed)
+    polygons = []
+    for _ in range(count):
+        lat = latitude + rng.uniform(-1, 1)
+        lon = rng.uniform(-170, 170)
+        sides = int(rng.integers(4, 24))
+        angles = np.sort(rng.uniform(0, 2 * math.pi, sides))
+        radii = radius_km * rng.uniform(0.6, 1.0, sides)
+        polygons.append([
+            (
+                lat + r * math.sin(a) / 111.32,
+                lon + r * math.cos(a) / (111.32 * math.cos(math.radians(lat))),
+            )
+            for a, r in zip(angles, radii)
+        ])
+    return polygons
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark polygon area computation")
+    parser.add_argument("--polygons", type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{'latitude':>8} {'radius':>8}  {'method':12} {'polygons/s':>12} {'median err':>11} {'max err':>9}")
+    for latitude, radius_km in [(10, 0.1), (50, 0.1), (50, 20), (70, 0.1), (70, 50)]:
+        polygons = make_polygons(args.polygons, latitude, radius_km)
+
+        geometries, build = timed(lambda: from_vertices(polygons))
+        reference, seconds = timed(lambda: polygon_areas(geometries, "geodesic"))
+        rows = [("geodesic", seconds + build, reference)]
+        areas, seconds = timed(lambda: polygon_areas(geometries, "equal_area"))
+        rows.append(("equal_area", seconds + build, areas))
+        areas, seconds = timed(lambda: np.array([calculate_polygon_area(list(p)) for p in polygons]))
+        rows.append(("old", seconds, areas))
+
+        for method, seconds, areas in rows:
+            error = np.abs(areas - reference) / reference * 100
+            print(
+                f"{latitude:8} {radius_km:6} km  {method:12} {len(polygons) / seconds:12,.0f} "
+                f"{np.median(error):10.4f}% {error.max():8.4f}%"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# Offline benchmark of the scrapers against a recorded page corpus.
+#
+# Record the corpus once (needs network, Firefox and geckodriver):
+#   python benchmarks/bench_scrapers.py --corpus corpus/ --record
+# Then replay it without network:
+#   python benchmarks/bench_scrapers.py --corpus corpus/ --no-sleep
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from instrumentation import metrics  # noqa: E402
+from replay import PageCorpus, ReplayServer, record_current_page, record_site  # noqa: E402
+
+FLATFY_URL = "https://flatfy.ua/uk/%D0%BF%D1%80%D0%BE%D0%B4%D0%B0%D0%B6-%D0%BA%D0%B2%D0%B0%D1%80%D1%82%D0%B8%D1%80-%D1%85%D0%B0%D1%80%D0%BA%D1%96%D0%B2"
+
+# Zone link XPath followed when recording each registered jurisdiction
+ZONE_LINK_XPATHS = {
+    "airway_heights": "//a[contains(text(), 'Zone') and not(starts-with(text(), 'Zone'))]",
+    "albion": "/html/body/div[3]/div[2]/ui-view/mcc-codes/div[2]/main/div[1]/mcc-codes-content/div/div[2]/div[2]/ul/li/mcc-codes-content-mini-toc-item/div/div/a",
+    "algona": "/html/body/div[1]/div[4]/div/div/main/div/article/ul/li/a",
+}
+
+# Detail page field filled by the browser pool entries, their detail pages are
+# recorded along with the Flatfy result page
+DETAIL_FIELDS = {"detail_title": "//h1"}
+POOL_WORKERS = (1, 2, 4)
+
+
+def record_corpus(corpus):
+    from auto_scrape_zones import JURISDICTIONS, init_driver
+
+    driver = init_driver()
+    try:
+        record_site(driver, corpus, FLATFY_URL)
+        record_detail_pages(driver, corpus)
+        for name, link_xpath in ZONE_LINK_XPATHS.items():
+            site = JURISDICTIONS[name]
+            record_site(driver, corpus, site["url"], [site["entry_xpath"], link_xpath])
+    finally:
+        driver.quit()
+
+
+# Record the detail pages of the listings on the recorded Flatfy page whose URL
+# resolves from the preview, the pool entries open them
+def record_detail_pages(driver, corpus, settle=3):
+    from scrape_lands import extract_listings_from_html
+
+    body, _ = corpus.load(FLATFY_URL)
+    for data in extract_listings_from_html(body, FLATFY_URL):
+        if data["url"] and data["url"] not in corpus.index:
+            driver.get(data["url"])
+            time.sleep(settle)
+            record_current_page(driver, corpus, data["url"])
+
+
+# Stand-in for the time module that skips sleeps
+def _no_sleep_time():
+    functions = {name: getattr(time, name) for name in dir(time) if not name.startswith("_")}
+    return types.SimpleNamespace(**dict(functions, sleep=lambda seconds: None))
+
+
+def run_flatfy(server, engine):
+    import scrape_lands
+
+    return len(scrape_lands.scrape_main_page(server.url_for(FLATFY_URL), limit=None, engine=engine))
+
+
+# The browser pool with detail pages. The results must come back in page order
+# whatever order the workers finish in, a mismatch fails the entry.
+def run_flatfy_pool(server, workers):
+    import scrape_lands
+
+    url = server.url_for(FLATFY_URL)
+    body, _ = server.corpus.load(FLATFY_URL)
+    expected = scrape_lands.extract_listings_from_html(server.rewrite(body), url)
+    results = scrape_lands.scrape_main_page_pool(
+        url, limit=None, workers=workers, detail_fields=DETAIL_FIELDS
+    )
+    want = [(data["title"], data["url"]) for data in expected]
+    # Listings that were clicked through have no URL to compare in the preview
+    got = [
+        (data["title"], data["url"] if want_url else None)
+        for data, (_, want_url) in zip(results, want)
+    ]
+    if got != want:
+        raise AssertionError(f"Pool results out of page order: {got} != {want}")
+    return len(results)
+
+
+def run_zones(server, name):
+    import auto_scrape_zones
+
+    # Same adapter, pointed at the replayed copy of the site
+    site = auto_scrape_zones.JURISDICTIONS[name]
+    return len(auto_scrape_zones.scrape_jurisdiction(dict(site, url=server.url_for(site["url"]))))
+
+
+SCRAPERS = {
+    "scrape_main_page[http]": lambda server: run_flatfy(server, "http"),
+    "scrape_main_page[selenium]": lambda server: run_flatfy(server, "selenium"),
+    **{
+        f"scrape_main_page_pool[workers={workers}]": (
+            lambda server, workers=workers: run_flatfy_pool(server, workers)
+        )
+        for workers in POOL_WORKERS
+    },
+    "scrape_zones_airway_heights": lambda server: run_zones(server, "airway_heights"),
+    "scrape_districts_albion": lambda server: run_zones(server, "albion"),
+    "scrape_districts_algona": lambda server: run_zones(server, "algona"),
+}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+# Besides throughput and memory, the p50/p95/p99 latency of every instrumented
+# phase (page_load, page_ready, element_lookup, detail_navigation, parse, ...)
+def run_benchmark(server, name):
+    server.reset_stats()
+    metrics.reset()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        items = SCRAPERS[name](server)
+        error = None
+    except Exception as e:
+        items, error = 0, str(e)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    pages = len(server.latencies) - server.misses
+    return {
+        "scraper": name,
+        "items": items,
+        "pages": pages,
+        "missing_pages": server.misses,
+        "seconds": round(elapsed, 3),
+        "pages_per_sec": round(pages / elapsed, 2) if elapsed else 0.0,
+        "serve_p50_ms": round(percentile(server.latencies, 0.5) * 1000, 2),
+        "serve_p95_ms": round(percentile(server.latencies, 0.95) * 1000, 2),
+        "serve_p99_ms": round(percentile(server.latencies, 0.99) * 1000, 2),
+        "python_peak_mb": round(peak / 2**20, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "phases": metrics.span_percentiles(),
+        "error": error,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scrapers against a recorded corpus")
+    parser.add_argument("--corpus", default="corpus")
+    parser.add_argument("--record", action="store_true", help="record the corpus from the live sites")
+    parser.add_argument("--no-sleep", action="store_true", help="skip the scrapers' fixed sleeps")
+    parser.add_argument("--only", choices=sorted(SCRAPERS), action="append")
+    parser.add_argument("--output", help="append results as JSON lines to this file")
+    args = parser.parse_args()
+
+    corpus = PageCorpus(args.corpus)
+    if args.record:
+        record_corpus(corpus)
+        return
+
+    if args.no_sleep:
+        import instrumentation
+
+        # The scrapers sleep through metrics.sleep()
+        instrumentation.time = _no_sleep_time()
+
+    metrics.keep_samples = True
+    with ReplayServer(corpus) as server:
+        for name in args.only or SCRAPERS:
+            result = run_benchmark(server, name)
+            print(json.dumps(result))
+            for phase, latency in result["phases"].items():
+                print(
+                    f"  {phase:<20} n={latency['count']:<6} p50 {latency['p50_ms']:>9.2f} ms  "
+                    f"p95 {latency['p95_ms']:>9.2f} ms  p99 {latency['p99_ms']:>9.2f} ms"
+                )
+            if args.output:
+                with open(args.output, "a") as f:
+                    f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
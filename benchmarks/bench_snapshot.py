@@ -0,0 +1,119 @@
+# Cold-start time and memory of the analysis input: every listing read from
+# MongoDB into pandas and cleaned, against the Parquet snapshot.
+#
+#   python benchmarks/bench_snapshot.py --uri mongodb://localhost:27017/ --listings 1000000
+#   python benchmarks/bench_snapshot.py --uri mongomock --listings 50000
+#
+# With a real server each load runs in a fresh process, so the max RSS it
+# reports is that load's own. mongomock lives in one process and loads run
+# there one after another, its RSS figures only grow.
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyze_lands import clean_listings, load_listings, summarize_frame  # noqa: E402
+from snapshot import export_snapshot, load_snapshot  # noqa: E402
+
+DATABASE = "hesti_benchmark"
+
+
+def get_collection(uri):
+    if uri == "mongomock":
+        import mongomock
+
+        client = mongomock.MongoClient()
+    else:
+        import pymongo
+
+        client = pymongo.MongoClient(uri)
+    return client[DATABASE]["land_listings"]
+
+
+def make_listing(index, now):
+    return {
+        "title": f"Ділянка {index}",
+        "location": f"Район {index % 500} Харків",
+        "price": f"{10000 + index % 90000:,} $".replace(",", " "),
+        "size": f"{20 + index % 200} м²",
+        "date": "01.06",
+        "description": "Benchmark listing " * 10,
+        "url": f"https://flatfy.ua/uk/realty/{index}",
+        "updated_at": now + timedelta(seconds=index),
+    }
+
+
+def seed(collection, listings, batch_size=10000):
+    collection.drop()
+    now = datetime(2026, 1, 1)
+    for start in range(0, listings, batch_size):
+        collection.insert_many(
+            [make_listing(index, now) for index in range(start, min(start + batch_size, listings))]
+        )
+
+
+def max_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def run_load(source, collection, directory):
+    start = time.perf_counter()
+    if source == "mongo":
+        df = clean_listings(load_listings(collection))
+    else:
+        df = load_snapshot(directory)
+    loaded = time.perf_counter() - start
+    summarize_frame(df)
+    return {
+        "source": source,
+        "rows": len(df),
+        "load_s": loaded,
+        "total_s": time.perf_counter() - start,
+        "max_rss_mb": max_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analysis cold start")
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
+    parser.add_argument("--listings", type=int, default=100000)
+    parser.add_argument("--directory", help="snapshot directory, a temporary one by default")
+    parser.add_argument("--load", choices=("mongo", "snapshot"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    collection = get_collection(args.uri)
+    if args.load:
+        print(json.dumps(run_load(args.load, collection, args.directory)))
+        return
+
+    with tempfile.TemporaryDirectory() as scratch:
+        directory = args.directory or os.path.join(scratch, "snapshot")
+        seed(collection, args.listings)
+        start = time.perf_counter()
+        export_snapshot(collection, directory)
+        print(f"Seeded {args.listings} listings, export took {time.perf_counter() - start:.2f}s")
+
+        for source in ("mongo", "snapshot"):
+            if args.uri == "mongomock":
+                result = run_load(source, collection, directory)
+            else:
+                command = [sys.executable, __file__, "--uri", args.uri, "--load", source,
+                           "--directory", directory]
+                result = json.loads(subprocess.check_output(command).decode().splitlines()[-1])
+            print(
+                f"{source:8} {result['rows']:>9} rows  load {result['load_s']:7.2f}s  "
+                f"with summary {result['total_s']:7.2f}s  max RSS {result['max_rss_mb']:8.1f} MB"
+            )
+        collection.drop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Startup time of the hesti CLI. Each command runs in a fresh interpreter, the
+# median of --runs is reported. The help and the light commands are guarded:
+# the script exits with status 1 when one takes longer than --budget, or when
+# hesti --help imports one of the heavy libraries.
+#
+#   python benchmarks/bench_startup.py
+#   python benchmarks/bench_startup.py --runs 20 --budget 200
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HESTI = os.path.join(ROOT, "hesti.py")
+
+# Arguments and whether the command is light enough to be held to the budget
+COMMANDS = [
+    (["--help"], True),
+    (["search", "--help"], True),
+    (["areas", "--help"], False),
+    (["snapshot", "--help"], False),
+    (["scrape", "--help"], False),
+    (["analyze", "--help"], False),
+    (["polygon-stats", "--help"], False),
+]
+
+HEAVY = ("pandas", "numpy", "matplotlib", "pymongo", "selenium", "shapely", "pyproj", "gmplot", "geopy")
+
+
+def time_command(arguments, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, HESTI, *arguments], check=True, capture_output=True, cwd=ROOT)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+# Top-level packages imported by a command, from python -X importtime
+def imported_packages(arguments):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", HESTI, *arguments], capture_output=True, text=True, cwd=ROOT
+    )
+    return {
+        line.rsplit("|", 1)[1].strip().split(".")[0]
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:") and "|" in line
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of the hesti CLI")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget", type=float, default=200, help="milliseconds for the light commands")
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        timings.append(time.perf_counter() - start)
+    print(f"{'python -c pass':28} {statistics.median(timings) * 1000:7.0f} ms")
+
+    failures = []
+    for arguments, guarded in COMMANDS:
+        elapsed = time_command(arguments, args.runs) * 1000
+        label = "hesti " + " ".join(arguments)
+        over = guarded and elapsed > args.budget
+        print(f"{label:28} {elapsed:7.0f} ms" + ("  over budget" if over else ""))
+        if over:
+            failures.append(label)
+
+    heavy = sorted(imported_packages(["--help"]) & set(HEAVY))
+    if heavy:
+        print(f"hesti --help imports {', '.join(heavy)}")
+        failures.append("hesti --help imports")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
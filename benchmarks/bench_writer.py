@@ -0,0 +1,72 @@
+# Compare per-document upserts with the BufferedWriter. Needs a MongoDB server,
+# the upserts are pipeline updates that mongomock does not evaluate.
+#
+#   python benchmarks/bench_writer.py --uri mongodb://localhost:27017/ --documents 20000
+import argparse
+import os
+import sys
+import time
+import pymongo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import BufferedWriter, ensure_indexes, upsert_listing  # noqa: E402
+
+
+def get_collection(uri):
+    client = pymongo.MongoClient(uri)
+    collection = client["hesti_benchmark"]["land_listings"]
+    collection.drop()
+    ensure_indexes(collection)
+    return collection
+
+
+def make_listing(index):
+    return {
+        "title": f"Ділянка {index}",
+        "location": f"Район {index % 50}",
+        "price": f"{10000 + index} $",
+        "size": f"{500 + index % 1000} м²",
+        "date": "01.06",
+        "description": "Benchmark listing " * 10,
+        "url": f"https://flatfy.ua/uk/realty/{index}",
+    }
+
+
+def bench_single(collection, documents):
+    start = time.perf_counter()
+    for index in range(documents):
+        upsert_listing(collection, make_listing(index))
+    elapsed = time.perf_counter() - start
+    return {"docs_per_sec": documents / elapsed}
+
+
+def bench_buffered(collection, documents, batch_size):
+    writer = BufferedWriter(collection, batch_size=batch_size)
+    for index in range(documents):
+        writer.add(make_listing(index))
+    writer.flush()
+    report = writer.report()
+    writer.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MongoDB write paths")
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
+    parser.add_argument("--documents", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    single = bench_single(get_collection(args.uri), args.documents)
+    print(f"update_one per document: {single['docs_per_sec']:.0f} docs/sec")
+
+    buffered = bench_buffered(get_collection(args.uri), args.documents, args.batch_size)
+    print(
+        f"BufferedWriter (batch {args.batch_size}): {buffered['docs_per_sec']:.0f} docs/sec, "
+        f"flush p50 {buffered['flush_p50_ms']:.1f} ms, p95 {buffered['flush_p95_ms']:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Index build time and query latency of zone_search.ZoneIndex on synthetic sections.
+#
+#   python benchmarks/bench_zone_search.py --sections 50000
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zone_search import ZoneIndex  # noqa: E402
+
+ZONE_CODES = ["R-1", "R-2", "R-3", "R-5", "R-10", "C-1", "C-2", "M-1", "I-1", "PUD", "MU", "AG"]
+WORDS = (
+    "minimum lot area width depth setback yard front rear side building height maximum "
+    "coverage density dwelling unit single family multifamily residential commercial "
+    "industrial accessory parking space square feet percent permitted conditional use "
+    "district zone overlay landscaping buffer street frontage structure sign fence "
+    "variance subdivision plat open space impervious surface stories feet acre"
+).split()
+QUERIES = [
+    "minimum lot area R-1",
+    "maximum building height commercial",
+    "accessory dwelling unit parking",
+    "front yard setback",
+    "impervious surface coverage percent",
+    "conditional use industrial",
+]
+
+
+def synthetic_zones(sections, jurisdictions, rng):
+    all_zones = {}
+    for number in range(jurisdictions):
+        url = f"https://codes.example/{number}"
+        all_zones[url] = [
+            {
+                "name": f"{rng.choice(ZONE_CODES)} {' '.join(rng.choices(WORDS, k=3)).title()}",
+                "description": " ".join(
+                    rng.choice(ZONE_CODES) if rng.random() < 0.05 else rng.choice(WORDS)
+                    for _ in range(rng.randint(40, 200))
+                ),
+                "link": f"{url}/section/{section}",
+            }
+            for section in range(sections // jurisdictions)
+        ]
+    return all_zones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the zoning full-text index")
+    parser.add_argument("--sections", type=int, default=50000)
+    parser.add_argument("--jurisdictions", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    all_zones = synthetic_zones(args.sections, args.jurisdictions, rng)
+    with tempfile.TemporaryDirectory() as directory:
+        index = ZoneIndex(os.path.join(directory, "index.sqlite3"))
+
+        start = time.perf_counter()
+        for url, zones in all_zones.items():
+            index.update_jurisdiction(url, zones)
+        print(f"Indexed {index.stats()} in {time.perf_counter() - start:.2f}s")
+
+        # Re-running the same crawl output touches nothing
+        start = time.perf_counter()
+        changed = sum(index.update_jurisdiction(url, zones) for url, zones in all_zones.items())
+        print(f"Unchanged resync: {changed} changed in {time.perf_counter() - start:.2f}s")
+
+        for query in QUERIES:
+            latencies = []
+            for _ in range(args.rounds):
+                start = time.perf_counter()
+                results = index.search(query)
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            print(
+                f"{query!r:40} {len(results):3} results  "
+                f"p50 {latencies[len(latencies) // 2] * 1000:6.1f} ms  "
+                f"max {latencies[-1] * 1000:6.1f} ms"
+            )
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
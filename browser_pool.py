@@ -0,0 +1,223 @@
+import atexit
+import itertools
+import os
+import threading
+from selenium import webdriver
+from selenium.webdriver.firefox.options import Options
+from selenium.webdriver.firefox.service import Service
+from instrumentation import metrics
+
+# Firefox preferences that stop a kind of asset from loading
+BLOCK_PREFERENCES = {
+    "images": {"permissions.default.image": 2},
+    "fonts": {"browser.display.use_document_fonts": 0, "gfx.downloadable_fonts.enabled": False},
+    "css": {"permissions.default.stylesheet": 2},
+}
+ALL_ASSETS = tuple(BLOCK_PREFERENCES)
+
+# Browsers are replaced after this many pages, Firefox grows over a long session
+DEFAULT_MAX_PAGES = 50
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+
+# Path of geckodriver, resolved once per process. HESTI_GECKODRIVER skips
+# webdriver_manager altogether.
+def geckodriver_path():
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path is None:
+            _driver_path = os.getenv("HESTI_GECKODRIVER")
+            if not _driver_path:
+                from webdriver_manager.firefox import GeckoDriverManager
+
+                _driver_path = GeckoDriverManager().install()
+        return _driver_path
+
+
+def firefox_options(user_agent=None, headless=True, blocked=ALL_ASSETS):
+    options = Options()
+    if headless:
+        options.add_argument("--headless")
+    if user_agent:
+        options.set_preference("general.useragent.override", user_agent)
+    for asset in blocked:
+        for name, value in BLOCK_PREFERENCES[asset].items():
+            options.set_preference(name, value)
+    return options
+
+
+def launch_driver(user_agent=None, headless=True, blocked=ALL_ASSETS):
+    with metrics.span("driver_startup"):
+        return webdriver.Firefox(
+            service=Service(geckodriver_path()),
+            options=firefox_options(user_agent, headless, blocked),
+        )
+
+
+def is_healthy(driver):
+    try:
+        return driver.execute_script("return 1") == 1 and bool(driver.window_handles)
+    except Exception:
+        return False
+
+
+# Pool of warm headless browsers. acquire() hands out an idle browser or launches
+# one while fewer than size exist, and blocks otherwise. Browsers are health
+# checked when handed out and replaced after max_pages pages.
+class BrowserPool:
+    def __init__(
+        self,
+        size=2,
+        max_pages=DEFAULT_MAX_PAGES,
+        user_agents=None,
+        headless=True,
+        blocked=ALL_ASSETS,
+    ):
+        self.size = size
+        self.max_pages = max_pages
+        self.user_agents = itertools.cycle(user_agents or [None])
+        self.headless = headless
+        self.blocked = blocked
+        self.idle = []
+        self.pages = {}
+        self.launched = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _launch(self):
+        with self.condition:
+            user_agent = next(self.user_agents)
+        try:
+            driver = launch_driver(user_agent, self.headless, self.blocked)
+        except Exception:
+            with self.condition:
+                self.launched -= 1
+                self.condition.notify()
+            raise
+        metrics.count("browsers_launched")
+        with self.condition:
+            self.pages[driver.session_id] = 0
+        return driver
+
+    def _retire(self, driver):
+        with self.condition:
+            self.pages.pop(driver.session_id, None)
+            self.launched -= 1
+            self.condition.notify()
+        try:
+            driver.quit()
+        except Exception as e:
+            print(f"Failed to quit browser: {e}")
+
+    # Launch browsers in parallel until count (default size) are idle
+    def prewarm(self, count=None):
+        with self.condition:
+            count = min(count or self.size, self.size) - len(self.idle)
+            count = min(count, self.size - self.launched)
+            self.launched += max(count, 0)
+
+        def warm():
+            try:
+                driver = self._launch()
+            except Exception as e:
+                print(f"Failed to launch browser: {e}")
+                return
+            with self.condition:
+                self.idle.append(driver)
+                self.condition.notify()
+
+        threads = [threading.Thread(target=warm) for _ in range(max(count, 0))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def acquire(self):
+        while True:
+            with self.condition:
+                while not self.closed and not self.idle and self.launched >= self.size:
+                    self.condition.wait()
+                if self.closed:
+                    raise RuntimeError("Browser pool is closed")
+                if self.idle:
+                    driver = self.idle.pop()
+                else:
+                    self.launched += 1
+                    driver = None
+            if driver is None:
+                return self._launch()
+            if is_healthy(driver):
+                return driver
+            print("Replacing unhealthy browser")
+            metrics.count("browsers_unhealthy")
+            self._retire(driver)
+
+    # Give a browser back after it loaded pages pages
+    def release(self, driver, pages=1):
+        with self.condition:
+            self.pages[driver.session_id] = self.pages.get(driver.session_id, 0) + pages
+            worn_out = self.pages[driver.session_id] >= self.max_pages
+        if worn_out or self.closed or not self._reset(driver):
+            metrics.count("browsers_recycled")
+            self._retire(driver)
+            return
+        with self.condition:
+            self.idle.append(driver)
+            self.condition.notify()
+
+    # Close extra tabs and leave the page, so the next user starts clean
+    def _reset(self, driver):
+        try:
+            for handle in driver.window_handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(driver.window_handles[0])
+            driver.get("about:blank")
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.condition.notify_all()
+        for driver in idle:
+            self._retire(driver)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# Named process-wide pool, created on first use. A later call with a larger
+# size grows the pool.
+def get_browser_pool(name="default", size=2, **options):
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = BrowserPool(size, **options)
+    with pool.condition:
+        if size > pool.size:
+            pool.size = size
+            pool.condition.notify_all()
+    return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close_pools)
@@ -1,4 +1,172 @@
+import os
+import threading
 import pymongo
-client = pymongo.MongoClient("mongodb://localhost:27017/")
-db = client["real_estate"]
-collection = db["land_listings"]
+from pymongo import monitoring
+
+# Settings come from the environment and are read when the client is first used:
+#   HESTI_MONGO_URI, HESTI_MONGO_DB, HESTI_MONGO_COLLECTION
+#   HESTI_MONGO_MAX_POOL_SIZE, HESTI_MONGO_MIN_POOL_SIZE, HESTI_MONGO_WAIT_QUEUE_TIMEOUT_MS
+#   HESTI_MONGO_SERVER_SELECTION_TIMEOUT_MS, HESTI_MONGO_CONNECT_TIMEOUT_MS,
+#   HESTI_MONGO_SOCKET_TIMEOUT_MS, HESTI_MONGO_WRITE_CONCERN (e.g. "1" or "majority")
+DEFAULT_URI = "mongodb://localhost:27017/"
+DEFAULT_DB = "real_estate"
+DEFAULT_COLLECTION = "land_listings"
+
+
+def _int_env(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def get_settings():
+    write_concern = os.getenv("HESTI_MONGO_WRITE_CONCERN", "1")
+    return {
+        "uri": os.getenv("HESTI_MONGO_URI", DEFAULT_URI),
+        "db": os.getenv("HESTI_MONGO_DB", DEFAULT_DB),
+        "collection": os.getenv("HESTI_MONGO_COLLECTION", DEFAULT_COLLECTION),
+        "client_options": {
+            "maxPoolSize": _int_env("HESTI_MONGO_MAX_POOL_SIZE", 50),
+            "minPoolSize": _int_env("HESTI_MONGO_MIN_POOL_SIZE", 0),
+            "waitQueueTimeoutMS": _int_env("HESTI_MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000),
+            "serverSelectionTimeoutMS": _int_env(
+                "HESTI_MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000
+            ),
+            "connectTimeoutMS": _int_env("HESTI_MONGO_CONNECT_TIMEOUT_MS", 10000),
+            "socketTimeoutMS": _int_env("HESTI_MONGO_SOCKET_TIMEOUT_MS", 60000),
+            "w": int(write_concern) if write_concern.isdigit() else write_concern,
+        },
+    }
+
+
+# Connection pool listener that keeps checked-out connections and checkout wait times
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.open_connections = 0
+            self.checked_out = 0
+            self.max_checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.wait_time = 0.0
+            self.max_wait_time = 0.0
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "open_connections": self.open_connections,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "avg_wait_ms": self.wait_time / self.checkouts * 1000 if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait_time * 1000,
+            }
+
+    def connection_checked_out(self, event):
+        wait = getattr(event, "duration", None) or 0.0
+        with self.lock:
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.checkouts += 1
+            self.wait_time += wait
+            self.max_wait_time = max(self.max_wait_time, wait)
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.checkout_failures += 1
+
+    def connection_created(self, event):
+        with self.lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.open_connections -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+pool_metrics = PoolMetrics()
+
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+
+# Process-wide client, created on first use and re-created in forked children
+def get_client():
+    global _client, _client_pid
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            settings = get_settings()
+            _client = pymongo.MongoClient(
+                settings["uri"], event_listeners=[pool_metrics], **settings["client_options"]
+            )
+            _client_pid = os.getpid()
+        return _client
+
+
+def get_db(name=None):
+    return get_client()[name or get_settings()["db"]]
+
+
+def get_collection(name=None):
+    return get_db()[name or get_settings()["collection"]]
+
+
+def close_client():
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def _reset_after_fork():
+    global _client, _client_pid, _lock
+    # The parent's sockets must not be used in the child, drop the client without closing it
+    _client = None
+    _client_pid = None
+    _lock = threading.Lock()
+    pool_metrics.lock = threading.Lock()
+    pool_metrics.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# Keep `from connector import collection` working, now resolved lazily
+def __getattr__(name):
+    if name == "client":
+        return get_client()
+    if name == "db":
+        return get_db()
+    if name == "collection":
+        return get_collection()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,355 @@
+import argparse
+import re
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+from instrumentation import metrics
+
+DEFAULT_PATH = "dedup.sqlite3"
+
+# 128 hash functions in 16 bands of 8 rows. Two descriptions with Jaccard
+# similarity s share a band with probability 1 - (1 - s^8)^16: 0.94 at s=0.8,
+# 0.39 at s=0.6 and 0.04 at s=0.4. Candidates are then checked against THRESHOLD.
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+THRESHOLD = 0.8
+
+# Descriptions are compared as sets of overlapping three-word shingles
+SHINGLE_SIZE = 3
+
+# Multiply-shift hashing of the 32 bit shingle hashes: the upper 32 bits of
+# a * x + b in wrapping 64 bit arithmetic, a odd. No modulo, so numpy stays fast.
+_rng = np.random.default_rng(20240601)
+PERM_A = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+PERM_B = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+BAND_MIX = _rng.integers(1, 2**63, ROWS, dtype=np.uint64) | np.uint64(1)
+
+# Shingles hashed against the permutations at once, bounds the temporary array
+# to NUM_PERM * SIGNATURE_BLOCK 64 bit values
+SIGNATURE_BLOCK = 65536
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    listing TEXT NOT NULL UNIQUE,
+    cluster INTEGER NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_cluster ON documents (cluster);
+CREATE TABLE IF NOT EXISTS bands (
+    band INTEGER NOT NULL,
+    key INTEGER NOT NULL,
+    document INTEGER NOT NULL,
+    PRIMARY KEY (band, key, document)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# SQLite limits the number of ? in one statement
+LOOKUP_BATCH = 500
+
+WORD = re.compile(r"\w+")
+
+
+# Words of every text hashed with pandas' stable hash, and the offset of each
+# text's first word
+def _word_hashes(texts):
+    words = [WORD.findall(text.lower()) if isinstance(text, str) else [] for text in texts]
+    counts = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+    flat = np.array([word for text_words in words for word in text_words], dtype=object)
+    hashes = pd.util.hash_array(flat) if len(flat) else np.empty(0, dtype=np.uint64)
+    return hashes, counts
+
+
+# 32 bit hashes of the shingles of every text, the shingle count per text. A
+# text shorter than SHINGLE_SIZE words is one shingle of all its words.
+def shingle_hashes(texts):
+    hashes, counts = _word_hashes(texts)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    position = np.arange(len(hashes)) - np.repeat(starts, counts)
+    length = np.repeat(counts, counts)
+    combined = hashes.copy()
+    for offset in range(1, SHINGLE_SIZE):
+        shifted = np.zeros_like(hashes)
+        shifted[:-offset] = hashes[offset:]
+        # Words past the end of a text belong to the next one and are left out
+        combined = combined * np.uint64(1000003) ^ np.where(position + offset < length, shifted, 0)
+    shingle_counts = np.maximum(counts - SHINGLE_SIZE + 1, np.minimum(counts, 1))
+    keep = position < np.repeat(shingle_counts, counts)
+    return combined[keep] & np.uint64(0xFFFFFFFF), shingle_counts
+
+
+# MinHash signatures, one row of NUM_PERM values per text with shingles
+def minhash_signatures(shingles, counts):
+    texts = len(counts)
+    signatures = np.empty((texts, NUM_PERM), dtype=np.uint32)
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    text = 0
+    while text < texts:
+        # As many whole texts as fit into one block
+        last = max(text + 1, int(np.searchsorted(ends, starts[text] + SIGNATURE_BLOCK, "right")))
+        block = shingles[starts[text] : ends[last - 1]]
+        hashed = (PERM_A[:, None] * block[None, :] + PERM_B[:, None]) >> np.uint64(32)
+        signatures[text:last] = np.minimum.reduceat(
+            hashed.astype(np.uint32), starts[text:last] - starts[text], axis=1
+        ).T
+        text = last
+    return signatures
+
+
+# LSH bucket key of every band of every signature, shape (texts, BANDS)
+def band_keys(signatures):
+    bands = signatures.reshape(len(signatures), BANDS, ROWS).astype(np.uint64)
+    return (bands * BAND_MIX).sum(axis=2).view(np.int64)
+
+
+def similarity(signature, other):
+    return float(np.mean(signature == other))
+
+
+# Persistent MinHash LSH index of listing descriptions. Listings whose estimated
+# Jaccard similarity reaches threshold are put in one cluster, clusters are
+# merged as later listings connect them and never split.
+class DedupIndex:
+    def __init__(self, path=DEFAULT_PATH, threshold=THRESHOLD):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def get_state(self, name):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM state WHERE name = ?", (name,)).fetchone()
+        return row["value"] if row else None
+
+    def set_state(self, name, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (name, value))
+
+    def _select(self, sql, values):
+        rows = []
+        for start in range(0, len(values), LOOKUP_BATCH):
+            batch = values[start : start + LOOKUP_BATCH]
+            rows.extend(self.conn.execute(sql.format(", ".join("?" * len(batch))), batch))
+        return rows
+
+    # Index listings by id and description, new or changed. Returns listing ->
+    # cluster listing for every listing whose cluster changed, the cluster is
+    # named after its oldest listing.
+    def add(self, listings, descriptions):
+        listings = [str(listing) for listing in listings]
+        if not listings:
+            return {}
+        with metrics.span("dedup_signatures"):
+            shingles, counts = shingle_hashes(descriptions)
+            has_text = counts > 0
+            listings = [listing for listing, keep in zip(listings, has_text) if keep]
+            signatures = minhash_signatures(shingles, counts[has_text])
+            keys = band_keys(signatures)
+        if not listings:
+            return {}
+
+        with self.lock, self.conn:
+            ids = self._store(listings, signatures, keys)
+            pairs = self._candidates(ids, keys)
+            merged = self._cluster(ids, signatures, pairs)
+        metrics.count("dedup_documents", len(listings))
+        metrics.count("dedup_candidate_pairs", len(pairs))
+        return merged
+
+    def _store(self, listings, signatures, keys):
+        existing = {
+            row["listing"]: row
+            for row in self._select(
+                "SELECT id, listing, signature FROM documents WHERE listing IN ({})", listings
+            )
+        }
+        # A changed listing leaves its old buckets
+        stale = []
+        for row in existing.values():
+            old_keys = band_keys(np.frombuffer(row["signature"], dtype=np.uint32)[None, :])[0]
+            stale.extend((band, int(key), row["id"]) for band, key in enumerate(old_keys))
+        self.conn.executemany(
+            "DELETE FROM bands WHERE band = ? AND key = ? AND document = ?", stale
+        )
+
+        next_id = (self.conn.execute("SELECT MAX(id) FROM documents").fetchone()[0] or 0) + 1
+        ids = np.empty(len(listings), dtype=np.int64)
+        rows = []
+        for position, listing in enumerate(listings):
+            if listing in existing:
+                ids[position] = existing[listing]["id"]
+                self.conn.execute(
+                    "UPDATE documents SET signature = ? WHERE id = ?",
+                    (signatures[position].tobytes(), int(ids[position])),
+                )
+            else:
+                ids[position] = next_id
+                rows.append((next_id, listing, next_id, signatures[position].tobytes()))
+                next_id += 1
+        self.conn.executemany("INSERT INTO documents VALUES (?, ?, ?, ?)", rows)
+        return ids
+
+    # Pairs of documents sharing a band bucket with one of the batch, found
+    # through a temporary probe table that is then added to the bands
+    def _candidates(self, ids, keys):
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS probe (band INTEGER, key INTEGER, document INTEGER)"
+        )
+        self.conn.execute("DELETE FROM probe")
+        bands = np.tile(np.arange(BANDS), len(ids))
+        documents = np.repeat(ids, BANDS)
+        self.conn.executemany(
+            "INSERT INTO probe VALUES (?, ?, ?)",
+            np.column_stack((bands, keys.ravel(), documents)).tolist(),
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS temp.probe_key ON probe (band, key)")
+        pairs = set()
+        for sql in (
+            # Earlier documents in the index, CROSS JOIN keeps the probe as the outer loop
+            "SELECT p.document, b.document FROM probe p "
+            "CROSS JOIN bands b ON b.band = p.band AND b.key = p.key",
+            # Documents of the same batch
+            "SELECT p.document, q.document FROM probe p "
+            "JOIN probe q ON q.band = p.band AND q.key = p.key AND q.document < p.document",
+        ):
+            pairs.update(self.conn.execute(sql))
+        # In key order the inserts walk the bands b-tree instead of jumping around it
+        self.conn.execute(
+            "INSERT OR IGNORE INTO bands SELECT band, key, document FROM probe "
+            "ORDER BY band, key, document"
+        )
+        return list(pairs)
+
+    # Verify candidate pairs on their signatures and merge the clusters of the
+    # similar ones, returns the new cluster of every listing in a merged cluster
+    def _cluster(self, ids, signatures, pairs):
+        if not pairs:
+            return {}
+        documents = sorted({document for pair in pairs for document in pair})
+        rows = {
+            row["id"]: row
+            for row in self._select(
+                "SELECT id, cluster, signature FROM documents WHERE id IN ({})", documents
+            )
+        }
+        batch = {int(document): position for position, document in enumerate(ids)}
+
+        def signature_of(document):
+            if document in batch:
+                return signatures[batch[document]]
+            return np.frombuffer(rows[document]["signature"], dtype=np.uint32)
+
+        parent = {}
+
+        def find(cluster):
+            while parent.get(cluster, cluster) != cluster:
+                cluster = parent[cluster]
+            return cluster
+
+        for first, second in pairs:
+            if similarity(signature_of(first), signature_of(second)) < self.threshold:
+                continue
+            roots = sorted((find(rows[first]["cluster"]), find(rows[second]["cluster"])))
+            if roots[0] != roots[1]:
+                parent[roots[1]] = roots[0]
+
+        merged = {}
+        for cluster in parent:
+            root = find(cluster)
+            self.conn.execute("UPDATE documents SET cluster = ? WHERE cluster = ?", (root, cluster))
+            merged.setdefault(root, None)
+        if not merged:
+            return {}
+        names = {
+            row["id"]: row["listing"]
+            for row in self._select("SELECT id, listing FROM documents WHERE id IN ({})", list(merged))
+        }
+        changed = {}
+        for row in self._select(
+            "SELECT listing, cluster FROM documents WHERE cluster IN ({})", list(merged)
+        ):
+            changed[row["listing"]] = names[row["cluster"]]
+        metrics.count("dedup_merges", len(parent))
+        return changed
+
+    # Listing -> cluster listing of every listing that has duplicates
+    def clusters(self):
+        with self.lock:
+            return {
+                row["listing"]: row["root"]
+                for row in self.conn.execute(
+                    "SELECT d.listing, r.listing AS root FROM documents d "
+                    "JOIN documents r ON r.id = d.cluster "
+                    "WHERE d.cluster IN (SELECT cluster FROM documents GROUP BY cluster "
+                    "HAVING COUNT(*) > 1)"
+                )
+            }
+
+    def stats(self):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT cluster) FROM documents"
+            ).fetchone()
+        return {"listings": row[0], "clusters": row[1], "duplicates": row[0] - row[1]}
+
+
+def _listing_id(value):
+    from bson import ObjectId
+
+    return ObjectId(value) if ObjectId.is_valid(value) else value
+
+
+# Index the listings changed since the last run and store the cluster of every
+# listing whose cluster changed in its cluster field
+def deduplicate(collection, index, chunk_size=10000):
+    from pymongo import UpdateOne
+    from analyze_lands import iter_raw_chunks
+
+    watermark = index.get_state("watermark")
+    query = {"updated_at": {"$gte": pd.Timestamp(watermark).to_pydatetime()}} if watermark else {}
+    fields = ("_id", "description", "updated_at")
+    changed = 0
+    for raw in iter_raw_chunks(collection, chunk_size, fields, query, sort=[("updated_at", 1)]):
+        clusters = index.add(raw["_id"].tolist(), raw["description"].tolist())
+        operations = [
+            UpdateOne({"_id": _listing_id(listing)}, {"$set": {"cluster": cluster}})
+            for listing, cluster in clusters.items()
+        ]
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+        changed += len(operations)
+        latest = pd.to_datetime(raw["updated_at"]).max()
+        if pd.notna(latest):
+            index.set_state("watermark", latest.isoformat())
+    print(f"Deduplicated, {changed} listings changed cluster, {index.stats()}")
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster near-duplicate listings")
+    parser.add_argument("--index", default=DEFAULT_PATH)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    from connector import get_collection
+
+    index = DedupIndex(args.index, args.threshold)
+    deduplicate(get_collection(), index)
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
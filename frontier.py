@@ -0,0 +1,114 @@
+import random
+import sqlite3
+import threading
+import time
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    seed TEXT NOT NULL,
+    page_number INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_status ON pages (status, next_attempt_at);
+-- Stored listing URLs were once tracked here, MongoDB is the record of them now
+DROP TABLE IF EXISTS listings;
+"""
+
+
+# Persistent crawl frontier of result pages backed by SQLite. Stored listings are
+# tracked in MongoDB by their fingerprint, see storage.is_unchanged.
+class CrawlFrontier:
+    def __init__(self, path="frontier.sqlite3", max_attempts=5, base_delay=30, max_delay=3600):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        # Pages a killed run was working on go back to the queue
+        with self.conn:
+            self.conn.execute(
+                "UPDATE pages SET status = ? WHERE status = ?", (PENDING, IN_PROGRESS)
+            )
+
+    def close(self):
+        self.conn.close()
+
+    def add_page(self, url, seed=None, page_number=1):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO pages (url, seed, page_number, status, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (url, seed or url, page_number, PENDING, time.time()),
+            )
+
+    # Claim the next page that is due, or None if nothing is due right now
+    def next_page(self):
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT * FROM pages WHERE status = ? AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at, seed, page_number LIMIT 1",
+                (PENDING, time.time()),
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE pages SET status = ?, updated_at = ? WHERE url = ?",
+                (IN_PROGRESS, time.time(), row["url"]),
+            )
+            return dict(row)
+
+    # Seconds until the next pending page is due, None when the crawl is finished
+    def next_retry_in(self):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT MIN(next_attempt_at) FROM pages WHERE status = ?", (PENDING,)
+            ).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def mark_done(self, url):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE pages SET status = ?, last_error = NULL, updated_at = ? WHERE url = ?",
+                (DONE, time.time(), url),
+            )
+
+    # Schedule a retry with exponential backoff and jitter, give up after max_attempts
+    def mark_failed(self, url, error):
+        with self.lock, self.conn:
+            attempts = self.conn.execute(
+                "SELECT attempts FROM pages WHERE url = ?", (url,)
+            ).fetchone()[0] + 1
+            if attempts >= self.max_attempts:
+                status, next_attempt_at = FAILED, 0
+            else:
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+                status = PENDING
+                next_attempt_at = time.time() + random.uniform(delay / 2, delay)
+            self.conn.execute(
+                "UPDATE pages SET status = ?, attempts = ?, next_attempt_at = ?, "
+                "last_error = ?, updated_at = ? WHERE url = ?",
+                (status, attempts, next_attempt_at, str(error), time.time(), url),
+            )
+        return status
+
+    def stats(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM pages GROUP BY status"
+            ).fetchall()
+        return {status: count for status, count in rows}
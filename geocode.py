@@ -0,0 +1,153 @@
+import csv
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+import requests
+from instrumentation import metrics
+from politeness import get_scheduler, polite_get
+
+DEFAULT_PATH = "geocode_cache.sqlite3"
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+# Nominatim's usage policy allows one request per second
+NOMINATIM_RATE = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS geocodes (
+    location TEXT PRIMARY KEY,
+    lat REAL,
+    lon REAL,
+    source TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# SQLite limits the number of ? in one statement
+LOOKUP_BATCH = 500
+
+WORD = re.compile(r"\w+")
+
+
+# Lowercase words of a location string without punctuation, so
+# "Салтівський (Московський) Харків" and "салтівський московський харків" match
+def normalize(location):
+    return " ".join(WORD.findall(location.lower()))
+
+
+# Offline geocoder reading a CSV of name,lat,lon places. Scraped locations run
+# from the most specific part to the city ("Левада Основ’янський Харків"), so a
+# location without an entry of its own falls back to its district or city by
+# dropping leading words.
+class Gazetteer:
+    name = "gazetteer"
+
+    def __init__(self, path):
+        self.places = {}
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                self.places[normalize(row["name"])] = (float(row["lat"]), float(row["lon"]))
+
+    def lookup(self, location):
+        words = normalize(location).split()
+        for start in range(len(words)):
+            point = self.places.get(" ".join(words[start:]))
+            if point is not None:
+                return point
+        return None
+
+
+# Online geocoder on the OpenStreetMap Nominatim API, rate limited through the
+# shared politeness scheduler
+class NominatimGeocoder:
+    name = "nominatim"
+
+    def __init__(self, session=None, scheduler=None, user_agent="hesti-geocoder", country_codes="ua"):
+        self.session = session or requests.Session()
+        self.session.headers["User-Agent"] = user_agent
+        self.scheduler = scheduler or get_scheduler()
+        self.scheduler.overrides.setdefault(
+            urlparse(NOMINATIM_URL).netloc, {"rate": NOMINATIM_RATE, "max_rate": NOMINATIM_RATE}
+        )
+        self.country_codes = country_codes
+
+    def lookup(self, location):
+        params = {"q": location, "format": "jsonv2", "limit": 1}
+        if self.country_codes:
+            params["countrycodes"] = self.country_codes
+        results = polite_get(self.session, NOMINATIM_URL, self.scheduler, params=params).json()
+        if not results:
+            return None
+        return float(results[0]["lat"]), float(results[0]["lon"])
+
+
+# Persistent cache of location string -> (lat, lon) in front of a geocoder. Misses
+# are cached as well and only asked again from a different geocoder.
+class GeocodeCache:
+    def __init__(self, path=DEFAULT_PATH, geocoder=None):
+        self.geocoder = geocoder
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _cached(self, locations):
+        rows = {}
+        with self.lock:
+            for start in range(0, len(locations), LOOKUP_BATCH):
+                batch = locations[start : start + LOOKUP_BATCH]
+                placeholders = ", ".join("?" * len(batch))
+                for row in self.conn.execute(
+                    f"SELECT * FROM geocodes WHERE location IN ({placeholders})", batch
+                ):
+                    rows[row["location"]] = row
+        return rows
+
+    # Points of the distinct locations, location -> (lat, lon) or None. Only
+    # locations not in the cache reach the geocoder.
+    def geocode_many(self, locations):
+        locations = list(dict.fromkeys(location for location in locations if location))
+        cached = self._cached(locations)
+        points = {}
+        missing = []
+        for location in locations:
+            row = cached.get(location)
+            retry = row is not None and row["lat"] is None and self.geocoder is not None
+            if row is None or (retry and row["source"] != self.geocoder.name):
+                missing.append(location)
+            else:
+                points[location] = None if row["lat"] is None else (row["lat"], row["lon"])
+        metrics.count("geocode_cache", len(points), status="hit")
+        metrics.count("geocode_cache", len(missing), status="miss")
+
+        if missing and self.geocoder is None:
+            points.update(dict.fromkeys(missing))
+            return points
+        rows = []
+        for location in missing:
+            try:
+                point = self.geocoder.lookup(location)
+            except requests.RequestException as e:
+                # Not cached, the next run asks again
+                print(f"Failed to geocode {location}: {e}")
+                points[location] = None
+                continue
+            points[location] = point
+            lat, lon = point or (None, None)
+            rows.append((location, lat, lon, self.geocoder.name, time.time()))
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?)", rows)
+        return points
+
+    def geocode(self, location):
+        return self.geocode_many([location]).get(location)
+
+    def stats(self):
+        with self.lock:
+            row = self.conn.execute("SELECT COUNT(*), COUNT(lat) FROM geocodes").fetchone()
+        return {"locations": row[0], "found": row[1]}
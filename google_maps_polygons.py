@@ -1,50 +1,18 @@
-import gmplot
 import webbrowser
 import os
-from shapely.geometry import Polygon
-from geopy.distance import geodesic
-from dotenv import load_dotenv
+from polygon_area import polygon_area
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Function to calculate the area of a polygon given its vertices using geodesic distances
+# Function to calculate the area of a polygon given its (lat, lon) vertices on the
+# WGS84 ellipsoid. The vertices are left as they are, the ring is closed internally.
 def calculate_polygon_area(vertices):
-    print("======================================")
-    print(f"Original vertices: {vertices}")
-
-    # Close the polygon by repeating the first coordinate at the end
-    if vertices[0] != vertices[-1]:
-        vertices.append(vertices[0])
-    
-    print(f"Closed vertices: {vertices}")
-    print("======================================")
-    polygon = Polygon(vertices)
-    if not polygon.is_valid:
-        print("Invalid polygon")
-        return 0
-
-    try:
-        # Calculate the area in degrees
-        total_area = polygon.area
-        print("======================================")
-        print(f"Area in degrees: {total_area}")
-
-        # Convert the area from degrees to square meters
-        average_lat = sum(lat for lat, lon in vertices) / len(vertices)
-        lat_distance = geodesic((average_lat, 0), (average_lat + 1, 0)).meters
-        lon_distance = geodesic((0, vertices[0][1]), (0, vertices[0][1] + 1)).meters
-        area_in_square_meters = total_area * lat_distance * lon_distance
-
-        print(f"Polygon area in square meters: {area_in_square_meters}")
-        print("======================================")
-        return area_in_square_meters
-    except Exception as e:
-        print(f"Error calculating polygon area: {e}")
-        return 0
+    area_in_square_meters = polygon_area(vertices)
+    print(f"Polygon area in square meters: {area_in_square_meters}")
+    return area_in_square_meters
 
 # Function to create a Google Map with polygons
 def create_google_map(polygons, api_key):
+    import gmplot
+
     # Center the map on the first polygon's first coordinate
     if polygons:
         center_lat, center_lng = polygons[0]["coordinates"][0]
@@ -102,6 +70,10 @@ def get_polygons_from_user():
 
 # Main function
 def main():
+    # Load environment variables from .env file
+    from dotenv import load_dotenv
+
+    load_dotenv()
     api_key = os.getenv("GOOGLE_MAPS_API_KEY")  # Get the API key from the environment variable
     if not api_key:
         raise ValueError("API key not found. Please set the GOOGLE_MAPS_API_KEY environment variable.")
@@ -0,0 +1,45 @@
+import argparse
+import importlib
+import sys
+
+# Subcommands as (module, function, help). The module is imported only when its
+# subcommand runs, so the help and the light commands never load pandas,
+# matplotlib, selenium or shapely. The function parses the remaining arguments.
+COMMANDS = {
+    "scrape": ("scrape_lands", "cli", "crawl the Flatfy listings into MongoDB"),
+    "zones": ("auto_scrape_zones", "cli", "scrape the zoning codes of the registered jurisdictions"),
+    "search": ("zone_search", "main", "full-text search of the scraped zoning sections"),
+    "analyze": ("analyze_lands", "cli", "price per square meter, categories and the top locations chart"),
+    "snapshot": ("snapshot", "main", "export or compact the Parquet snapshot of the listings"),
+    "dedup": ("dedup", "main", "cluster near-duplicate listings"),
+    "polygons": ("google_maps_polygons", "main", "draw polygons on a Google Map and print their areas"),
+    "areas": ("polygon_area", "main", "compute the areas of polygons from a GeoJSON or CSV file"),
+    "polygon-stats": ("listing_polygons", "cli", "assign listings to polygons and summarize their prices"),
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="hesti",
+        description="HESTI real estate scraper and analysis",
+        epilog="Run hesti <command> --help for the options of a command.",
+    )
+    subparsers = parser.add_subparsers(dest="command", metavar="command", required=True)
+    for name, (_, _, help) in COMMANDS.items():
+        # The command's own parser handles its arguments and --help
+        subparsers.add_parser(name, help=help, add_help=False)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # Only the command name is parsed here, an unknown one or no command exits with usage
+    args = build_parser().parse_args(argv[:1])
+    module, function, _ = COMMANDS[args.command]
+    # argparse takes its prog from argv[0], so usage and errors read "hesti <command>"
+    sys.argv = [f"hesti {args.command}", *argv[1:]]
+    return getattr(importlib.import_module(module), function)()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the span histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Span that sleep() records under, everything else counts as working time
+SLEEP_SPAN = "sleep"
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # Cumulative counts per upper bound, the way Prometheus expects them
+    def cumulative(self):
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+# Counters, histograms and timing spans of one scraping run. Spans nest per
+# thread, so the summary can attribute each second to the innermost phase.
+# With keep_samples every observed value is kept too, for exact percentiles in
+# benchmarks; a scraping run only needs the histogram buckets.
+class Metrics:
+    def __init__(self, prefix="hesti", buckets=DEFAULT_BUCKETS, keep_samples=False):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.keep_samples = keep_samples
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.samples = {}
+            self.self_times = {}
+            self.started = time.perf_counter()
+
+    def count(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.buckets)
+            self.histograms[key].observe(value)
+            if self.keep_samples:
+                self.samples.setdefault(key, []).append(value)
+
+    @contextmanager
+    def span(self, name, **labels):
+        stack = self.local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.observe("span_seconds", elapsed, span=name, **labels)
+            with self.lock:
+                self.self_times[name] = self.self_times.get(name, 0.0) + elapsed - children
+
+    def sleep(self, seconds, reason="delay"):
+        if seconds > 0:
+            with self.span(SLEEP_SPAN, reason=reason):
+                time.sleep(seconds)
+
+    # Latency percentiles in milliseconds of each span name over all its labels,
+    # from the samples kept with keep_samples
+    def span_percentiles(self, quantiles=(0.5, 0.95, 0.99)):
+        with self.lock:
+            phases = {}
+            for (name, labels), values in self.samples.items():
+                if name == "span_seconds":
+                    phases.setdefault(dict(labels)["span"], []).extend(values)
+        result = {}
+        for phase, values in sorted(phases.items()):
+            values.sort()
+            result[phase] = {"count": len(values)}
+            for q in quantiles:
+                value = values[min(len(values) - 1, int(q * len(values)))]
+                result[phase][f"p{round(q * 100)}_ms"] = round(value * 1000, 2)
+        return result
+
+    # Where the wall-clock time went. Phase times are thread-seconds, with
+    # several workers they can add up to more than the wall time.
+    def summary(self):
+        wall = time.perf_counter() - self.started
+        with self.lock:
+            phases = sorted(self.self_times.items(), key=lambda item: item[1], reverse=True)
+        sleeping = sum(seconds for name, seconds in phases if name == SLEEP_SPAN)
+        working = sum(seconds for name, seconds in phases if name != SLEEP_SPAN)
+        return {
+            "wall_seconds": wall,
+            "sleeping_seconds": sleeping,
+            "working_seconds": working,
+            "untracked_seconds": max(0.0, wall - sleeping - working),
+            "phases": {
+                name: {"seconds": seconds, "share": seconds / wall if wall else 0.0}
+                for name, seconds in phases
+            },
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print(
+            f"Run took {summary['wall_seconds']:.1f}s: "
+            f"{summary['working_seconds']:.1f}s working, "
+            f"{summary['sleeping_seconds']:.1f}s sleeping, "
+            f"{summary['untracked_seconds']:.1f}s untracked"
+        )
+        for name, phase in summary["phases"].items():
+            print(f"  {name:<20} {phase['seconds']:>9.2f}s {phase['share']:>7.1%}")
+
+    def records(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        records = [
+            {"type": "counter", "name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in counters
+        ]
+        for (name, labels), histogram in histograms:
+            records.append(
+                {
+                    "type": "histogram",
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "max": histogram.max,
+                    "buckets": {str(bound): count for bound, count in histogram.cumulative()},
+                }
+            )
+        records.append({"type": "summary", **self.summary()})
+        return records
+
+    # One JSON object per line, runs are appended so the file keeps a history
+    def write_jsonl(self, path):
+        timestamp = time.time()
+        with open(path, "a") as f:
+            for record in self.records():
+                f.write(json.dumps({"timestamp": timestamp, **record}) + "\n")
+
+    def to_prometheus(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{_label_text(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            metric = f"{self.prefix}_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            for bound, count in histogram.cumulative():
+                lines.append(f"{metric}_bucket{_label_text(labels, [('le', bound)])} {count}")
+            lines.append(f"{metric}_sum{_label_text(labels)} {histogram.sum}")
+            lines.append(f"{metric}_count{_label_text(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        with open(path, "w") as f:
+            f.write(self.to_prometheus())
+
+    # Prometheus text for .prom and .txt files, JSON lines for anything else
+    def export(self, path):
+        if path.endswith((".prom", ".txt")):
+            self.write_prometheus(path)
+        else:
+            self.write_jsonl(path)
+
+    # Print the run summary and export to HESTI_METRICS_PATH if it is set
+    def report(self, path=None):
+        self.print_summary()
+        path = path or os.getenv("HESTI_METRICS_PATH")
+        if path:
+            self.export(path)
+            print(f"Metrics written to {path}")
+
+
+metrics = Metrics()
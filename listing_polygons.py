@@ -0,0 +1,178 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import shapely
+from pymongo import ReplaceOne, UpdateMany
+from analyze_lands import STREAM_CHUNK_SIZE, iter_listing_chunks
+from connector import get_collection
+from geocode import DEFAULT_PATH, Gazetteer, GeocodeCache, NominatimGeocoder
+from instrumentation import metrics
+from polygon_area import load_polygons, polygon_areas, repair
+from sketch import KLLSketch
+
+# Per-polygon summary: {_id: polygon name, count, price_per_sqm (mean), p25,
+# median, p75, area_m2, updated_at}
+POLYGON_STATS = "polygon_stats"
+
+
+# Pairs of (point index, polygon index) for every point inside or on the edge of
+# a polygon. The STRtree narrows each point down to the polygons whose bounding
+# box holds it, so the cost grows with N log M instead of N * M.
+def points_in_polygons(lons, lats, geometries):
+    points = shapely.points(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+    tree = shapely.STRtree(geometries)
+    with metrics.span("point_in_polygon"):
+        point_index, polygon_index = tree.query(points, predicate="intersects")
+    return point_index, polygon_index
+
+
+# Frame of (location, polygon) for the geocoded locations, a location in
+# overlapping polygons appears once per polygon
+def locate(points, geometries):
+    located = [(location, point) for location, point in points.items() if point is not None]
+    if not located:
+        return pd.DataFrame({"location": [], "polygon": []})
+    lats, lons = zip(*(point for _, point in located))
+    point_index, polygon_index = points_in_polygons(lons, lats, geometries)
+    return pd.DataFrame(
+        {
+            "location": np.array([location for location, _ in located], dtype=object)[point_index],
+            "polygon": polygon_index,
+        }
+    )
+
+
+# Running price per square meter sums and sketches per polygon index
+class PolygonAccumulator:
+    def __init__(self):
+        self.sums = {}
+        self.counts = {}
+        self.sketches = {}
+
+    def add(self, listings, location_polygons):
+        joined = listings[["location", "price_per_sqm"]].merge(location_polygons, on="location")
+        if joined.empty:
+            return 0
+        # Sorted by polygon every polygon's prices are one slice
+        order = np.argsort(joined["polygon"].to_numpy(), kind="stable")
+        polygons = joined["polygon"].to_numpy()[order]
+        values = joined["price_per_sqm"].to_numpy(dtype=float)[order]
+        unique, starts, counts = np.unique(polygons, return_index=True, return_counts=True)
+        sums = np.add.reduceat(values, starts)
+        for polygon, start, count, total in zip(
+            unique.tolist(), starts.tolist(), counts.tolist(), sums.tolist()
+        ):
+            self.sums[polygon] = self.sums.get(polygon, 0.0) + total
+            self.counts[polygon] = self.counts.get(polygon, 0) + count
+            if polygon not in self.sketches:
+                self.sketches[polygon] = KLLSketch()
+            self.sketches[polygon].update_many(values[start : start + count].tolist())
+        return len(joined)
+
+    def frame(self, names, areas):
+        rows = []
+        for polygon, count in self.counts.items():
+            p25, median, p75 = self.sketches[polygon].quantiles([0.25, 0.5, 0.75])
+            rows.append(
+                {
+                    "polygon": names[polygon],
+                    "count": count,
+                    "price_per_sqm": self.sums[polygon] / count,
+                    "p25": p25,
+                    "median": median,
+                    "p75": p75,
+                    "area_m2": float(areas[polygon]),
+                }
+            )
+        columns = ["polygon", "count", "price_per_sqm", "p25", "median", "p75", "area_m2"]
+        return pd.DataFrame(rows, columns=columns).sort_values(by="price_per_sqm", ascending=False)
+
+
+def write_polygon_stats(db, stats):
+    now = time.time()
+    operations = []
+    for row in stats.to_dict("records"):
+        name = row.pop("polygon")
+        operations.append(ReplaceOne({"_id": name}, dict(row, _id=name, updated_at=now), upsert=True))
+    if operations:
+        db[POLYGON_STATS].bulk_write(operations, ordered=False)
+
+
+# Store the names of the polygons each listing lies in as its polygons field.
+# Listings at one location share their point, so this is one update per location.
+def write_assignments(collection, locations, location_polygons, names):
+    collection.create_index("location", name="location")
+    polygons_of = location_polygons.groupby("location")["polygon"].agg(list).to_dict()
+    operations = [
+        UpdateMany(
+            {"location": location},
+            {"$set": {"polygons": [names[polygon] for polygon in polygons_of.get(location, [])]}},
+        )
+        for location in locations
+    ]
+    for start in range(0, len(operations), 1000):
+        collection.bulk_write(operations[start : start + 1000], ordered=False)
+
+
+# Geocode the distinct listing locations, find the polygons around them and
+# summarize price per square meter per polygon in polygon_stats
+def analyze_polygons(
+    collection,
+    polygons_path,
+    cache,
+    chunk_size=STREAM_CHUNK_SIZE,
+    assign=False,
+):
+    names, geometries = load_polygons(polygons_path)
+    geometries, repaired = repair(geometries)
+    if repaired.any():
+        print(f"Repaired {int(repaired.sum())} invalid polygons")
+    areas = polygon_areas(geometries)
+
+    with metrics.span("geocode"):
+        locations = [location for location in collection.distinct("location") if location]
+        points = cache.geocode_many(locations)
+    located = sum(point is not None for point in points.values())
+    print(f"Geocoded {located} of {len(locations)} locations, cache {cache.stats()}")
+
+    location_polygons = locate(points, geometries)
+    accumulator = PolygonAccumulator()
+    assigned = 0
+    for chunk in iter_listing_chunks(collection, chunk_size):
+        assigned += accumulator.add(chunk, location_polygons)
+    metrics.count("polygon_assignments", assigned)
+
+    stats = accumulator.frame(names, areas)
+    write_polygon_stats(collection.database, stats)
+    if assign:
+        write_assignments(collection, locations, location_polygons, names)
+    print(f"{assigned} listing-polygon assignments over {len(stats)} of {len(names)} polygons")
+    return stats
+
+
+def main(polygons_path, gazetteer=None, cache_path=DEFAULT_PATH, online=False, assign=False):
+    geocoder = Gazetteer(gazetteer) if gazetteer else NominatimGeocoder() if online else None
+    cache = GeocodeCache(cache_path, geocoder)
+    stats = analyze_polygons(get_collection(), polygons_path, cache, assign=assign)
+    print(stats.head(10).to_string(index=False))
+    metrics.report()
+
+
+def cli():
+    parser = argparse.ArgumentParser(
+        description="Assign listings to polygons and summarize price per square meter per polygon"
+    )
+    parser.add_argument("polygons", help="GeoJSON or CSV file of polygons, see polygon_area.py")
+    parser.add_argument("--gazetteer", help="CSV of name,lat,lon places used to geocode offline")
+    parser.add_argument("--online", action="store_true", help="geocode cache misses with Nominatim")
+    parser.add_argument("--cache", default=DEFAULT_PATH, help="geocode cache file")
+    parser.add_argument(
+        "--assign", action="store_true", help="also store the polygon names on each listing"
+    )
+    args = parser.parse_args()
+    main(args.polygons, args.gazetteer, args.cache, args.online, args.assign)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,205 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+import requests
+from requests.adapters import HTTPAdapter
+from instrumentation import metrics
+from politeness import polite_get
+
+# Settings come from the environment and are read when the cache is first used:
+#   HESTI_PAGE_CACHE_DIR      directory of the cache, ".page_cache" by default
+#   HESTI_PAGE_CACHE_TTL      seconds a page is used without asking the server again
+#   HESTI_PAGE_CACHE_MAX_MB   size of the stored pages before the least recently used go
+DEFAULT_DIRECTORY = ".page_cache"
+DEFAULT_TTL = 3600
+DEFAULT_MAX_MB = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    result TEXT,
+    result_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at);
+"""
+
+
+# On-disk HTTP cache keyed by URL. Pages younger than ttl are served without a
+# request, older ones are revalidated with If-None-Match/If-Modified-Since. A
+# result parsed from a page is kept with the page's content hash, so callers
+# can skip parsing while the content stays the same.
+class PageCache:
+    def __init__(
+        self,
+        directory=DEFAULT_DIRECTORY,
+        ttl=DEFAULT_TTL,
+        max_bytes=DEFAULT_MAX_MB * 2**20,
+        session=None,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.session = session or requests.Session()
+        if session is None:
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.directory / "index.sqlite3", check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _row(self, url):
+        with self.lock:
+            return self.conn.execute("SELECT * FROM pages WHERE url = ?", (url,)).fetchone()
+
+    def _body(self, row):
+        return gzip.decompress((self.directory / row["file"]).read_bytes())
+
+    def _page(self, row, changed, status):
+        metrics.count("page_cache", status=status)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), row["url"])
+            )
+        return {
+            "url": row["url"],
+            "body": self._body(row),
+            "content_hash": row["content_hash"],
+            "changed": changed,
+            "status": status,
+        }
+
+    # Fetch url, returns a dict with body, content_hash, changed and status,
+    # where status is fresh, not_modified, unchanged, changed or new
+    def fetch(self, url, scheduler=None):
+        row = self._row(url)
+        if row is not None and time.time() - row["fetched_at"] < self.ttl:
+            return self._page(row, False, "fresh")
+
+        headers = {}
+        if row is not None and row["etag"]:
+            headers["If-None-Match"] = row["etag"]
+        if row is not None and row["last_modified"]:
+            headers["If-Modified-Since"] = row["last_modified"]
+        response = polite_get(self.session, url, scheduler, headers=headers)
+
+        if response.status_code == 304 and row is not None:
+            with self.lock, self.conn:
+                self.conn.execute(
+                    "UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url)
+                )
+            return self._page(row, False, "not_modified")
+
+        body = response.content
+        content_hash = hashlib.sha256(body).hexdigest()
+        changed = row is None or row["content_hash"] != content_hash
+        self._store(url, body, response.headers, content_hash, keep_result=not changed)
+        self._evict()
+        status = "new" if row is None else "changed" if changed else "unchanged"
+        metrics.count("page_cache", status=status)
+        return {
+            "url": url,
+            "body": body,
+            "content_hash": content_hash,
+            "changed": changed,
+            "status": status,
+        }
+
+    def _store(self, url, body, headers, content_hash, keep_result):
+        name = hashlib.sha1(url.encode("utf-8")).hexdigest() + ".gz"
+        (self.directory / name).write_bytes(gzip.compress(body))
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO pages (url, file, etag, last_modified, content_hash, size, "
+                "fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (url) DO UPDATE SET etag = excluded.etag, "
+                "last_modified = excluded.last_modified, content_hash = excluded.content_hash, "
+                "size = excluded.size, fetched_at = excluded.fetched_at, "
+                "accessed_at = excluded.accessed_at"
+                + ("" if keep_result else ", result = NULL, result_hash = NULL"),
+                (
+                    url,
+                    name,
+                    headers.get("ETag"),
+                    headers.get("Last-Modified"),
+                    content_hash,
+                    len(body),
+                    now,
+                    now,
+                ),
+            )
+
+    # Drop least recently used pages until the stored bodies fit in max_bytes
+    def _evict(self):
+        with self.lock, self.conn:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for row in self.conn.execute(
+                "SELECT url, file, size FROM pages ORDER BY accessed_at"
+            ).fetchall():
+                self.conn.execute("DELETE FROM pages WHERE url = ?", (row["url"],))
+                try:
+                    os.remove(self.directory / row["file"])
+                except FileNotFoundError:
+                    pass
+                metrics.count("page_cache_evictions")
+                total -= row["size"]
+                if total <= self.max_bytes:
+                    break
+
+    # Result parsed from the page with this content hash, None if not parsed yet
+    def get_result(self, url, content_hash):
+        row = self._row(url)
+        if row is None or row["result_hash"] != content_hash or row["result"] is None:
+            return None
+        return json.loads(row["result"])
+
+    def put_result(self, url, content_hash, result):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE pages SET result = ?, result_hash = ? WHERE url = ? AND content_hash = ?",
+                (json.dumps(result), content_hash, url, content_hash),
+            )
+
+    def stats(self):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COUNT(result) FROM pages"
+            ).fetchone()
+        return {"pages": row[0], "bytes": row[1], "parsed": row[2]}
+
+
+_cache = None
+_lock = threading.Lock()
+
+
+def get_page_cache():
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = PageCache(
+                os.getenv("HESTI_PAGE_CACHE_DIR", DEFAULT_DIRECTORY),
+                ttl=float(os.getenv("HESTI_PAGE_CACHE_TTL", DEFAULT_TTL)),
+                max_bytes=int(float(os.getenv("HESTI_PAGE_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 2**20),
+            )
+        return _cache
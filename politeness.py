@@ -0,0 +1,220 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+import requests
+from instrumentation import metrics
+
+# Settings come from the environment and are read when the scheduler is first used:
+#   HESTI_POLITENESS_RATE       requests per second per domain to start with
+#   HESTI_POLITENESS_MAX_RATE   ceiling the rate may grow to while requests succeed
+#   HESTI_POLITENESS_BURST      requests a domain may receive back to back
+#   HESTI_POLITENESS_JITTER     "none", "uniform:LOW:HIGH" or "proportional:FRACTION"
+DEFAULT_RATE = 0.5
+DEFAULT_MIN_RATE = 0.02
+DEFAULT_MAX_RATE = 4.0
+DEFAULT_BURST = 1
+DEFAULT_JITTER = "proportional:0.25"
+
+# HTTP statuses that mean the site wants us to slow down
+THROTTLE_STATUSES = {429, 503}
+
+
+def no_jitter(interval):
+    return 0.0
+
+
+def uniform_jitter(low, high):
+    return lambda interval: random.uniform(low, high)
+
+
+def proportional_jitter(fraction):
+    return lambda interval: random.uniform(0, fraction * interval)
+
+
+# Jitter policy from a spec string, e.g. "uniform:0.5:2" or "proportional:0.25"
+def parse_jitter(spec):
+    name, *args = spec.split(":")
+    if name == "none":
+        return no_jitter
+    if name == "uniform":
+        return uniform_jitter(float(args[0]), float(args[1]))
+    if name == "proportional":
+        return proportional_jitter(float(args[0]))
+    raise ValueError(f"Unknown jitter policy {spec!r}")
+
+
+def parse_retry_after(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class DomainBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    # Take a token, returns the delay before it may be used. Tokens go negative
+    # while waiters queue up, so concurrent callers get consecutive slots.
+    def reserve(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(delay, self.blocked_until - now)
+
+
+# Per-domain token bucket whose rate follows AIMD: it grows additively while a
+# site answers and is cut multiplicatively on errors, throttling and timeouts
+class PolitenessScheduler:
+    def __init__(
+        self,
+        rate=DEFAULT_RATE,
+        min_rate=DEFAULT_MIN_RATE,
+        max_rate=DEFAULT_MAX_RATE,
+        burst=DEFAULT_BURST,
+        increase=0.05,
+        decrease=0.5,
+        jitter=None,
+        overrides=None,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.jitter = jitter or parse_jitter(DEFAULT_JITTER)
+        # Domain -> dict of rate/min_rate/max_rate/burst for sites with known limits
+        self.overrides = overrides or {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _setting(self, domain, name):
+        return self.overrides.get(domain, {}).get(name, getattr(self, name))
+
+    def _bucket(self, domain):
+        if domain not in self.buckets:
+            self.buckets[domain] = DomainBucket(
+                self._setting(domain, "rate"), self._setting(domain, "burst")
+            )
+        return self.buckets[domain]
+
+    # Block until the domain of url may receive another request
+    def wait(self, url):
+        domain = urlparse(url).netloc
+        with self.lock:
+            bucket = self._bucket(domain)
+            delay = bucket.reserve(time.monotonic())
+            interval = 1 / bucket.rate
+        metrics.sleep(delay + self.jitter(interval), "rate_limit")
+
+    def success(self, url):
+        domain = urlparse(url).netloc
+        with self.lock:
+            bucket = self._bucket(domain)
+            bucket.rate = min(self._setting(domain, "max_rate"), bucket.rate + self.increase)
+
+    # Halve the rate, a Retry-After also pauses the domain for that long
+    def failure(self, url, retry_after=None):
+        domain = urlparse(url).netloc
+        metrics.count("politeness_backoffs", domain=domain)
+        with self.lock:
+            bucket = self._bucket(domain)
+            bucket.rate = max(self._setting(domain, "min_rate"), bucket.rate * self.decrease)
+            if retry_after:
+                bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+        print(f"Backing off {domain}, now {bucket.rate:.2f} requests/s")
+
+    # Feed an HTTP response back, returns True if the site throttled the request
+    def observe_response(self, url, response):
+        if response.status_code in THROTTLE_STATUSES or response.status_code >= 500:
+            self.failure(url, parse_retry_after(response.headers.get("Retry-After")))
+            return True
+        self.success(url)
+        return False
+
+    def rates(self):
+        with self.lock:
+            return {domain: bucket.rate for domain, bucket in self.buckets.items()}
+
+
+_scheduler = None
+_lock = threading.Lock()
+
+
+# Process-wide scheduler shared by all scrapers, so limits hold across them
+def get_scheduler():
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = PolitenessScheduler(
+                rate=float(os.getenv("HESTI_POLITENESS_RATE", DEFAULT_RATE)),
+                max_rate=float(os.getenv("HESTI_POLITENESS_MAX_RATE", DEFAULT_MAX_RATE)),
+                burst=int(os.getenv("HESTI_POLITENESS_BURST", DEFAULT_BURST)),
+                jitter=parse_jitter(os.getenv("HESTI_POLITENESS_JITTER", DEFAULT_JITTER)),
+            )
+        return _scheduler
+
+
+# GET through the scheduler, throttling and timeouts slow the domain down
+def polite_get(session, url, scheduler=None, timeout=15, **kwargs):
+    scheduler = scheduler or get_scheduler()
+    scheduler.wait(url)
+    try:
+        response = session.get(url, timeout=timeout, **kwargs)
+    except (requests.Timeout, requests.ConnectionError):
+        scheduler.failure(url)
+        raise
+    scheduler.observe_response(url, response)
+    response.raise_for_status()
+    return response
+
+
+# Explicit readiness waits used instead of fixed sleeps after navigation
+
+
+def wait_for_document(driver, timeout=15):
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    with metrics.span("page_ready"):
+        WebDriverWait(driver, timeout).until(
+            lambda d: d.execute_script("return document.readyState") == "complete"
+        )
+
+
+# Wait until xpath matches, returns the elements. With required=False a page
+# without matches returns [] after the timeout instead of raising.
+def wait_for_elements(driver, xpath, timeout=15, required=True):
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    with metrics.span("page_ready"):
+        try:
+            return WebDriverWait(driver, timeout).until(
+                lambda d: d.find_elements(By.XPATH, xpath)
+            )
+        except TimeoutException:
+            if required:
+                raise
+            return []
+
+
+# Wait for a click to navigate away from old_url, single page apps included
+def wait_for_navigation(driver, old_url, timeout=15):
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    with metrics.span("page_ready"):
+        try:
+            WebDriverWait(driver, timeout).until(lambda d: d.current_url != old_url)
+        except TimeoutException:
+            pass
+    wait_for_document(driver, timeout)
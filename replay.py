@@ -0,0 +1,178 @@
+import gzip
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+# External scripts are dropped from rendered pages, on replay they would fetch the
+# live site again and re-render over the recorded DOM
+EXTERNAL_SCRIPT = re.compile(rb"<script\b[^>]*\bsrc=[^>]*>\s*</script>", re.I)
+
+
+# Compressed on-disk corpus of recorded pages keyed by URL
+class PageCorpus:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.directory / "index.json"
+        self.index = json.loads(self.index_path.read_text()) if self.index_path.exists() else {}
+        self.lock = threading.Lock()
+
+    def save(self, url, body, content_type="text/html; charset=utf-8"):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        name = hashlib.sha1(url.encode("utf-8")).hexdigest() + ".gz"
+        (self.directory / name).write_bytes(gzip.compress(body))
+        with self.lock:
+            self.index[url] = {"file": name, "content_type": content_type, "size": len(body)}
+            self.index_path.write_text(json.dumps(self.index, indent=2))
+
+    def load(self, url):
+        entry = self.index.get(url)
+        if entry is None:
+            return None, None
+        return gzip.decompress((self.directory / entry["file"]).read_bytes()), entry["content_type"]
+
+    def urls(self):
+        return list(self.index)
+
+    def hosts(self):
+        return sorted({urlsplit(url).netloc for url in self.index})
+
+
+# Record pages over plain HTTP
+def record(corpus, urls, session=None):
+    import requests
+
+    session = session or requests.Session()
+    for url in urls:
+        response = session.get(url, timeout=30)
+        response.raise_for_status()
+        corpus.save(url, response.content, response.headers.get("Content-Type", "text/html"))
+        print(f"Recorded {url} ({len(response.content)} bytes)")
+
+
+# Record the page currently rendered in a Selenium driver
+def record_current_page(driver, corpus, url=None):
+    body = EXTERNAL_SCRIPT.sub(b"", driver.page_source.encode("utf-8"))
+    corpus.save(url or driver.current_url, body)
+    print(f"Recorded {url or driver.current_url} ({len(body)} bytes)")
+
+
+# Record rendered pages with a browser, starting at start_url and following the
+# links matched by each XPath of link_xpaths, one XPath per level
+def record_site(driver, corpus, start_url, link_xpaths=(), settle=3):
+    from selenium.webdriver.common.by import By
+
+    level = [start_url]
+    for depth in range(len(link_xpaths) + 1):
+        next_level = []
+        for url in level:
+            driver.get(url)
+            time.sleep(settle)
+            record_current_page(driver, corpus, url)
+            if depth < len(link_xpaths):
+                for element in driver.find_elements(
+                    By.XPATH, link_xpaths[depth] + "/descendant-or-self::a[@href]"
+                ):
+                    href = element.get_attribute("href")
+                    if href and href.startswith("http"):
+                        next_level.append(urljoin(url, href))
+        level = list(dict.fromkeys(next_level))
+
+
+def _make_handler(server):
+    class ReplayHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            start = time.perf_counter()
+            url = server.original_url(self.path, self.headers.get("Referer"))
+            body, content_type = server.corpus.load(url) if url else (None, None)
+            if body is None:
+                self.send_error(404, f"Not recorded: {url or self.path}")
+            else:
+                body = server.rewrite(body)
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            server.record_latency(time.perf_counter() - start, body is not None)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ReplayHandler
+
+
+# Local HTTP stand-in that serves a corpus. The original https://host/path is
+# served at http://127.0.0.1:port/https/host/path and absolute links in the pages
+# are rewritten the same way, root-relative links are resolved through the Referer
+class ReplayServer:
+    def __init__(self, corpus, host="127.0.0.1", port=0):
+        self.corpus = corpus
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.base = f"http://{host}:{self.httpd.server_address[1]}"
+        self.thread = None
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.misses = 0
+        self.by_path = {}
+        for url in corpus.urls():
+            parts = urlsplit(url)
+            self.by_path.setdefault(parts.path + ("?" + parts.query if parts.query else ""), url)
+        self.replacements = []
+        for netloc in corpus.hosts():
+            for scheme in ("https", "http"):
+                self.replacements.append(
+                    (f"{scheme}://{netloc}".encode(), f"{self.base}/{scheme}/{netloc}".encode())
+                )
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def url_for(self, url):
+        scheme, rest = url.split("://", 1)
+        return f"{self.base}/{scheme}/{rest}"
+
+    def original_url(self, path, referer=None):
+        match = re.match(r"^/(https?)/([^/?#]+)(.*)$", path)
+        if match:
+            scheme, netloc, rest = match.groups()
+            return f"{scheme}://{netloc}{rest or '/'}"
+        if referer and referer.startswith(self.base):
+            origin = self.original_url(referer[len(self.base) :])
+            if origin:
+                return urljoin(origin, path)
+        return self.by_path.get(path)
+
+    def rewrite(self, body):
+        for original, local in self.replacements:
+            body = body.replace(original, local)
+        return body
+
+    def record_latency(self, seconds, hit):
+        with self.lock:
+            self.latencies.append(seconds)
+            if not hit:
+                self.misses += 1
+
+    def reset_stats(self):
+        with self.lock:
+            self.latencies = []
+            self.misses = 0
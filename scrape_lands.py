@@ -1,12 +1,24 @@
-from selenium import webdriver
-from selenium.webdriver.firefox.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.firefox.options import Options
-from webdriver_manager.firefox import GeckoDriverManager
-import time
+from selenium.webdriver.support.ui import WebDriverWait
+import argparse
 import random
-from connector import collection
+import functools
+import json
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse, urlunparse
+import requests
+from requests.adapters import HTTPAdapter
+from lxml import html as lxml_html
+from browser_pool import get_browser_pool, launch_driver
+from connector import get_collection
+from frontier import CrawlFrontier
+from instrumentation import metrics
+from politeness import get_scheduler, polite_get, wait_for_document, wait_for_elements
+from storage import BufferedWriter, ensure_indexes, is_unchanged, upsert_listing
 
 # List of user agents to rotate
 USER_AGENTS = [
@@ -31,21 +43,64 @@ MONTH_MAPPING = {
     "грудня": "12",
 }
 
+LISTING_XPATH = "//article[@class='realty-preview']"
+
+# XPaths of the listing fields, shared by the Selenium and lxml engines
+FIELD_XPATHS = {
+    "title": ".//h3[@class='realty-preview-title']/button",
+    "location": ".//div[@class='realty-preview-sub-title-wrapper']/a",
+    "price": ".//div[contains(@class, 'realty-preview-price--main')]",
+    "size": ".//div[contains(@class, 'realty-preview-properties-item')]//span[@class='realty-preview-info']",
+    "date": ".//span[contains(@class, 'realty-preview-dates__value')]",
+    "description": ".//div[@class='realty-preview-description closed']//p",
+}
+
+# Places in the preview DOM that carry the detail page URL, in order of preference
+DETAIL_URL_XPATHS = (
+    ".//button[contains(@class, 'realty-link-button')]/@data-href",
+    ".//button[contains(@class, 'realty-link-button')]/@data-url",
+    ".//a[contains(@class, 'realty-link')]/@href",
+)
+
+# Last resort after the page state: any other link of the preview, except the
+# location links of the sub-title, which point to city and district pages
+FALLBACK_URL_XPATH = ".//a[@href][not(ancestor::div[@class='realty-preview-sub-title-wrapper'])]/@href"
+
+# Detail pages, on Flatfy or the agency it redirects to, have the numeric listing
+# id as a path segment (/realty/939037312, /flats-sale/view/11174920/). Listing
+# and location pages do not.
+DETAIL_PATH = re.compile(r"/\d{5,}(?:/|$)")
+
+# Attributes of the preview article that identify the listing in the page state
+LISTING_ID_ATTRIBUTES = ("data-id", "data-realty-id", "id")
+
+# Embedded JSON page state, either a JSON script tag or a window.__STATE__ assignment
+STATE_SCRIPT_XPATH = "//script[@type='application/json' or contains(text(), 'window.__')]/text()"
+STATE_ASSIGNMENT = re.compile(r"window\.__\w+__\s*=\s*(\{.*\})\s*;?\s*$", re.S)
+STATE_URL_KEYS = ("url", "link", "href", "path")
+
+ENGINES = ("selenium", "http")
+
+
 def store_data(collection, data):
     if data:
-        collection.insert_one(data)
+        upsert_listing(collection, data)
     else:
         print("No data to store!")
 
 
-def create_driver():
-    options = Options()
-    user_agent = random.choice(USER_AGENTS)
-    options.set_preference("general.useragent.override", user_agent)
-    driver = webdriver.Firefox(
-        service=Service(GeckoDriverManager().install()), options=options
+def create_driver(user_agent=None):
+    if user_agent is None:
+        user_agent = random.choice(USER_AGENTS)
+    return launch_driver(user_agent, headless=False, blocked=())
+
+
+# Warm headless browsers of the Selenium engine with rotating user agents.
+# Stylesheets stay enabled, the rendered .text and the detail clicks need layout.
+def browser_pool(size=1):
+    return get_browser_pool(
+        "flatfy", size, user_agents=USER_AGENTS, blocked=("images", "fonts")
     )
-    return driver
 
 
 def transform_date(raw_date):
@@ -59,141 +114,653 @@ def transform_date(raw_date):
     return raw_date
 
 
-def scrape_main_page(main_page_url, limit=10, retries=3):
-    driver = create_driver()
+def extract_listing_data(listing):
+    title = listing.find_element(By.XPATH, FIELD_XPATHS["title"]).text
+    location = " ".join(
+        [elem.text for elem in listing.find_elements(By.XPATH, FIELD_XPATHS["location"])]
+    )
+    price = listing.find_element(By.XPATH, FIELD_XPATHS["price"]).text
+    size_elements = listing.find_elements(By.XPATH, FIELD_XPATHS["size"])
+    size = " ".join([elem.text for elem in size_elements if "м²" in elem.text])
+    raw_date = listing.find_elements(By.XPATH, FIELD_XPATHS["date"])[1].text
+    date = transform_date(raw_date)
+
+    # Extract the description
+    try:
+        description = listing.find_element(By.XPATH, FIELD_XPATHS["description"]).text
+    except:
+        description = None
+        print("Description not found")
+
+    return {
+        "title": title,
+        "location": location,
+        "price": price,
+        "size": size,
+        "date": date,
+        "description": description,
+    }
+
+
+def create_session(user_agent=None, pool_size=10, retries=3):
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = user_agent or random.choice(USER_AGENTS)
+    return session
+
+
+# Connections kept per host by the shared sessions, enough for the detail fetches
+SESSION_POOL_SIZE = 32
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+# Process-wide session per user agent, created on first use, so pages and detail
+# fetches reuse the same connection pool. Without a user agent one is picked at random.
+def get_session(user_agent=None):
+    user_agent = user_agent or random.choice(USER_AGENTS)
+    with _sessions_lock:
+        if user_agent not in _sessions:
+            _sessions[user_agent] = create_session(user_agent, pool_size=SESSION_POOL_SIZE)
+        return _sessions[user_agent]
+
+
+def _element_text(element):
+    # Collapse whitespace the way a rendered browser .text does
+    return " ".join(element.text_content().split())
+
+
+def _first_text(listing, xpath):
+    elements = listing.xpath(xpath)
+    return _element_text(elements[0]) if elements else None
+
+
+def _iter_state_objects(state):
+    stack = [state]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            yield value
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+
+
+# Map listing ids to detail URLs found in the embedded page state
+def extract_state_urls(tree, base_url):
+    state_urls = {}
+    for script in tree.xpath(STATE_SCRIPT_XPATH):
+        script = script.strip()
+        match = STATE_ASSIGNMENT.search(script)
+        try:
+            state = json.loads(match.group(1) if match else script)
+        except ValueError:
+            continue
+        for obj in _iter_state_objects(state):
+            if "id" not in obj:
+                continue
+            for key in STATE_URL_KEYS:
+                url = detail_url(obj.get(key), base_url) if isinstance(obj.get(key), str) else None
+                if url:
+                    state_urls[str(obj["id"])] = url
+                    break
+    return state_urls
+
+
+# Absolute URL of href when it points to a listing detail page, else None
+def detail_url(href, base_url):
+    if not href or href.startswith(("#", "javascript:")):
+        return None
+    url = urljoin(base_url, href)
+    return url if DETAIL_PATH.search(urlparse(url).path) else None
+
+
+# Resolve the detail URL of a preview from its own markup or the page state. None
+# leaves it to the caller to click through to the detail page.
+def resolve_detail_url(listing, base_url, state_urls=None):
+    for xpath in DETAIL_URL_XPATHS:
+        for href in listing.xpath(xpath):
+            url = detail_url(href, base_url)
+            if url:
+                return url
+
+    for attribute in LISTING_ID_ATTRIBUTES:
+        match = re.search(r"\d+", listing.get(attribute) or "")
+        if match and state_urls and match.group() in state_urls:
+            return state_urls[match.group()]
+
+    for href in listing.xpath(FALLBACK_URL_XPATH):
+        url = detail_url(href, base_url)
+        if url:
+            return url
+    return None
+
+
+# Same as resolve_detail_url for a Selenium element, in a single WebDriver round trip
+def resolve_listing_url(listing, base_url, state_urls=None):
+    tree = lxml_html.fromstring(listing.get_attribute("outerHTML"))
+    return resolve_detail_url(tree, base_url, state_urls)
+
+
+def _fetch_detail(session, scheduler, data, field_xpaths):
+    try:
+        with metrics.span("detail_navigation", engine="http"):
+            response = polite_get(session, data["url"], scheduler)
+    except requests.RequestException as e:
+        metrics.count("http_errors")
+        print(f"Error fetching detail page {data['url']}: {e}")
+        return
+    with metrics.span("parse"):
+        tree = lxml_html.fromstring(response.text)
+        for field, xpath in field_xpaths.items():
+            data[field] = _first_text(tree, xpath)
+
+
+# Fill fields that are only on the detail pages, fetching the pages concurrently
+def fetch_details(results, field_xpaths, workers=8, session=None, scheduler=None):
+    session = session or get_session()
+    scheduler = scheduler or get_scheduler()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_fetch_detail, session, scheduler, data, field_xpaths)
+            for data in results
+            if data.get("url")
+        ]
+        # The listings are filled in place, so they keep their order
+        for future in as_completed(futures):
+            future.result()
+    return results
+
+
+# Extract listings from raw HTML with lxml, mirroring extract_listing_data
+def extract_listings_from_html(page_html, base_url, limit=None):
+    tree = lxml_html.fromstring(page_html)
+    state_urls = extract_state_urls(tree, base_url)
     results = []
+    for listing in tree.xpath(LISTING_XPATH)[:limit]:
+        location = " ".join(
+            _element_text(elem) for elem in listing.xpath(FIELD_XPATHS["location"])
+        )
+        size = " ".join(
+            text
+            for text in map(_element_text, listing.xpath(FIELD_XPATHS["size"]))
+            if "м²" in text
+        )
+        dates = listing.xpath(FIELD_XPATHS["date"])
+        results.append(
+            {
+                "title": _first_text(listing, FIELD_XPATHS["title"]),
+                "location": location,
+                "price": _first_text(listing, FIELD_XPATHS["price"]),
+                "size": size,
+                "date": transform_date(_element_text(dates[1])) if len(dates) > 1 else None,
+                "description": _first_text(listing, FIELD_XPATHS["description"]),
+                "url": resolve_detail_url(listing, base_url, state_urls),
+            }
+        )
+    return results
+
+
+# Fields the static HTML must provide, otherwise the Selenium engine is used
+REQUIRED_FIELDS = ("title", "price", "date", "url")
+
+
+# Server errors and rate limiting are failures of the page, retried later by the crawl
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Past the last result page the site may answer with these, the page has no listings
+EMPTY_STATUSES = (404, 410)
+
+
+# Scrape the main page without a browser, returns None if Selenium is needed. Raises
+# on RETRY_STATUSES and returns [] on EMPTY_STATUSES.
+def scrape_main_page_http(main_page_url, limit=10, session=None, skip=None, scheduler=None):
+    session = session or get_session()
+    try:
+        with metrics.span("page_load", engine="http"):
+            response = polite_get(session, main_page_url, scheduler)
+    except requests.RequestException as e:
+        metrics.count("http_errors")
+        status = e.response.status_code if e.response is not None else None
+        if status in RETRY_STATUSES:
+            raise
+        if status in EMPTY_STATUSES:
+            return []
+        print(f"Error fetching {main_page_url}: {e}")
+        return None
+
+    with metrics.span("parse"):
+        results = extract_listings_from_html(response.text, response.url, limit)
+    if not results:
+        print("No listings in static HTML")
+        return None
+    for data in results:
+        missing = [field for field in REQUIRED_FIELDS if not data[field]]
+        if missing:
+            print(f"Static HTML lacks {', '.join(missing)} for '{data['title']}'")
+            return None
+
+    if skip:
+        results = [data for data in results if not skip(data)]
+    metrics.count("listings_scraped", len(results), engine="http")
+    for data in results:
+        print_listing(data)
+    return results
+
+
+def print_listing(data):
+    # Debugging: Print to understand the structure
+    print(f"Title: {data['title']}")
+    print(f"Location: {data['location']}")
+    print(f"Price: {data['price']}")
+    print(f"Size: {data['size']}")
+    print(f"Date: {data['date']}")
+    print(f"URL: {data['url']}")
+    print(f"Description: {data['description']}")
+
+
+# Click the detail button, wait for the new tab to navigate and return its URL
+def open_detail_url(driver, listing, main_window, timeout=15):
+    with metrics.span("detail_navigation", engine="selenium"):
+        return _open_detail_url(driver, listing, main_window, timeout)
 
+
+def _open_detail_url(driver, listing, main_window, timeout):
+    detail_button = listing.find_element(
+        By.XPATH, ".//button[contains(@class, 'realty-link-button')]"
+    )
+    handles = len(driver.window_handles)
+    driver.execute_script("arguments[0].scrollIntoView();", detail_button)
+    ActionChains(driver).move_to_element(detail_button).click(detail_button).perform()
+    WebDriverWait(driver, timeout).until(lambda d: len(d.window_handles) > handles)
+    driver.switch_to.window(driver.window_handles[-1])
+    try:
+        WebDriverWait(driver, timeout).until(
+            lambda d: d.current_url not in ("", "about:blank")
+        )
+        return driver.current_url
+    finally:
+        driver.close()
+        driver.switch_to.window(main_window)
+
+
+# Load a result page in the browser and return its listing elements. A page that
+# finished loading without listings returns [], the end of the pagination. Load
+# errors and timeouts raise.
+def load_listing_page(driver, main_page_url, scheduler):
+    driver.set_page_load_timeout(15)
+    scheduler.wait(main_page_url)
+    try:
+        with metrics.span("page_load", engine="selenium"):
+            driver.get(main_page_url)
+        # Wait for the listings to render instead of a fixed delay
+        listings = wait_for_elements(driver, LISTING_XPATH, required=False)
+        if not listings:
+            wait_for_document(driver)
+    except Exception:
+        scheduler.failure(main_page_url)
+        raise
+    scheduler.success(main_page_url)
+    return listings
+
+
+# Open the detail page of a listing in a pool browser and fill its detail_fields,
+# returns the number of pages loaded. Fields of a page that keeps failing stay unset.
+def _open_detail_page(driver, data, detail_fields, scheduler, retries):
+    for attempt in range(retries):
+        scheduler.wait(data["url"])
+        try:
+            with metrics.span("detail_navigation", engine="selenium"):
+                driver.get(data["url"])
+                wait_for_document(driver)
+        except Exception as e:
+            metrics.count("detail_errors")
+            print(f"Error opening detail page {data['url']}, attempt {attempt + 1}: {e}")
+            scheduler.failure(data["url"])
+            continue
+        scheduler.success(data["url"])
+        with metrics.span("parse"):
+            tree = lxml_html.fromstring(driver.page_source)
+            for field, xpath in detail_fields.items():
+                data[field] = _first_text(tree, xpath)
+        return attempt + 1
+    return retries
+
+
+# Open the detail pages of queued listings until a None job, in a browser of its own
+def _detail_worker(pool, jobs, detail_fields, scheduler, retries):
+    try:
+        driver = pool.acquire()
+    except Exception as e:
+        print(f"Detail worker could not get a browser: {e}")
+        return
+    pages = 0
     try:
-        driver.set_page_load_timeout(15)
-        driver.get(main_page_url)
-        time.sleep(
-            random.uniform(5, 15)
-        )  # Wait for the page to fully load with longer delay
-
-        listings = driver.find_elements(By.XPATH, "//article[@class='realty-preview']")[
-            :limit
+        while True:
+            data = jobs.get()
+            if data is None:
+                break
+            pages += _open_detail_page(driver, data, detail_fields, scheduler, retries)
+    finally:
+        pool.release(driver, pages)
+
+
+# A page whose listings all failed is a failure of the page, not an empty page
+def check_listing_failures(main_page_url, found, failed):
+    if found and failed >= found:
+        raise RuntimeError(f"All {found} listings of {main_page_url} failed")
+
+
+# Scrape listings with several long-lived browsers sharing one job queue. The
+# result page is loaded and parsed once, in the first browser, which also clicks
+# through the listings without a detail URL. Listings with detail_fields to fill
+# are queued as they are found and the other browsers open their detail pages
+# meanwhile, the first one joins them when the page is done. Results keep the
+# page order, limit=None takes all listings.
+def scrape_main_page_pool(
+    main_page_url,
+    limit=None,
+    retries=3,
+    workers=4,
+    detail_fields=None,
+    skip=None,
+    scheduler=None,
+):
+    scheduler = scheduler or get_scheduler()
+    pool = browser_pool(workers)
+    jobs = queue.Queue()
+    threads = []
+    if detail_fields:
+        pool.prewarm(workers)
+        threads = [
+            threading.Thread(
+                target=_detail_worker, args=(pool, jobs, detail_fields, scheduler, retries)
+            )
+            for _ in range(workers - 1)
         ]
+        for thread in threads:
+            thread.start()
+
+    driver = pool.acquire()
+    pages = 1
+    results = []
+    failed = 0
+    try:
+        load_listing_page(driver, main_page_url, scheduler)
         main_window = driver.current_window_handle
+        # One WebDriver round trip for the whole page instead of several per listing
+        with metrics.span("parse"):
+            listings = extract_listings_from_html(driver.page_source, main_page_url, limit)
+
+        for index, data in enumerate(listings):
+            if skip and skip(data):
+                print(f"Skipping unchanged listing '{data['title']}'")
+                continue
+            for attempt in range(retries if data["url"] is None else 0):
+                try:
+                    # Look the listing up again, earlier clicks may have re-rendered the page
+                    with metrics.span("element_lookup"):
+                        listing = driver.find_elements(By.XPATH, LISTING_XPATH)[index]
+                    scheduler.wait(main_page_url)
+                    data["url"] = open_detail_url(driver, listing, main_window)
+                    pages += 1
+                    break
+                except Exception as e:
+                    metrics.count("listing_errors")
+                    print(f"Error opening listing {index + 1}, attempt {attempt + 1}: {e}")
+                    scheduler.failure(main_page_url)
+            if data["url"] is None:
+                failed += 1
+                continue
+
+            print_listing(data)
+            results.append(data)
+            metrics.count("listings_scraped", engine="selenium")
+            if detail_fields:
+                jobs.put(data)
+
+        # Everything is queued, help with the detail pages left
+        while True:
+            try:
+                data = jobs.get_nowait()
+            except queue.Empty:
+                break
+            pages += _open_detail_page(driver, data, detail_fields, scheduler, retries)
+    finally:
+        # One None per worker ends it once the queue is drained
+        for _ in threads:
+            jobs.put(None)
+        pool.release(driver, pages)
+        for thread in threads:
+            thread.join()
+
+    check_listing_failures(main_page_url, len(listings), failed)
+    # The workers fill the listings in place, so results are already in page order
+    return results
+
+
+def scrape_main_page(
+    main_page_url,
+    limit=10,
+    retries=3,
+    workers=1,
+    engine="selenium",
+    detail_fields=None,
+    skip=None,
+    scheduler=None,
+    session=None,
+):
+    # skip(data) is called with the index page fields of each listing and the URL
+    # resolved from the preview (None when it needs a click-through), listings it
+    # returns True for are dropped before any detail page is opened
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}, expected one of {ENGINES}")
+
+    results = None
+    if engine == "http":
+        results = scrape_main_page_http(main_page_url, limit, session, skip, scheduler)
+        if results is None:
+            print("Falling back to the Selenium engine")
+    if results is None and workers > 1:
+        # The pool opens the detail pages in its own browsers
+        return scrape_main_page_pool(
+            main_page_url, limit, retries, workers, detail_fields, skip, scheduler
+        )
+    if results is None:
+        results = scrape_main_page_selenium(main_page_url, limit, retries, skip, scheduler)
+
+    # Detail pages are only opened for fields the index page does not have
+    if detail_fields:
+        fetch_details(results, detail_fields, max(workers, 4), session, scheduler)
+    return results
+
+
+# Raises when the page fails to load or all of its listings fail, [] means the
+# page loaded without listings
+def scrape_main_page_selenium(main_page_url, limit=10, retries=3, skip=None, scheduler=None):
+    pool = browser_pool()
+    driver = pool.acquire()
+    pages = 1
+    scheduler = scheduler or get_scheduler()
+    results = []
+    failed = 0
+
+    try:
+        load_listing_page(driver, main_page_url, scheduler)
+        with metrics.span("element_lookup"):
+            listings = driver.find_elements(By.XPATH, LISTING_XPATH)[:limit]
+        main_window = driver.current_window_handle
+        state_urls = extract_state_urls(
+            lxml_html.fromstring(driver.page_source), main_page_url
+        )
 
         for index, listing in enumerate(listings):
             for attempt in range(retries):
                 try:
-                    # Extract initial data
-                    title = listing.find_element(
-                        By.XPATH, ".//h3[@class='realty-preview-title']/button"
-                    ).text
-                    location = " ".join(
-                        [
-                            elem.text
-                            for elem in listing.find_elements(
-                                By.XPATH,
-                                ".//div[@class='realty-preview-sub-title-wrapper']/a",
-                            )
-                        ]
-                    )
-                    price = listing.find_element(
-                        By.XPATH,
-                        ".//div[contains(@class, 'realty-preview-price--main')]",
-                    ).text
-                    size_elements = listing.find_elements(
-                        By.XPATH,
-                        ".//div[contains(@class, 'realty-preview-properties-item')]//span[@class='realty-preview-info']",
-                    )
-                    size = " ".join(
-                        [elem.text for elem in size_elements if "м²" in elem.text]
-                    )
-                    raw_date = listing.find_elements(
-                        By.XPATH,
-                        ".//span[contains(@class, 'realty-preview-dates__value')]",
-                    )[1].text
-                    date = transform_date(raw_date)
-
-                    # Extract the description
-                    try:
-                        description = listing.find_element(
-                            By.XPATH,
-                            ".//div[@class='realty-preview-description closed']//p",
-                        ).text
-                    except:
-                        description = None
-                        print("Description not found")
-
-                    # Scroll the element into view and click the button to navigate to the detail page
-                    detail_button = listing.find_element(
-                        By.XPATH, ".//button[contains(@class, 'realty-link-button')]"
-                    )
-                    driver.execute_script(
-                        "arguments[0].scrollIntoView();", detail_button
-                    )
-                    ActionChains(driver).move_to_element(detail_button).click(
-                        detail_button
-                    ).perform()
-                    time.sleep(
-                        random.uniform(5, 15)
-                    )  # Wait for the new page to load with longer delay
-
-                    # Switch to new tab
-                    driver.switch_to.window(driver.window_handles[-1])
-
-                    # Capture the URL after navigation
-                    url = driver.current_url
-
-                    # Debugging: Print to understand the structure
-                    print(f"Title: {title}")
-                    print(f"Location: {location}")
-                    print(f"Price: {price}")
-                    print(f"Size: {size}")
-                    print(f"Date: {date}")
-                    print(f"URL: {url}")
-                    print(f"Description: {description}")
-
-                    results.append(
-                        {
-                            "title": title,
-                            "location": location,
-                            "price": price,
-                            "size": size,
-                            "date": date,
-                            "description": description,
-                            "url": url,
-                        }
-                    )
+                    with metrics.span("element_lookup"):
+                        data = extract_listing_data(listing)
+                    data["url"] = resolve_listing_url(listing, main_page_url, state_urls)
+                    if skip and skip(data):
+                        print(f"Skipping unchanged listing '{data['title']}'")
+                        break
 
-                    # Close the new tab and switch back to main window
-                    driver.close()
-                    driver.switch_to.window(main_window)
-                    time.sleep(
-                        random.uniform(5, 15)
-                    )  # Wait for the main page to load with longer delay
+                    if data["url"] is None:
+                        # Click through to the detail page, waiting for the new tab to navigate
+                        scheduler.wait(main_page_url)
+                        data["url"] = open_detail_url(driver, listing, main_window)
+                        pages += 1
 
+                    print_listing(data)
+                    results.append(data)
+                    metrics.count("listings_scraped", engine="selenium")
                     break  # Exit the retry loop if successful
 
                 except Exception as e:
+                    metrics.count("listing_errors")
                     print(
                         f"Error extracting data from listing {index + 1}, attempt {attempt + 1}: {e}"
                     )
-                    time.sleep(
-                        random.uniform(5, 15)
-                    )  # Wait before retrying with longer delay
+                    # Slow down before retrying
+                    scheduler.failure(main_page_url)
+                    scheduler.wait(main_page_url)
+            else:
+                failed += 1
+    finally:
+        pool.release(driver, pages)
 
-        driver.quit()
-        return results
+    check_listing_failures(main_page_url, len(listings), failed)
+    return results
+
+
+# Result page number n of a listing search, Flatfy paginates with ?page=n
+def page_url(seed_url, page_number):
+    parts = urlparse(seed_url)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key != "page"]
+    if page_number > 1:
+        query.append(("page", str(page_number)))
+    return urlunparse(parts._replace(query=urlencode(query)))
+
+
+def retry_page(frontier, url, failed):
+    metrics.count("pages_failed")
+    status = frontier.mark_failed(url, f"{failed} listing writes failed")
+    print(f"Page {url} failed ({failed} listing writes failed), now {status}")
 
-    except Exception as e:
-        print(f"Error occurred while scraping main page: {e}")
-        driver.quit()
-        return []
 
+# Crawl every result page of the seed URLs, checkpointing progress in the frontier
+def crawl(seed_urls, frontier_path="frontier.sqlite3", engine="http", max_pages=None, workers=1):
+    collection = get_collection()
+    frontier = CrawlFrontier(frontier_path)
+    ensure_indexes(collection)
+    for seed_url in seed_urls:
+        frontier.add_page(seed_url)
 
-def main():
-    main_page_url = "https://flatfy.ua/uk/%D0%BF%D1%80%D0%BE%D0%B4%D0%B0%D0%B6-%D0%BA%D0%B2%D0%B0%D1%80%D1%82%D0%B8%D1%80-%D1%85%D0%B0%D1%80%D0%BA%D1%96%D0%B2"
-    listings_data = scrape_main_page(main_page_url, limit=10)
+    writer = BufferedWriter(collection)
+    # One session for the run, its connections are kept alive across the pages
+    session = get_session()
+    total = 0
+    try:
+        while True:
+            page = frontier.next_page()
+            if page is None:
+                wait = frontier.next_retry_in()
+                if wait is None:
+                    break
+                print(f"Waiting {wait:.0f}s for the next retry")
+                metrics.sleep(wait, "retry_backoff")
+                continue
+
+            print(f"Scraping page {page['page_number']} of {page['seed']}")
+            unchanged = []
+
+            def skip(data):
+                with metrics.span("db_read"):
+                    found = is_unchanged(collection, data)
+                if found:
+                    unchanged.append(data)
+                    return True
+                return False
+
+            try:
+                listings_data = scrape_main_page(
+                    page["url"],
+                    limit=None,
+                    workers=workers,
+                    engine=engine,
+                    skip=skip,
+                    session=session,
+                )
+            except Exception as e:
+                # Timeouts, server errors and blocks are retried with backoff
+                metrics.count("pages_failed")
+                status = frontier.mark_failed(page["url"], e)
+                print(f"Page {page['url']} failed ({e}), now {status}")
+                continue
+
+            if not listings_data and not unchanged:
+                # A page after the first one that loaded without listings is the end
+                # of the pagination, an empty first page is retried
+                if page["page_number"] > 1:
+                    frontier.mark_done(page["url"])
+                else:
+                    metrics.count("pages_failed")
+                    status = frontier.mark_failed(page["url"], "no listings found")
+                    print(f"Page {page['url']} failed (no listings found), now {status}")
+                continue
+
+            # Only new or changed listings come back, unchanged ones were skipped
+            for data in listings_data:
+                writer.add(data)
+            total += len(listings_data)
+            metrics.count("pages_scraped")
+            metrics.count("listings_unchanged", len(unchanged))
+            print(f"Queued {len(listings_data)} listings, {len(unchanged)} unchanged")
+
+            next_number = page["page_number"] + 1
+            if max_pages is None or next_number <= max_pages:
+                frontier.add_page(page_url(page["seed"], next_number), page["seed"], next_number)
+
+            # The page is checkpointed once its listings are in the database, and
+            # scraped again when some of them could not be written
+            writer.after_flush(
+                functools.partial(frontier.mark_done, page["url"]),
+                functools.partial(retry_page, frontier, page["url"]),
+            )
+    finally:
+        writer.close()
+        print(f"Frontier: {frontier.stats()}")
+        frontier.close()
+    return total
 
-    for data in listings_data:
-        store_data(collection, data)
 
-    print(f"Total scraped listings: {len(listings_data)}")
+SEED_URLS = [
+    "https://flatfy.ua/uk/%D0%BF%D1%80%D0%BE%D0%B4%D0%B0%D0%B6-%D0%BA%D0%B2%D0%B0%D1%80%D1%82%D0%B8%D1%80-%D1%85%D0%B0%D1%80%D0%BA%D1%96%D0%B2",
+]
+
+
+def main(engine="http", workers=1):
+    total = crawl(SEED_URLS, engine=engine, workers=workers)
+    print(f"Total scraped listings: {total}")
+    # Append the changed listings to the Parquet snapshot for analyze_lands.py --mode snapshot
+    from snapshot import export_snapshot
+
+    export_snapshot(get_collection())
+    metrics.report()
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Crawl the Flatfy seed URLs into MongoDB")
+    parser.add_argument("engine", nargs="?", choices=ENGINES, default="http")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="browsers of the Selenium engine (default 1)"
+    )
+    args = parser.parse_args()
+    main(args.engine, args.workers)
 
 
 if __name__ == "__main__":
-    main()
+    cli()
@@ -0,0 +1,136 @@
+import math
+import random
+
+# Default accuracy parameter, the rank error of quantile() is about 1.7 / k
+DEFAULT_K = 200
+
+
+# Mergeable KLL quantile sketch (Karnin, Lang, Liberty 2016). Memory is O(k log n)
+# no matter how many values are added, and sketches built over different chunks
+# or processes can be merged into one.
+class KLLSketch:
+    def __init__(self, k=DEFAULT_K, c=2 / 3, seed=None):
+        self.k = k
+        self.c = c
+        self.random = random.Random(seed)
+        self.compactors = []
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.size = 0
+        self.max_size = 0
+        self._grow()
+
+    def _grow(self):
+        self.compactors.append([])
+        self.max_size = sum(self._capacity(height) for height in range(len(self.compactors)))
+
+    def _capacity(self, height):
+        depth = len(self.compactors) - height - 1
+        return int(math.ceil(self.k * self.c**depth)) + 1
+
+    def _compress(self):
+        for height, compactor in enumerate(self.compactors):
+            if len(compactor) >= self._capacity(height):
+                if height + 1 >= len(self.compactors):
+                    self._grow()
+                compactor.sort()
+                # Keep every other item with weight doubled, an odd item left over stays
+                odd = [compactor.pop()] if len(compactor) % 2 else []
+                offset = self.random.randint(0, 1)
+                self.compactors[height + 1].extend(compactor[offset::2])
+                compactor[:] = odd
+                self.size = sum(len(c) for c in self.compactors)
+                if self.size < self.max_size:
+                    break
+
+    def update(self, value):
+        self.update_many([value])
+
+    def update_many(self, values):
+        values = [float(value) for value in values if value == value]  # Drop NaN
+        if not values:
+            return
+        self.count += len(values)
+        self.min = min(self.min, min(values))
+        self.max = max(self.max, max(values))
+        for start in range(0, len(values), self.k):
+            self.compactors[0].extend(values[start : start + self.k])
+            self.size += len(values[start : start + self.k])
+            while self.size >= self.max_size:
+                self._compress()
+
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for height, compactor in enumerate(other.compactors):
+            self.compactors[height].extend(compactor)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.size = sum(len(c) for c in self.compactors)
+        while self.size >= self.max_size:
+            self._compress()
+        return self
+
+    def _weighted_items(self):
+        items = sorted(
+            (value, 2**height)
+            for height, compactor in enumerate(self.compactors)
+            for value in compactor
+        )
+        total = sum(weight for _, weight in items)
+        return items, total
+
+    # Fraction of added values that are <= value
+    def rank(self, value):
+        items, total = self._weighted_items()
+        if not total:
+            return math.nan
+        return sum(weight for item, weight in items if item <= value) / total
+
+    def quantile(self, q):
+        return self.quantiles([q])[0]
+
+    def quantiles(self, qs):
+        items, total = self._weighted_items()
+        if not total:
+            return [math.nan for _ in qs]
+        results = []
+        for q in qs:
+            if q <= 0:
+                results.append(self.min)
+                continue
+            if q >= 1:
+                results.append(self.max)
+                continue
+            target = q * total
+            cumulative = 0
+            for value, weight in items:
+                cumulative += weight
+                if cumulative >= target:
+                    results.append(value)
+                    break
+        return results
+
+    def to_dict(self):
+        return {
+            "k": self.k,
+            "c": self.c,
+            "count": self.count,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "compactors": [list(compactor) for compactor in self.compactors],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(k=data["k"], c=data["c"])
+        while len(sketch.compactors) < len(data["compactors"]):
+            sketch._grow()
+        sketch.compactors = [list(compactor) for compactor in data["compactors"]]
+        sketch.count = data["count"]
+        sketch.min = data["min"] if data["min"] is not None else math.inf
+        sketch.max = data["max"] if data["max"] is not None else -math.inf
+        sketch.size = sum(len(c) for c in sketch.compactors)
+        return sketch
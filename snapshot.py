@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+from datetime import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs
+import pyarrow.parquet as pq
+from analyze_lands import STREAM_CHUNK_SIZE, STREAM_FIELDS, clean_listings, iter_raw_chunks
+from instrumentation import metrics
+
+DEFAULT_DIRECTORY = "snapshot"
+
+# Cleaned, typed listings. A listing whose price or size does not parse is kept
+# with null metrics, so it replaces an older valid row of the same listing.
+SCHEMA = pa.schema(
+    [
+        ("_id", pa.string()),
+        ("location", pa.dictionary(pa.int32(), pa.string())),
+        ("price_numeric", pa.float64()),
+        ("size_numeric", pa.float64()),
+        ("price_per_sqm", pa.float64()),
+        ("updated_at", pa.timestamp("ms")),
+    ]
+)
+METRIC_COLUMNS = ("price_numeric", "size_numeric", "price_per_sqm")
+
+# Every export adds a batch, past this many they are compacted into one
+MAX_BATCHES = 20
+
+# Files starting with _ are skipped by pyarrow's dataset discovery
+STATE_FILE = "_snapshot.json"
+BATCH = re.compile(r"batch=(\d+)$")
+
+
+def _batches(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        int(match.group(1)) for match in map(BATCH.match, os.listdir(directory)) if match
+    )
+
+
+def _read_state(directory):
+    path = os.path.join(directory, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_state(directory, state):
+    path = os.path.join(directory, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def snapshot_table(raw):
+    cleaned = clean_listings(raw).set_index("_id")
+    frame = pd.DataFrame(
+        {
+            "_id": raw["_id"].astype(str),
+            "location": raw["location"],
+            "updated_at": pd.to_datetime(raw["updated_at"]),
+        }
+    )
+    for column in METRIC_COLUMNS:
+        frame[column] = raw["_id"].map(cleaned[column]).astype("float64").to_numpy()
+    return pa.Table.from_pandas(frame, schema=SCHEMA, preserve_index=False, safe=False)
+
+
+# Append the listings changed since the last export as a new batch=N partition,
+# none is added when nothing changed. The first export (or one after the state
+# file was removed) writes everything.
+def export_snapshot(collection, directory=DEFAULT_DIRECTORY, chunk_size=STREAM_CHUNK_SIZE):
+    os.makedirs(directory, exist_ok=True)
+    state = _read_state(directory)
+    query = {}
+    if state.get("watermark"):
+        # $gte like update_location_stats, a listing exported twice is deduplicated on read
+        query = {"updated_at": {"$gte": datetime.fromisoformat(state["watermark"])}}
+    batch = max(_batches(directory), default=0) + 1
+    path = os.path.join(directory, f"batch={batch:05d}", "part-0.parquet")
+
+    watermark = pd.Timestamp(state["watermark"]) if state.get("watermark") else None
+    previous = watermark
+    # Listings at the watermark that are already exported, $gte finds them again
+    at_watermark = set(state.get("at_watermark", []))
+    exported = set(at_watermark)
+    writer = None
+    rows = 0
+    fields = STREAM_FIELDS + ("updated_at",)
+    with metrics.span("snapshot_export"):
+        for raw in iter_raw_chunks(collection, chunk_size, fields, query, sort=[("updated_at", 1)]):
+            updated = pd.to_datetime(raw["updated_at"])
+            ids = raw["_id"].astype(str)
+            if exported:
+                keep = ~((updated == previous) & ids.isin(exported)).to_numpy()
+                raw, updated, ids = raw[keep], updated[keep], ids[keep]
+                if raw.empty:
+                    continue
+            table = snapshot_table(raw)
+            if writer is None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                writer = pq.ParquetWriter(path, SCHEMA, compression="zstd")
+            writer.write_table(table)
+            rows += len(table)
+            latest = updated.max()
+            if pd.isna(latest):
+                continue
+            if watermark is None or latest > watermark:
+                watermark = latest
+                at_watermark = set()
+            at_watermark.update(ids[updated == watermark])
+        if writer is not None:
+            writer.close()
+
+    # The state goes last, a crash before it only means the batch is exported again
+    _write_state(
+        directory,
+        {
+            "watermark": watermark.isoformat() if watermark is not None else None,
+            "at_watermark": sorted(at_watermark),
+            "exported_at": time.time(),
+        },
+    )
+    metrics.count("snapshot_rows", rows)
+    print(f"Exported {rows} changed listings to {directory}" + (f" batch {batch}" if rows else ""))
+    if len(_batches(directory)) > MAX_BATCHES:
+        compact_snapshot(directory)
+    return rows
+
+
+def _dataset(directory, memory_map=True):
+    return ds.dataset(
+        directory,
+        format="parquet",
+        partitioning="hive",
+        filesystem=pyarrow.fs.LocalFileSystem(use_mmap=memory_map),
+    )
+
+
+# Listings from the snapshot with only the given columns read from disk. When a
+# listing was exported in several batches the latest row wins, and rows with
+# null metrics are dropped. Locations come back as a pandas categorical.
+def load_snapshot(
+    directory=DEFAULT_DIRECTORY,
+    columns=("location", "price_per_sqm"),
+    memory_map=True,
+):
+    batches = _batches(directory)
+    if not batches:
+        raise FileNotFoundError(f"No snapshot in {directory}, run snapshot.py export first")
+    read = [*columns, "price_per_sqm"]
+    if len(batches) > 1:
+        read += ["_id", "batch"]
+    with metrics.span("snapshot_load"):
+        table = _dataset(directory, memory_map).to_table(columns=list(dict.fromkeys(read)))
+        df = table.to_pandas()
+        if len(batches) > 1:
+            df = df.sort_values("batch", kind="stable").drop_duplicates("_id", keep="last")
+        df = df[df["price_per_sqm"].notna()]
+        if "location" in df:
+            df["location"] = df["location"].cat.remove_unused_categories()
+    return df[list(columns)].reset_index(drop=True)
+
+
+# Rewrite all batches as one deduplicated batch. The compacted batch is added
+# before the old ones go, a reader in between sees duplicates it drops anyway.
+def compact_snapshot(directory=DEFAULT_DIRECTORY):
+    batches = _batches(directory)
+    if len(batches) < 2:
+        return
+    df = load_snapshot(directory, columns=[field.name for field in SCHEMA], memory_map=False)
+    table = pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False, safe=False)
+    staging = os.path.join(directory, "_compacted")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    pq.write_table(table, os.path.join(staging, "part-0.parquet"), compression="zstd")
+    os.replace(staging, os.path.join(directory, f"batch={batches[-1] + 1:05d}"))
+    for batch in batches:
+        shutil.rmtree(os.path.join(directory, f"batch={batch:05d}"))
+    print(f"Compacted {len(batches)} batches into {len(table)} listings")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export listings to a Parquet snapshot")
+    parser.add_argument("command", choices=("export", "compact"))
+    parser.add_argument("--directory", default=DEFAULT_DIRECTORY)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        from connector import get_collection
+
+        export_snapshot(get_collection(), args.directory)
+    else:
+        compact_snapshot(args.directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import bisect
+import functools
+import hashlib
+import threading
+import time
+from collections import deque
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError, OperationFailure, PyMongoError
+from instrumentation import metrics
+
+# Server error codes of write errors that are worth retrying
+TRANSIENT_ERROR_CODES = {
+    6,  # HostUnreachable
+    7,  # HostNotFound
+    89,  # NetworkTimeout
+    91,  # ShutdownInProgress
+    189,  # PrimarySteppedDown
+    262,  # ExceededTimeLimit
+    9001,  # SocketException
+    10107,  # NotWritablePrimary
+    11600,  # InterruptedAtShutdown
+    11602,  # InterruptedDueToReplStateChange
+    13435,  # NotPrimaryNoSecondaryOk
+}
+
+# Fields that identify a version of a listing, a change in any of them is an update
+FINGERPRINT_FIELDS = ("title", "location", "price", "size")
+
+
+def listing_fingerprint(data):
+    values = [" ".join(str(data.get(field) or "").split()).lower() for field in FINGERPRINT_FIELDS]
+    return hashlib.sha1("\x1f".join(values).encode("utf-8")).hexdigest()
+
+
+def listing_filter(data):
+    if data.get("url"):
+        return {"url": data["url"]}
+    return {"fingerprint": listing_fingerprint(data)}
+
+
+def ensure_indexes(collection):
+    try:
+        collection.create_index(
+            "url",
+            unique=True,
+            name="url_unique",
+            partialFilterExpression={"url": {"$type": "string"}},
+        )
+    except OperationFailure as e:
+        print(f"Could not create the unique url index, remove duplicate listings first: {e}")
+    collection.create_index("fingerprint", name="fingerprint")
+    collection.create_index("updated_at", name="updated_at")
+
+
+# True if this listing, found by its URL, is stored with the same fingerprint. A
+# listing without a URL is never unchanged, other plots may share its fields.
+def is_unchanged(collection, data):
+    if not data.get("url"):
+        return False
+    query = {"url": data["url"], "fingerprint": listing_fingerprint(data)}
+    return collection.find_one(query, {"_id": 1}) is not None
+
+
+# Filter and update pipeline of a listing upsert, the previous price is appended
+# to price_history when it changed
+def upsert_update(data):
+    fingerprint = listing_fingerprint(data)
+    price = {"$literal": data.get("price")}
+    fields = {key: {"$literal": value} for key, value in data.items() if key != "_id"}
+    pipeline = [
+        {
+            "$set": {
+                "price_history": {
+                    "$cond": [
+                        {"$and": [{"$gt": ["$price", None]}, {"$ne": ["$price", price]}]},
+                        {
+                            "$concatArrays": [
+                                {"$ifNull": ["$price_history", []]},
+                                [{"price": "$price", "date": "$date", "seen_at": "$updated_at"}],
+                            ]
+                        },
+                        {"$ifNull": ["$price_history", []]},
+                    ]
+                },
+                "first_seen": {"$ifNull": ["$first_seen", "$$NOW"]},
+                "updated_at": {
+                    "$cond": [{"$ne": ["$fingerprint", fingerprint]}, "$$NOW", "$updated_at"]
+                },
+                "last_seen": "$$NOW",
+                "fingerprint": fingerprint,
+                **fields,
+            }
+        }
+    ]
+    return listing_filter(data), pipeline
+
+
+def upsert_operation(data):
+    return UpdateOne(*upsert_update(data), upsert=True)
+
+
+def upsert_listing(collection, data):
+    return collection.update_one(*upsert_update(data), upsert=True)
+
+
+# Buffers write operations and flushes them as unordered bulk writes by size or time
+class BufferedWriter:
+    def __init__(
+        self,
+        collection,
+        batch_size=500,
+        flush_interval=5.0,
+        max_buffer=5000,
+        max_retries=5,
+        retry_delay=0.5,
+    ):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        # Operations are numbered as they are added, the buffer holds (seq, operation)
+        self.buffer = []
+        self.callbacks = []
+        self.added = 0
+        self.written = 0
+        self.failed = 0
+        # Sequence numbers of dropped writes not yet reported to an after_flush range
+        self.failed_seqs = []
+        # First sequence number of the next after_flush range, exclusive
+        self.mark = 0
+        self.flushes = 0
+        self.flush_latencies = deque(maxlen=1000)
+        self.started = time.monotonic()
+
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._flush_periodically, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, data):
+        self.write(upsert_operation(data))
+
+    # Queue an operation, blocks while the buffer is full so memory stays bounded
+    def write(self, operation):
+        with self.condition:
+            while len(self.buffer) >= self.max_buffer:
+                self.condition.wait()
+            self.added += 1
+            self.buffer.append((self.added, operation))
+            full = len(self.buffer) >= self.batch_size
+        if full:
+            self.flush(self.batch_size)
+
+    # Once the operations added since the previous after_flush call are flushed, run
+    # callback if all of them reached the database. Otherwise run on_failure with the
+    # number of dropped writes, or nothing without one.
+    def after_flush(self, callback, on_failure=None):
+        with self.condition:
+            entry = (self.mark, self.added, callback, on_failure)
+            self.mark = self.added
+            if self.written + self.failed >= self.added:
+                ready = [self._resolve(*entry)]
+            else:
+                self.callbacks.append(entry)
+                ready = []
+        self._run(ready)
+
+    # The call to make for a finished range (start, end], under self.condition
+    def _resolve(self, start, end, callback, on_failure):
+        low = bisect.bisect_right(self.failed_seqs, start)
+        high = bisect.bisect_right(self.failed_seqs, end)
+        failed = high - low
+        # Ranges finish in order, later ones start after end
+        del self.failed_seqs[:high]
+        if not failed:
+            return callback
+        print(f"{failed} of {end - start} writes failed, skipping their checkpoint")
+        return functools.partial(on_failure, failed) if on_failure else None
+
+    def _run(self, ready):
+        for callback in ready:
+            if callback is not None:
+                callback()
+
+    def flush(self, min_size=1):
+        with self.flush_lock:
+            while True:
+                with self.condition:
+                    if len(self.buffer) < min_size:
+                        return
+                    batch = self.buffer[: self.batch_size]
+                    del self.buffer[: self.batch_size]
+                    self.condition.notify_all()
+                with metrics.span("db_write"):
+                    self._write_batch(batch)
+
+    def close(self):
+        self.closed.set()
+        self.thread.join()
+        self.flush()
+        print(f"Writer: {self.report()}")
+
+    def report(self):
+        latencies = sorted(self.flush_latencies)
+        elapsed = time.monotonic() - self.started
+
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0.0
+
+        return {
+            "documents": self.written,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "docs_per_sec": self.written / elapsed if elapsed else 0.0,
+            "flush_p50_ms": percentile(0.5) * 1000,
+            "flush_p95_ms": percentile(0.95) * 1000,
+            "flush_max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+        }
+
+    def _flush_periodically(self):
+        while not self.closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Background flush failed: {e}")
+
+    def _write_batch(self, batch):
+        start = time.monotonic()
+        pending = batch
+        failed = []
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.collection.bulk_write([operation for _, operation in pending], ordered=False)
+                pending = []
+                break
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                retry = [
+                    pending[error["index"]]
+                    for error in errors
+                    if error.get("code") in TRANSIENT_ERROR_CODES
+                ]
+                for error in errors:
+                    if error.get("code") not in TRANSIENT_ERROR_CODES:
+                        print(f"Dropping write: {error.get('errmsg')}")
+                        failed.append(pending[error["index"]][0])
+                pending = retry
+                if not pending:
+                    break
+            except PyMongoError as e:
+                if not isinstance(e, AutoReconnect) and not e.has_error_label(
+                    "RetryableWriteError"
+                ):
+                    print(f"Bulk write failed: {e}")
+                    failed.extend(seq for seq, _ in pending)
+                    pending = []
+                    break
+                print(f"Transient error on bulk write, attempt {attempt + 1}: {e}")
+            if pending and attempt < self.max_retries:
+                metrics.sleep(self.retry_delay * 2**attempt, "db_retry")
+        if pending:
+            print(f"Giving up on {len(pending)} writes after {self.max_retries} retries")
+            failed.extend(seq for seq, _ in pending)
+
+        metrics.count("db_documents_written", len(batch) - len(failed))
+        metrics.count("db_documents_failed", len(failed))
+        with self.condition:
+            self.written += len(batch) - len(failed)
+            self.failed += len(failed)
+            self.failed_seqs.extend(sorted(failed))
+            self.flushes += 1
+            self.flush_latencies.append(time.monotonic() - start)
+            done = self.written + self.failed
+            ready = [self._resolve(*entry) for entry in self.callbacks if entry[1] <= done]
+            self.callbacks = [entry for entry in self.callbacks if entry[1] > done]
+        self._run(ready)
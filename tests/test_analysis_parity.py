@@ -0,0 +1,141 @@
+# The aggregation pipeline (analyze_lands.py --mode pipeline) re-implements the
+# pandas parsing and categorization, these tests check both give the same results.
+# They need a MongoDB server at MONGO_URI (default localhost:27017) and are
+# skipped without one, mongomock does not evaluate the pipeline expressions.
+# The streaming mode only reads the listings and runs on mongomock.
+#
+#   python -m pytest tests
+import os
+import sys
+import uuid
+
+import pymongo
+import pytest
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyze_lands import (  # noqa: E402
+    analyze_in_memory,
+    analyze_with_pipeline,
+    check_parity,
+    clean_listings,
+    load_listings,
+)
+
+# Prices and sizes the way they show up in listings, including the ones the
+# parsers have to reject
+LISTINGS = [
+    # Plain dollar amounts and m² sizes
+    ("Салтівка", "12 000 $", "1000 м²"),
+    ("Салтівка", "$ 8 500", "850 м²"),
+    ("Салтівка", "25000$", "1200 м²"),
+    ("Центр", "40 000 $", "500 м²"),
+    # Currency conversion, signs and codes, thousands separators and decimals
+    ("Центр", "1.250.000 грн", "600 м²"),
+    ("Центр", "9 500,50 €", "120 м²"),
+    ("Олексіївка", "15000 EUR", "300 м2"),
+    ("Олексіївка", "USD 17 500", "410 m²"),
+    ("Олексіївка", "820 000 UAH", "1000 м²"),
+    ("Олексіївка", "1\xa0500\xa0000 ₴", "2500 м²"),
+    # Sizes in сотки and with decimal commas, only the leading number counts
+    ("Павлове Поле", "30 000 $", "10 сот."),
+    ("Павлове Поле", "18 000 $", "6 сот"),
+    ("Павлове Поле", "22 500 $", "12,5 м²"),
+    ("Павлове Поле", "19 999 $", "7.5 сот."),
+    # Unparseable prices and sizes, left out of every result
+    ("Салтівка", "Договірна", "900 м²"),
+    ("Центр", "10 000 $", "—"),
+    ("Центр", "", "100 м²"),
+    ("Центр", None, "100 м²"),
+    ("Олексіївка", "10 000 $", None),
+    ("Олексіївка", "10 000 $", "0 м²"),
+    # No location, counted in the thresholds and categories but in no location
+    (None, "14 000 $", "700 м²"),
+]
+PARSED = 15
+
+
+def insert_listings(collection, listings=LISTINGS):
+    collection.insert_many(
+        [
+            {"title": f"Ділянка {index}", "location": location, "price": price, "size": size}
+            for index, (location, price, size) in enumerate(listings)
+        ]
+    )
+    return collection
+
+
+@pytest.fixture(scope="module")
+def client():
+    client = pymongo.MongoClient(
+        os.getenv("MONGO_URI", "mongodb://localhost:27017/"), serverSelectionTimeoutMS=1000
+    )
+    try:
+        client.admin.command("ping")
+    except PyMongoError as e:
+        pytest.skip(f"No MongoDB server: {e}")
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def make_collection(client):
+    database = client[f"hesti_test_{uuid.uuid4().hex[:12]}"]
+
+    def make(listings=LISTINGS):
+        return insert_listings(database[f"land_listings_{uuid.uuid4().hex[:6]}"], listings)
+
+    yield make
+    client.drop_database(database.name)
+
+
+def test_pipeline_matches_pandas(make_collection):
+    assert check_parity(make_collection()) == []
+
+
+def test_unparseable_listings_are_left_out(make_collection):
+    collection = make_collection()
+    parsed = len(clean_listings(load_listings(collection)))
+    assert parsed == PARSED
+    pipeline = analyze_with_pipeline(collection, migrate=False)
+    assert sum(pipeline["categories"].values()) == parsed
+    assert pipeline["locations"]["count"].sum() == parsed - 1
+
+
+def test_migrated_categories_match(make_collection):
+    in_memory, pipeline = make_collection(), make_collection()
+    analyze_in_memory(in_memory)
+    analyze_with_pipeline(pipeline)
+    want = {doc["title"]: doc.get("category") for doc in in_memory.find()}
+    got = {doc["title"]: doc.get("category") for doc in pipeline.find()}
+    assert got == want
+    # Listings without a price per square meter get no category
+    assert sum(category is None for category in want.values()) == len(LISTINGS) - PARSED
+
+
+# Equal thresholds leave no Moderate category, values at a threshold are Cheap
+def test_equal_thresholds(make_collection):
+    listings = [("Центр", "10 000 $", "100 м²")] * 6 + [("Центр", "50 000 $", "100 м²")]
+    collection = make_collection(listings)
+    assert check_parity(collection) == []
+    categories = analyze_with_pipeline(collection, migrate=False)["categories"]
+    assert categories == {"Cheap": 6, "Expensive": 1}
+
+
+# The KLL sketch thresholds are within STREAM_RANK_TOLERANCE of the exact ones
+def test_stream_matches_pandas():
+    mongomock = pytest.importorskip("mongomock")
+    collection = insert_listings(mongomock.MongoClient().hesti_test.land_listings)
+    assert check_parity(collection, mode="stream") == []
+
+
+# Enough listings for the sketch to compact, the thresholds are no longer exact
+def test_stream_matches_pandas_past_sketch_size():
+    mongomock = pytest.importorskip("mongomock")
+    listings = [
+        (f"Район {index % 7}", f"{1000 + (index * 7919) % 50000} $", f"{100 + index % 900} м²")
+        for index in range(5000)
+    ]
+    collection = insert_listings(mongomock.MongoClient().hesti_test.land_listings, listings)
+    assert check_parity(collection, mode="stream") == []
@@ -0,0 +1,206 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Porter stemming matches "lots" to "lot". A query word like "R-1" is searched
+# as the phrase "r 1", which matches "R-1" and "R 1" but not "R-10".
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sections (
+    id INTEGER PRIMARY KEY,
+    jurisdiction TEXT NOT NULL,
+    link TEXT NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (jurisdiction, link)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS sections_fts USING fts5(
+    name, description, content='sections', content_rowid='id',
+    tokenize="porter unicode61"
+);
+CREATE TRIGGER IF NOT EXISTS sections_ai AFTER INSERT ON sections BEGIN
+    INSERT INTO sections_fts (rowid, name, description)
+    VALUES (new.id, new.name, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS sections_ad AFTER DELETE ON sections BEGIN
+    INSERT INTO sections_fts (sections_fts, rowid, name, description)
+    VALUES ('delete', old.id, old.name, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS sections_au AFTER UPDATE ON sections BEGIN
+    INSERT INTO sections_fts (sections_fts, rowid, name, description)
+    VALUES ('delete', old.id, old.name, old.description);
+    INSERT INTO sections_fts (rowid, name, description)
+    VALUES (new.id, new.name, new.description);
+END;
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+"""
+
+# bm25 weights of the name and description columns, a hit in the name counts more
+NAME_WEIGHT = 5.0
+DESCRIPTION_WEIGHT = 1.0
+
+QUERY_TERM = re.compile(r"[\w-]+")
+
+
+def section_hash(zone):
+    text = f"{zone.get('name') or ''}\x00{zone.get('description') or ''}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+# Every word of a free text query as a quoted FTS5 phrase, so "R-1" or "AND"
+# in a query are searched for instead of being parsed as syntax
+def match_expression(query, operator="AND"):
+    terms = [f'"{term}"' for term in QUERY_TERM.findall(query)]
+    return f" {operator} ".join(terms)
+
+
+# Persistent SQLite FTS5 index of zone and district sections of all jurisdictions
+class ZoneIndex:
+    def __init__(self, path="zones_index.sqlite3"):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # Bring one jurisdiction's sections up to date, only changed ones are reindexed
+    def update_jurisdiction(self, jurisdiction, zones):
+        now = time.time()
+        changed = 0
+        with self.lock, self.conn:
+            existing = {
+                row["link"]: row["content_hash"]
+                for row in self.conn.execute(
+                    "SELECT link, content_hash FROM sections WHERE jurisdiction = ?",
+                    (jurisdiction,),
+                )
+            }
+            seen = set()
+            for zone in zones:
+                link = zone.get("link") or zone.get("name")
+                content_hash = section_hash(zone)
+                seen.add(link)
+                if existing.get(link) == content_hash:
+                    continue
+                self.conn.execute(
+                    "INSERT INTO sections (jurisdiction, link, name, description, content_hash, "
+                    "updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (jurisdiction, link) DO UPDATE SET name = excluded.name, "
+                    "description = excluded.description, content_hash = excluded.content_hash, "
+                    "updated_at = excluded.updated_at",
+                    (
+                        jurisdiction,
+                        link,
+                        zone.get("name") or "",
+                        zone.get("description") or "",
+                        content_hash,
+                        now,
+                    ),
+                )
+                changed += 1
+            removed = [link for link in existing if link not in seen]
+            self.conn.executemany(
+                "DELETE FROM sections WHERE jurisdiction = ? AND link = ?",
+                [(jurisdiction, link) for link in removed],
+            )
+        return changed + len(removed)
+
+    # Index a zones.json file, skipped when the file did not change since the last sync
+    def sync_file(self, path="zones.json"):
+        stat = os.stat(path)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT mtime, size FROM sources WHERE path = ?", (os.path.abspath(path),)
+            ).fetchone()
+        if row is not None and (row["mtime"], row["size"]) == (stat.st_mtime, stat.st_size):
+            return 0
+
+        with open(path) as f:
+            all_zones = json.load(f)
+        changed = sum(
+            self.update_jurisdiction(jurisdiction, zones)
+            for jurisdiction, zones in all_zones.items()
+        )
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sources (path, mtime, size) VALUES (?, ?, ?)",
+                (os.path.abspath(path), stat.st_mtime, stat.st_size),
+            )
+        return changed
+
+    # Sections matching every word of query ranked by bm25, or any word when no
+    # section has them all. Snippets mark the matches with [ and ].
+    def search(self, query, limit=10, jurisdiction=None, snippet_tokens=16):
+        results = []
+        for operator in ("AND", "OR"):
+            expression = match_expression(query, operator)
+            if not expression:
+                return []
+            sql = (
+                "SELECT s.jurisdiction, s.name, s.link, "
+                f"bm25(sections_fts, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}) AS score, "
+                "snippet(sections_fts, -1, '[', ']', '...', ?) AS snippet "
+                "FROM sections_fts JOIN sections s ON s.id = sections_fts.rowid "
+                "WHERE sections_fts MATCH ?"
+            )
+            params = [snippet_tokens, expression]
+            if jurisdiction:
+                sql += " AND s.jurisdiction = ?"
+                params.append(jurisdiction)
+            sql += " ORDER BY score LIMIT ?"
+            params.append(limit)
+            with self.lock:
+                results = [dict(row) for row in self.conn.execute(sql, params)]
+            if results:
+                break
+        return results
+
+    def stats(self):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT jurisdiction) FROM sections"
+            ).fetchone()
+        return {"sections": row[0], "jurisdictions": row[1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the scraped zoning sections")
+    parser.add_argument("query")
+    parser.add_argument("--zones", default="zones.json", help="zones file to index first")
+    parser.add_argument("--index", default="zones_index.sqlite3")
+    parser.add_argument("--jurisdiction")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    index = ZoneIndex(args.index)
+    if os.path.exists(args.zones):
+        changed = index.sync_file(args.zones)
+        if changed:
+            print(f"Indexed {changed} changed sections from {args.zones}")
+
+    start = time.perf_counter()
+    results = index.search(args.query, args.limit, args.jurisdiction)
+    elapsed = time.perf_counter() - start
+    for result in results:
+        print(f"{result['score']:8.2f}  {result['name']}  ({result['jurisdiction']})")
+        print(f"          {result['link']}")
+        print(f"          {result['snippet']}")
+    print(f"{len(results)} results in {elapsed * 1000:.1f} ms, {index.stats()}")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()